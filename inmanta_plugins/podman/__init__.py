@@ -226,11 +226,9 @@ def container_rm(
     return " ".join(i for i in cmd if i is not None)
 
 
-@inmanta.plugins.plugin()
-def container_run(
-    container: typing.Annotated[
-        typing.Any, inmanta.plugins.ModelType["podman::Container"]
-    ],
+def container_command(
+    container: typing.Any,
+    subcommand: str,
     *,
     cidfile: str | None = None,
     cgroups: str | None = None,
@@ -238,11 +236,14 @@ def container_run(
     sdnotify: str | None = None,
     detach: bool = False,
     replace: bool = False,
-) -> str:
+) -> list[str]:
     """
-    Create the run command required to start the given container.
+    Create the run (or create) command for the given container, as a list of
+    arguments, up to the image of the container.  The image and the command of
+    the container should be appended by the caller.
 
     :param container: The container that should be started.
+    :param subcommand: The container subcommand to use (run|create)
     :param cidfile: Write the container ID to the file
     :param cgroups: control container cgroup configuration ("enabled"|"disabled"|"no-conmon"|"split")
     :param pod_id_file: Read the pod ID from the file
@@ -255,7 +256,7 @@ def container_run(
         *repeated("module", container.containers_conf_module),
         *container.global_args,
         "container",
-        "run",
+        subcommand,
         option("cidfile", cidfile),
         option("cgroups", cgroups or container.cgroups_mode),
         option("pod-id-file", pod_id_file),
@@ -281,7 +282,7 @@ def container_run(
         *repeated("dns", container.dns),
         *repeated("dns-search", container.dns_search),
         *repeated("dns-option", container.dns_option),
-        *{f"--label={k}={v}" for k, v in container.labels.items()},
+        *[f"--label={k}={v}" for k, v in container.labels.items()],
         (
             f"--label=io.containers.autoupdate={container.auto_update}"
             if container.auto_update is not None
@@ -308,7 +309,16 @@ def container_run(
         *repeated("ulimit", container.ulimit),
         option("log-driver", container.log_driver),
         *repeated("log-opt", container.log_opt),
-        option("pull", container.pull),
+        # The image of the container is deployed by its own resource, it should
+        # never be pulled when the container starts
+        option(
+            "pull",
+            (
+                "never"
+                if _optional(lambda: container.source_image) is not None
+                else container.pull
+            ),
+        ),
         flag("init", container.run_init),
         option("stop-signal", container.stop_signal),
         option("stop-timeout", container.stop_timeout),
@@ -349,12 +359,78 @@ def container_run(
         option("retry-delay", container.retry_delay),
         *extra_args("podman-run", container.extra_args),
         *container.podman_args,
+    ]
+    return [i for i in cmd if i is not None]
+
+
+@inmanta.plugins.plugin()
+def container_run(
+    container: typing.Annotated[
+        typing.Any, inmanta.plugins.ModelType["podman::Container"]
+    ],
+    *,
+    cidfile: str | None = None,
+    cgroups: str | None = None,
+    pod_id_file: str | None = None,
+    sdnotify: str | None = None,
+    detach: bool = False,
+    replace: bool = False,
+) -> str:
+    """
+    Create the run command required to start the given container.
+
+    :param container: The container that should be started.
+    :param cidfile: Write the container ID to the file
+    :param cgroups: control container cgroup configuration ("enabled"|"disabled"|"no-conmon"|"split")
+    :param pod_id_file: Read the pod ID from the file
+    :param sdnotify: control sd-notify behavior ("container"|"conmon"|"ignore")
+    :param detach: Run container in background and print container ID
+    :param replace: If a container with the same name exists, replace it
+    """
+    cmd: list[str | None] = [
+        *container_command(
+            container,
+            "run",
+            cidfile=cidfile,
+            cgroups=cgroups,
+            pod_id_file=pod_id_file,
+            sdnotify=sdnotify,
+            detach=detach,
+            replace=replace,
+        ),
         container.image,
         container.command,
     ]
     return " ".join(i for i in cmd if i is not None)
 
 
+@inmanta.plugins.plugin()
+def container_start(
+    container: typing.Annotated[
+        typing.Any, inmanta.plugins.ModelType["podman::Container"]
+    ],
+    *,
+    attach: bool = False,
+) -> str:
+    """
+    Create the start command required to start an existing container.
+
+    :param container: The container that should be started.
+    :param attach: Attach to the container, and wait for it to exit
+    """
+    cmd: list[str | None] = [
+        "/usr/bin/podman",
+        *repeated("module", container.containers_conf_module),
+        *container.global_args,
+        "container",
+        "start",
+        flag("attach", attach),
+        *extra_args("podman-start", container.extra_args),
+        container.name,
+    ]
+    return " ".join(i for i in cmd if i is not None)
+
+
 @inmanta.plugins.plugin()
 def container_stop(
     container: typing.Annotated[
@@ -542,3 +618,42 @@ def auto_update(
         option("tls-verify", auto_update.tls_verify),
     ]
     return " ".join(i for i in cmd if i is not None)
+
+
+@inmanta.plugins.plugin()
+def quadlet_option(
+    option: str,
+    quadlets: typing.Annotated[
+        list[typing.Any],
+        inmanta.plugins.ModelType["podman::services::QuadletObject[]"],
+    ],
+    kinds: list[str],
+) -> str:
+    """
+    Replace the name of the object at the start of the given option (the name
+    of a network or a volume, or the reference of an image) by the quadlet file
+    defining this object, if one of the given quadlets defines it.  Quadlet then
+    makes the unit using the option depend on the unit creating the object.
+
+    :param option: The option, as passed to the podman cli, starting with the
+        name of the object, and optionally followed by ":" and some options.
+    :param quadlets: The quadlets defining objects for the same owner.
+    :param kinds: The kinds of quadlet files (network, volume, image, build)
+        which can define the object.
+    """
+    for quadlet in quadlets:
+        kind = quadlet.quadlet_file.rsplit(".", 1)[-1]
+        if kind not in kinds:
+            continue
+
+        if option == quadlet.quadlet_name:
+            return quadlet.quadlet_file
+
+        # The reference of an image can contain a ":", only the options of
+        # networks and volumes can be suffixed with ":"
+        if kind in ["network", "volume"] and option.startswith(
+            quadlet.quadlet_name + ":"
+        ):
+            return quadlet.quadlet_file + option[len(quadlet.quadlet_name) :]
+
+    return option
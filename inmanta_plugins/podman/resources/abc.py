@@ -16,14 +16,72 @@ limitations under the License.
 Contact: edvgui@gmail.com
 """
 
+import collections.abc
+import contextlib
+import json
+import os
+import time
 import typing
 
+import inmanta_plugins.mitogen
 import inmanta_plugins.mitogen.abc
+import mitogen.core
+import mitogen.parent
+import mitogen.select
 
 import inmanta.agent.handler
 import inmanta.execute.proxy
 import inmanta.export
 import inmanta.resources
+import inmanta_plugins.podman.resources.cache
+import inmanta_podman
+
+# Interval, in seconds, between two progress reports of long running commands
+# (image builds and pulls), and amount of lines of their output which are
+# kept.  They can be configured using the corresponding environment variables,
+# on the agent.
+PROGRESS_INTERVAL_ENV_VAR = "INMANTA_PODMAN_PROGRESS_INTERVAL"
+PROGRESS_INTERVAL = float(os.getenv(PROGRESS_INTERVAL_ENV_VAR, "10"))
+OUTPUT_LINES_ENV_VAR = "INMANTA_PODMAN_OUTPUT_LINES"
+OUTPUT_LINES = int(os.getenv(OUTPUT_LINES_ENV_VAR, "100"))
+
+# Size, in bytes, of the chunks in which the agent transfers data between hosts
+# (i.e. image archives).  At most one chunk per transfer is held in memory by the
+# agent.  It can be configured using the INMANTA_PODMAN_CHUNK_SIZE environment
+# variable, on the agent.
+CHUNK_SIZE_ENV_VAR = "INMANTA_PODMAN_CHUNK_SIZE"
+CHUNK_SIZE = int(os.getenv(CHUNK_SIZE_ENV_VAR, str(1024 * 1024)))
+
+
+class LoggedProxy(inmanta_plugins.mitogen.Proxy):
+    """
+    View on a cached proxy, which logs its calls in its own logger (i.e. the
+    handler context of a resource).  The connection is the one of the cached
+    proxy, whose logger is never changed, so that views used by nested or
+    interleaved calls always log in the right place.
+    """
+
+    def __init__(
+        self,
+        proxy: inmanta_plugins.mitogen.Proxy,
+        logger: inmanta.agent.handler.LoggerABC,
+    ) -> None:
+        """
+        :param proxy: The cached proxy, owning the connection
+        :param logger: The logger in which the calls made with this view are logged
+        """
+        super().__init__(proxy.serialized_context, logger=logger)
+        self.proxy = proxy
+
+    @property
+    def context(self) -> mitogen.parent.Context:
+        return self.proxy.context
+
+    def connect(self, *, exists_ok: bool = False) -> mitogen.parent.Context:
+        return self.proxy.connect(exists_ok=exists_ok)
+
+    def disconnect(self, *, timeout: float = 10.0, best_effort: bool = False) -> None:
+        self.proxy.disconnect(timeout=timeout, best_effort=best_effort)
 
 
 class ResourceABC(
@@ -53,24 +111,240 @@ ABC = typing.TypeVar("ABC", bound=ResourceABC)
 
 
 class HandlerABC(inmanta_plugins.mitogen.abc.Handler[ABC]):
-    def whoami(self) -> str:
+    @inmanta.agent.handler.cache(
+        evict_after_creation=inmanta_plugins.podman.resources.cache.SNAPSHOT_TTL,
+    )
+    def get_snapshot(
+        self,
+        kind: str,
+        owner: str | None,
+        context_hash: str,
+        agent_name: str,
+    ) -> inmanta_plugins.podman.resources.cache.Snapshot:
+        """
+        Get the snapshot of all the podman objects of the given kind, owned by
+        the given user, on the host reached by the given context.  The snapshot
+        is shared by all the handlers of the agent.
+
+        :param kind: The kind of podman object in the snapshot (network, image, ...)
+        :param owner: The owner of the objects in the snapshot.
+        :param context_hash: The hash of the mitogen context used to reach the host.
+        :param agent_name: The name of the agent deploying the resources.
+        """
+        return inmanta_plugins.podman.resources.cache.Snapshot(kind)
+
+    def snapshot(
+        self,
+        resource: ABC,
+        kind: str,
+    ) -> inmanta_plugins.podman.resources.cache.Snapshot:
+        """
+        Get the snapshot of all the podman objects of the given kind, which
+        are on the same host and have the same owner as the given resource.
+
+        :param resource: The resource object used by the handler at runtime
+        :param kind: The kind of podman object in the snapshot (network, image, ...)
+        """
+        return self.get_snapshot(
+            kind,
+            resource.owner,
+            context_hash=inmanta_plugins.mitogen.context_hash(resource.via),
+            agent_name=resource.id.get_agent_name(),
+        )
+
+    def lookup(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        kind: str,
+        key: str,
+        load: typing.Callable[[], dict[str, dict]],
+    ) -> dict | None:
+        """
+        Lookup an object in the snapshot of the given kind, for the host and owner
+        of the resource.  Returns None if the object doesn't exist on the host.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param kind: The kind of podman object in the snapshot (network, image, ...)
+        :param key: The key of the object in the snapshot index
+        :param load: The function to call to (re)load the snapshot
+        """
+        snapshot = self.snapshot(resource, kind)
+        entry = snapshot.lookup(key, load)
+        ctx.debug(
+            "Lookup %(key)s in %(kind)s snapshot (hits=%(hits)d, misses=%(misses)d)",
+            key=key,
+            kind=kind,
+            hits=snapshot.hits,
+            misses=snapshot.misses,
+        )
+        return entry
+
+    @inmanta.agent.handler.cache(
+        evict_after_creation=inmanta_plugins.podman.resources.cache.HOST_FACTS_TTL,
+    )
+    def get_host_facts_cache(
+        self,
+        owner: str | None,
+        context_hash: str,
+        agent_name: str,
+    ) -> inmanta_plugins.podman.resources.cache.HostFactsCache:
+        """
+        Get the cache of the facts about the host reached by the given context,
+        as seen by the given owner.  The cache is shared by all the handlers of
+        the agent.
+
+        :param owner: The user for which the facts are gathered, None for the
+            user of the proxy.
+        :param context_hash: The hash of the mitogen context used to reach the host.
+        :param agent_name: The name of the agent deploying the resources.
+        """
+        return inmanta_plugins.podman.resources.cache.HostFactsCache()
+
+    def host_facts(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        as_owner: bool = True,
+    ) -> inmanta_plugins.podman.resources.cache.HostFacts:
+        """
+        Get the facts about the host on which the resource is being deployed.
+        The facts are gathered once, in a single call, and then cached.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param as_owner: Whether the facts should be gathered as the resource
+            owner, or as the user of the proxy.
+        """
+        owner = resource.owner if as_owner else None
+        facts_cache = self.get_host_facts_cache(
+            owner,
+            context_hash=inmanta_plugins.mitogen.context_hash(resource.via),
+            agent_name=resource.id.get_agent_name(),
+        )
+
+        def load() -> inmanta_plugins.podman.resources.cache.HostFacts:
+            if owner is None:
+                facts = self.host_proxy(resource).remote_call(
+                    inmanta_podman.host_facts, 5
+                )
+            else:
+                with self.owner_proxy(ctx, resource) as proxy:
+                    facts = proxy.remote_call(inmanta_podman.host_facts, 5)
+
+            return inmanta_plugins.podman.resources.cache.HostFacts.model_validate(
+                facts
+            )
+
+        return facts_cache.get(load)
+
+    def invalidate_host_facts(self, resource: ABC) -> None:
+        """
+        Forget the facts about the host on which the resource is being deployed,
+        for the resource owner.  They will be gathered again on next access.
+
+        :param resource: The resource object used by the handler at runtime
+        """
+        self.get_host_facts_cache(
+            resource.owner,
+            context_hash=inmanta_plugins.mitogen.context_hash(resource.via),
+            agent_name=resource.id.get_agent_name(),
+        ).invalidate()
+
+    def whoami(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+    ) -> str:
         """
         Check which user is currently executing the commands on the remote host.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
         """
-        # Cache the result of the call on the proxy session, as the same proxy
-        # will always bring us to the same user
-        if hasattr(self.proxy, "_whoami"):
-            return getattr(self.proxy, "_whoami")
+        return self.host_facts(ctx, resource, as_owner=False).user
 
-        stdout, stderr, ret = self.proxy.run("whoami", timeout=5)
-        if ret == 0:
-            setattr(self.proxy, "_whoami", stdout)
-            return stdout
+    def host_proxy(
+        self,
+        resource: ABC,
+    ) -> inmanta_plugins.mitogen.Proxy:
+        """
+        Get the proxy reaching the host of the resource, as the user of the proxy.
+        This is the proxy of the handler, unless the resource is a clone pointing
+        to another host (i.e. the build host of an image).
 
-        raise RuntimeError(
-            f"Failed to check current user: {stderr} (error code: {ret})"
+        :param resource: The resource object used by the handler at runtime
+        """
+        return self.get_proxy(
+            resource.via,
+            hash=inmanta_plugins.mitogen.context_hash(resource.via),
+            agent_name=resource.id.get_agent_name(),
         )
 
+    def get_owner_proxy(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+    ) -> inmanta_plugins.mitogen.Proxy:
+        """
+        Get a proxy that can be used to execute code on the host of the resource,
+        as the resource owner.  Each call made with the proxy is logged in the
+        handler context.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        """
+        # We always want to run the code as the resource owner.
+        # Case 1: The owner is not set on the resource, then the owner of the
+        #   resource is implicitly the user of the proxy, we can use the proxy
+        #   as is.
+        # Case 2: The owner is set and matches the user of the proxy, we can
+        #   use the proxy as is.
+        # Case 3: The owner is set and is different from the user of the proxy,
+        #   we use a dedicated sudo context, on top of the one of the proxy.  The
+        #   context is long-lived and cached, so we only pay for the sudo and
+        #   login shell once, not for every command.
+        if resource.owner is None or resource.owner == self.whoami(ctx, resource):
+            proxy = self.host_proxy(resource)
+        else:
+            serialized_context: dict[str, object] = {
+                "method_name": "sudo",
+                "username": resource.owner,
+                "login": True,
+                "via": resource.via,
+            }
+            if resource.via.get("python_path"):
+                # Use the same python interpreter as the one of the proxy
+                serialized_context["python_path"] = resource.via["python_path"]
+
+            proxy = self.get_proxy(
+                serialized_context,
+                hash=inmanta_plugins.mitogen.context_hash(serialized_context),
+                agent_name=resource.id.get_agent_name(),
+            )
+
+        # Log each call in the resource actions, without changing the logger
+        # of the cached proxy, which might be in use by another call
+        return LoggedProxy(proxy, ctx)
+
+    @contextlib.contextmanager
+    def owner_proxy(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+    ) -> collections.abc.Iterator[inmanta_plugins.mitogen.Proxy]:
+        """
+        Get a proxy that can be used to execute code on the host of the resource,
+        as the resource owner, see get_owner_proxy.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        """
+        yield self.get_owner_proxy(ctx, resource)
+
     def run_command(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
@@ -92,32 +366,299 @@ class HandlerABC(inmanta_plugins.mitogen.abc.Handler[ABC]):
         :param cwd: The directory in which the command should be executed
         :param env: Some environment variables to pass to the command
         """
-        # We always want to run the command as the resource owner.
-        # Case 1: The owner is not set on the resource, then the owner of the
-        #   resource is implicitly the user of the proxy, we can execute the
-        #   command as is.
-        # Case 2: The owner is set and matches the user of the proxy, we can
-        #   execute the command as is.
-        # Case 3: The owner is set and is different from the user of the proxy,
-        #   we have to use sudo to execute the command as the resource owner.
+        # Run the command on the host, as the resource owner
+        with self.owner_proxy(ctx, resource) as proxy:
+            stdout, stderr, return_code = proxy.run(
+                command[0],
+                command[1:],
+                env or None,
+                cwd,
+                timeout=timeout,
+            )
 
-        if resource.owner is None:
-            pass
-        elif resource.owner == self.whoami():
-            pass
-        else:
-            command = ["sudo", "--login", "-u", resource.owner, "--", *command]
-
-        # Run the command on the host
-        stdout, stderr, return_code = self.proxy.run(
-            command[0],
-            command[1:],
-            env or None,
-            cwd,
-            timeout=timeout,
+        return stdout, stderr, return_code
+
+    def stream_command(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        command: list[str],
+        timeout: int | None,
+        progress_timeout: int | None,
+    ) -> tuple[str, int]:
+        """
+        Execute a long running command on the host targeted by the agent, and
+        report its progress in the handler context while it runs.  Return the
+        last lines of its output (stdout and stderr merged) and its return code.
+        Raise a RuntimeError if the command didn't make any progress for longer
+        than the progress timeout.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param command: The command to run on the host
+        :param timeout: The maximum duration the command can take to run
+        :param progress_timeout: The maximum duration the command can run
+            without printing anything
+        """
+        result: object = None
+        with self.owner_proxy(ctx, resource) as proxy:
+            progress = mitogen.core.Receiver(proxy.context.router)
+            try:
+                call = proxy.context.call_async(
+                    inmanta_podman.stream,
+                    command[0],
+                    command[1:],
+                    progress.to_sender(),
+                    timeout=timeout,
+                    progress_timeout=progress_timeout,
+                    progress_interval=PROGRESS_INTERVAL,
+                    max_lines=OUTPUT_LINES,
+                )
+                with mitogen.select.Select([progress, call], oneshot=False) as select:
+                    for msg in select:
+                        if msg.receiver is call:
+                            result = msg.unpickle()
+                            break
+
+                        ctx.info(
+                            "%(command)s: %(progress)s",
+                            command=" ".join(command[:3]),
+                            progress=msg.unpickle(),
+                        )
+            except mitogen.core.CallError as e:
+                # Translate to the same exception as the proxy, to not expose
+                # mitogen to the caller
+                raise inmanta_plugins.mitogen.RemoteException(e)
+            finally:
+                progress.close()
+
+        match result:
+            case {
+                "output": str() as output,
+                "returncode": int() as returncode,
+                "stalled": bool() as stalled,
+            }:
+                pass
+            case _:
+                raise inmanta_plugins.mitogen.RemoteException(
+                    ValueError(f"Received invalid result from stream command: {result}")
+                )
+
+        if stalled:
+            ctx.error("%(output)s", output=output)
+            raise RuntimeError(
+                f"Command {command} didn't make any progress for {progress_timeout} seconds"
+            )
+
+        return output, returncode
+
+    def call_chunk(
+        self,
+        proxy: inmanta_plugins.mitogen.Proxy,
+        function: collections.abc.Callable[..., object],
+        *args: object,
+        timeout: int | None,
+    ) -> typing.Any:
+        """
+        Call a function transferring a chunk of data on the remote host.  Contrary
+        to the remote_call method of the proxy, the call is not logged, as a
+        transfer is made of many of them.  Raise a RuntimeError if the call takes
+        longer than the timeout.
+
+        :param proxy: The proxy to the context in which the function should be called
+        :param function: The function to call
+        :param args: The arguments of the function
+        :param timeout: The maximum duration the call can take
+        """
+        try:
+            return proxy.context.call_async(function, *args).get(timeout).unpickle()
+        except mitogen.core.CallError as e:
+            # Translate to the same exception as the proxy, to not expose
+            # mitogen to the caller
+            raise inmanta_plugins.mitogen.RemoteException(e)
+        except mitogen.core.TimeoutError:
+            raise RuntimeError(
+                f"Transfer didn't make any progress for {timeout} seconds"
+            )
+
+    def read_command_output(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        command: list[str],
+        progress_timeout: int | None,
+    ) -> collections.abc.Iterator[bytes]:
+        """
+        Execute a command on the host of the resource, and yield its output
+        (stdout) in chunks, as it is consumed.  Raise a RuntimeError once the
+        output is exhausted if the command failed.  When the iteration is
+        aborted, the command is killed.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param command: The command to run on the host
+        :param progress_timeout: The maximum duration the command can take to
+            produce a chunk of output
+        """
+        # The generator is suspended while the chunks are consumed, possibly
+        # by calls made for another owner, its proxy is only used by itself
+        proxy = self.get_owner_proxy(ctx, resource)
+        pid = proxy.remote_call(
+            inmanta_podman.open_process, command[0], command[1:], "r"
         )
+        try:
+            while chunk := self.call_chunk(
+                proxy,
+                inmanta_podman.read_process,
+                pid,
+                CHUNK_SIZE,
+                timeout=progress_timeout,
+            ):
+                yield chunk
+        except BaseException:
+            proxy.remote_call(inmanta_podman.close_process, pid, 5, True)
+            raise
 
-        return stdout, stderr, return_code
+        result = proxy.remote_call(inmanta_podman.close_process, pid, progress_timeout)
+
+        match result:
+            case {"returncode": 0}:
+                pass
+            case {"returncode": int() as returncode, "stderr": str() as stderr}:
+                ctx.error("%(stderr)s", exit_code=returncode, stderr=stderr)
+                raise RuntimeError(f"Command {command} failed")
+            case _:
+                raise inmanta_plugins.mitogen.RemoteException(
+                    ValueError(f"Received invalid result from command: {result}")
+                )
+
+    def write_command_input(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        command: list[str],
+        chunks: collections.abc.Iterable[bytes],
+        timeout: int | None,
+        progress_timeout: int | None,
+    ) -> tuple[str, int]:
+        """
+        Execute a command on the host of the resource, write the given chunks
+        to its input (stdin), and report the progress of the transfer in the
+        handler context.  Return the last lines of its stderr and its return code.
+        Raise a RuntimeError if the transfer takes longer than the timeout, or
+        doesn't make any progress for longer than the progress timeout.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param command: The command to run on the host
+        :param chunks: The data to write to the input of the command, it can be
+            produced lazily (i.e. by read_command_output)
+        :param timeout: The maximum duration the transfer can take
+        :param progress_timeout: The maximum duration the command can take to
+            consume a chunk of input
+        """
+        proxy = self.get_owner_proxy(ctx, resource)
+        pid = proxy.remote_call(
+            inmanta_podman.open_process, command[0], command[1:], "w"
+        )
+        try:
+            transferred = 0
+            start = last_report = time.monotonic()
+            for chunk in chunks:
+                self.call_chunk(
+                    proxy,
+                    inmanta_podman.write_process,
+                    pid,
+                    chunk,
+                    timeout=progress_timeout,
+                )
+                transferred += len(chunk)
+
+                now = time.monotonic()
+                if timeout is not None and now - start > timeout:
+                    raise RuntimeError(
+                        f"Command {command} took more than {timeout} seconds"
+                    )
+
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    ctx.info(
+                        "%(command)s: %(progress)s",
+                        command=" ".join(command[:3]),
+                        progress={
+                            "bytes": transferred,
+                            "elapsed": int(now - start),
+                        },
+                    )
+        except BaseException:
+            proxy.remote_call(inmanta_podman.close_process, pid, 5, True)
+            raise
+
+        result = proxy.remote_call(inmanta_podman.close_process, pid, progress_timeout)
+
+        match result:
+            case {"returncode": int() as returncode, "stderr": str() as stderr}:
+                return stderr, returncode
+            case _:
+                raise inmanta_plugins.mitogen.RemoteException(
+                    ValueError(f"Received invalid result from command: {result}")
+                )
+
+    def api_request(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ABC,
+        *,
+        method: str,
+        path: str,
+        body: object | None = None,
+        stream: bool = False,
+        timeout: int | None,
+    ) -> tuple[int, typing.Any] | None:
+        """
+        Send a request to the libpod REST api of the resource owner, on the host
+        targeted by the agent, and return the status code and the decoded body of
+        the response.  The request goes over the unix socket of the podman
+        service (`podman system service`), using a persistent connection kept in
+        the mitogen context.  Return None if the socket is not available, in which
+        case the caller should fall back to the podman cli.
+
+        :param ctx: The handler context object used by the handler at runtime
+        :param resource: The resource object used by the handler at runtime
+        :param method: The http method of the request
+        :param path: The path of the endpoint, relative to the libpod api root
+        :param body: The body of the request, it will be serialized to json
+        :param stream: Whether the response is a stream of json objects, one per
+            line, in which case the decoded body is the list of these objects
+        :param timeout: The maximum duration the request can take
+        """
+        # Send the request from a context running as the resource owner, to
+        # reach the podman service of the owner
+        with self.owner_proxy(ctx, resource) as proxy:
+            response = proxy.remote_call(
+                inmanta_podman.api_request,
+                method,
+                path,
+                json.dumps(body) if body is not None else None,
+                timeout,
+            )
+        if response is None:
+            ctx.debug(
+                "Libpod api socket of %(owner)s is not available, falling back to the podman cli",
+                owner=resource.owner,
+            )
+            return None
+
+        status, content = typing.cast(tuple[int, str], response)
+        if stream:
+            return status, [
+                json.loads(line) for line in content.splitlines() if line.strip()
+            ]
+
+        return status, json.loads(content) if content else None
 
     def get_platform(
         self,
@@ -127,17 +668,12 @@ class HandlerABC(inmanta_plugins.mitogen.abc.Handler[ABC]):
         """
         Check the os and architecture of the host on which the resource is being deployed.
         """
-        # Run the info command on the remote host
-        command = ["podman", "info", "--format", "{{.Host.OS}}/{{.Host.Arch}}"]
-        stdout, stderr, ret = self.run_command(
-            ctx,
-            resource,
-            command=command,
-            timeout=5,
-        )
-        platform_string = stdout.strip()
-        if "/" not in platform_string:
-            raise ValueError(f"Unexpected output format: {platform_string}")
+        facts = self.host_facts(ctx, resource)
+        if facts.os is None or facts.arch is None:
+            # Podman could not be queried, make sure we try again next time
+            self.invalidate_host_facts(resource)
+            raise RuntimeError(
+                "Failed to get the platform of the host from podman info"
+            )
 
-        target_os, target_arch = platform_string.split("/", 1)
-        return target_os.lower(), target_arch.lower()
+        return facts.os.lower(), facts.arch.lower()
@@ -0,0 +1,240 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import collections.abc
+import os
+import threading
+import time
+
+import pydantic
+
+# Duration, in seconds, during which a snapshot of the podman objects on a host
+# can be used to answer the read requests of the handlers.  This should be long
+# enough to cover a burst of resource deployments for an agent (one deploy cycle)
+# and short enough to not hide changes made outside of the orchestrator.
+SNAPSHOT_TTL = 30
+
+# Duration, in seconds, during which the facts gathered about a host can be
+# reused by the handlers.  These facts (user, platform, podman version and config)
+# rarely change, so they can be kept for a long time.  It can be configured
+# using the INMANTA_PODMAN_HOST_FACTS_TTL environment variable, on the agent.
+HOST_FACTS_TTL_ENV_VAR = "INMANTA_PODMAN_HOST_FACTS_TTL"
+HOST_FACTS_TTL = int(os.getenv(HOST_FACTS_TTL_ENV_VAR, "600"))
+
+# Duration, in seconds, during which a manifest resolved from a registry can be
+# reused, for any host deploying the same image.  Lookups that didn't find any
+# manifest are kept for a shorter duration.  Both can be configured using the
+# corresponding environment variables, on the agent.
+MANIFEST_TTL_ENV_VAR = "INMANTA_PODMAN_MANIFEST_TTL"
+MANIFEST_TTL = int(os.getenv(MANIFEST_TTL_ENV_VAR, "300"))
+MANIFEST_NEGATIVE_TTL_ENV_VAR = "INMANTA_PODMAN_MANIFEST_NEGATIVE_TTL"
+MANIFEST_NEGATIVE_TTL = int(os.getenv(MANIFEST_NEGATIVE_TTL_ENV_VAR, "60"))
+
+
+class Snapshot:
+    """
+    Indexed, in-memory copy of the output of a bulk podman listing command
+    (i.e. `podman network ls`, `podman image ls`).  A single snapshot is
+    shared by all the handlers reading objects of the same kind, owned by the
+    same user, on the same host.  This allows to replace one inspect command
+    per resource by one listing command for all the resources.
+
+    The snapshot is loaded lazily, on the first lookup.  When a handler modifies
+    an object on the host, it should invalidate the corresponding key, the next
+    lookup for this key will then reload the snapshot.
+    """
+
+    def __init__(self, kind: str) -> None:
+        """
+        :param kind: The kind of object contained in this snapshot, only
+            used for logging purposes.
+        """
+        self.kind = kind
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] | None = None
+        self._stale: set[str] = set()
+
+    def lookup(
+        self,
+        key: str,
+        load: collections.abc.Callable[[], dict[str, dict]],
+    ) -> dict | None:
+        """
+        Get the object indexed with the given key from the snapshot, or None
+        if the object doesn't exist.  If the snapshot has not been loaded yet,
+        or if the key has been invalidated, the snapshot is (re)loaded using the
+        load function.
+
+        :param key: The key identifying the object in the snapshot.
+        :param load: A function returning the full index of the snapshot.
+        """
+        with self._lock:
+            if self._entries is None or key in self._stale:
+                self.misses += 1
+                self._entries = load()
+                self._stale.clear()
+            else:
+                self.hits += 1
+
+            return self._entries.get(key)
+
+    def invalidate(self, *keys: str) -> None:
+        """
+        Mark the given keys as stale, the next lookup for any of them will
+        reload the snapshot.  When no key is provided, the full snapshot is
+        discarded.
+
+        :param keys: The keys of the objects that have been modified.
+        """
+        with self._lock:
+            if keys:
+                self._stale.update(keys)
+            else:
+                self._entries = None
+                self._stale.clear()
+
+
+class HostFacts(pydantic.BaseModel):
+    """
+    Facts about a host, as seen by a user on that host.  The podman related
+    facts are None when podman could not be queried.  The registry auth file
+    is None when the user relies on the default one.
+    """
+
+    user: str
+    os: str | None
+    arch: str | None
+    podman_version: str | None
+    storage_driver: str | None
+    network_backend: str | None
+    registry_auth_file: str | None = None
+
+
+class HostFactsCache:
+    """
+    Lazily loaded host facts, shared by all the handlers of an agent.  The
+    facts are loaded on first access, and can be invalidated to force the
+    next access to load them again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._facts: HostFacts | None = None
+
+    def get(self, load: collections.abc.Callable[[], HostFacts]) -> HostFacts:
+        """
+        Get the facts, load them using the given function if they are
+        not known yet.
+
+        :param load: A function gathering the facts from the host.
+        """
+        with self._lock:
+            if self._facts is None:
+                self._facts = load()
+
+            return self._facts
+
+    def invalidate(self) -> None:
+        """
+        Forget the facts, they will be loaded again on the next access.
+        """
+        with self._lock:
+            self._facts = None
+
+
+class ManifestCache:
+    """
+    Cache of the image manifests resolved from the registries, shared by all
+    the agents running in the same process.  When the same image is tracked
+    on many hosts, the registry is only queried once per ttl.
+
+    Concurrent lookups of the same key are coalesced: the first caller resolves
+    the manifest while the other ones wait for its result.  Lookups that didn't
+    find any manifest are cached as well (negative caching), for a shorter
+    duration.  Any other failure is not cached.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float) -> None:
+        """
+        :param ttl: The duration, in seconds, during which a manifest can be reused.
+        :param negative_ttl: The duration, in seconds, during which a failed lookup
+            can be reused.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, ...], tuple[float, dict | None]] = {}
+        self._in_flight: dict[tuple[str, ...], threading.Event] = {}
+
+    def get(
+        self,
+        key: tuple[str, ...],
+        load: collections.abc.Callable[[], dict],
+    ) -> dict:
+        """
+        Get the manifest identified by the given key, resolve it using the load
+        function if it is not in the cache.  Raise a LookupError if the manifest
+        doesn't exist.
+
+        :param key: The key identifying the manifest (image reference, platform, ...)
+        :param load: A function resolving the manifest, it should raise a LookupError
+            if the manifest doesn't exist.
+        """
+        while True:
+            with self._lock:
+                match self._entries.get(key):
+                    case (float() as expiry, manifest) if expiry > time.monotonic():
+                        self.hits += 1
+                        if manifest is None:
+                            raise LookupError(f"No manifest found for {key} (cached)")
+                        return manifest
+                    case _:
+                        pass
+
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    # Nobody is resolving this manifest, we do it
+                    self.misses += 1
+                    self._in_flight[key] = threading.Event()
+                    break
+
+            # Somebody else is already resolving this manifest, wait for it to
+            # be done and check the cache again
+            in_flight.wait()
+
+        try:
+            manifest = load()
+        except LookupError:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.negative_ttl, None)
+            raise
+        else:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, manifest)
+            return manifest
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+
+# Single manifest cache instance, shared by all the handlers in the process
+MANIFESTS = ManifestCache(MANIFEST_TTL, MANIFEST_NEGATIVE_TTL)
@@ -0,0 +1,749 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import hashlib
+import json
+import os
+import re
+import shlex
+
+import inmanta.agent.handler
+import inmanta.execute.proxy
+import inmanta.export
+import inmanta.resources
+import inmanta_plugins.podman
+import inmanta_plugins.podman.resources.abc
+import inmanta_plugins.podman.resources.image
+
+# Label set on the containers created by the Container handler, holding the
+# hash of the config the container has been created with
+CONFIG_LABEL = "io.inmanta.podman.config"
+
+# The fields of the Container resource which can only be changed by re-creating
+# the container
+RECREATE_FIELDS = {"config_hash", "projection_hash", "image_id"}
+
+
+def persistent_service(
+    entity: inmanta.execute.proxy.DynamicProxy,
+) -> inmanta.execute.proxy.DynamicProxy | None:
+    """
+    Get the service running the given container, if the container is persistent,
+    i.e. created by its own resource, and only started and stopped by the service.
+
+    :param entity: The container entity.
+    """
+    service = inmanta_plugins.podman._optional(lambda: entity._systemd_service)
+    if service is None or not service.persistent:
+        return None
+
+    return service
+
+
+def container_state(container: dict) -> str:
+    """
+    Get the state of the container, as modelled on the Container entity, from
+    its entry in the output of the podman container inspect command.
+
+    :param container: The container, as inspected by podman
+    """
+    state = container.get("State") or {}
+    return "running" if state.get("Status") == "running" else "stopped"
+
+
+def index_containers(containers: list[dict]) -> dict[str, dict]:
+    """
+    Index the containers, as returned by the podman container inspect command,
+    by id and by name.
+
+    :param containers: The containers, as inspected by podman
+    """
+    return {
+        key: container
+        for container in containers
+        for key in [container["Id"], container["Name"]]
+    }
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a size, as accepted by the podman cli (i.e. 512m), into a number
+    of bytes.
+
+    :param size: The size, with an optional unit (b, k, m, g, t)
+    """
+    matched = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([bkmgt]?)b?", size.strip().lower())
+    if matched is None:
+        raise ValueError(f"Invalid size: {size}")
+
+    number, unit = matched.groups()
+    return int(float(number) * 1024 ** "bkmgt".index(unit or "b"))
+
+
+def capability(name: str) -> str:
+    """
+    Normalize the name of a capability, the way podman reports it.
+
+    :param name: The name of the capability, with or without its CAP_ prefix
+    """
+    name = name.upper()
+    return name if name.startswith("CAP_") else f"CAP_{name}"
+
+
+def port_range(ports: str) -> list[str]:
+    """
+    Expand a port, or range of ports (i.e. 123-456), into the list of ports.
+
+    :param ports: The port, or range of ports
+    """
+    first, _, last = ports.partition("-")
+    return [str(port) for port in range(int(first), int(last or first) + 1)]
+
+
+def host_ip(ip: str | None) -> str:
+    """
+    Normalize the ip a port is published on, binding on all ips is reported
+    by podman as an empty ip.
+
+    :param ip: The ip the port is published on, if any
+    """
+    return "" if ip in [None, "0.0.0.0"] else ip
+
+
+def volume_source(source: str | None) -> str:
+    """
+    Normalize the source of a volume the way podman reports it, the name of a
+    named volume, or an absolute path.  Relative paths are resolved by podman,
+    we can only check that something is mounted.
+
+    :param source: The source of the volume, if any
+    """
+    if source is None or source.startswith((".", "~")):
+        return ""
+
+    return os.path.normpath(source) if source.startswith("/") else source
+
+
+def container_projection(container: dict, desired: dict) -> dict:
+    """
+    Read, from the output of the podman container inspect command, the options
+    of the container which are part of the desired projection, normalized the
+    same way the desired projection is.  Only the keys of the desired dicts are
+    read, the image of the container and podman itself add their own.
+
+    :param container: The container, as inspected by podman
+    :param desired: The desired projection of the container options
+    """
+    config = container.get("Config") or {}
+    host_config = container.get("HostConfig") or {}
+    projection: dict[str, object] = {}
+    for key, value in desired.items():
+        match key:
+            case "command":
+                projection[key] = list(config.get("Cmd") or [])
+            case "env":
+                env = dict(
+                    item.split("=", 1)
+                    for item in config.get("Env") or []
+                    if "=" in item
+                )
+                projection[key] = {k: env[k] for k in value if k in env}
+            case "labels":
+                labels = config.get("Labels") or {}
+                projection[key] = {k: labels[k] for k in value if k in labels}
+            case "user":
+                projection[key] = config.get("User")
+            case "working_dir":
+                projection[key] = config.get("WorkingDir")
+            case "hostname":
+                projection[key] = config.get("Hostname")
+            case "stop_timeout":
+                projection[key] = config.get("StopTimeout")
+            case "memory":
+                projection[key] = host_config.get("Memory")
+            case "pids_limit":
+                projection[key] = host_config.get("PidsLimit")
+            case "read_only":
+                projection[key] = bool(host_config.get("ReadonlyRootfs"))
+            case "add_capability":
+                added = {capability(c) for c in host_config.get("CapAdd") or []}
+                projection[key] = [c for c in value if c in added]
+            case "drop_capability":
+                dropped = {capability(c) for c in host_config.get("CapDrop") or []}
+                projection[key] = [c for c in value if c in dropped]
+            case "publish":
+                bindings = host_config.get("PortBindings") or {}
+                projection[key] = {
+                    port: sorted(
+                        f"{host_ip(binding.get('HostIp'))}:{binding.get('HostPort')}"
+                        for binding in bindings.get(port) or []
+                    )
+                    for port in value
+                    if bindings.get(port)
+                }
+            case "volumes":
+                mounts = {
+                    mount["Destination"]: mount
+                    for mount in container.get("Mounts") or []
+                }
+                projection[key] = {
+                    destination: (
+                        ""
+                        if not source
+                        else (
+                            mounts[destination].get("Name")
+                            if mounts[destination].get("Type") == "volume"
+                            else mounts[destination].get("Source")
+                        )
+                    )
+                    for destination, source in value.items()
+                    if destination in mounts
+                }
+            case _:
+                raise ValueError(f"Unsupported container option: {key}")
+
+    return projection
+
+
+def projection_hash(projection: dict) -> str:
+    """
+    Hash the projection of the options of a container.
+
+    :param projection: The normalized options of the container
+    """
+    return hashlib.sha256(json.dumps(projection, sort_keys=True).encode()).hexdigest()
+
+
+@inmanta.resources.resource(
+    name="podman::Container",
+    id_attribute="uri",
+    agent="host.name",
+)
+class ContainerResource(
+    inmanta_plugins.podman.resources.abc.ResourceABC,
+    inmanta.resources.PurgeableResource,
+):
+    fields = (
+        "options",
+        "image",
+        "command",
+        "config_hash",
+        "projection",
+        "projection_hash",
+        "image_id",
+        "state",
+        "stop_timeout",
+        "systemd_unit",
+        "systemctl_command",
+    )
+    options: list[str]
+    image: str
+    command: list[str]
+    config_hash: str
+    projection: dict
+    projection_hash: str
+    image_id: str | None
+    state: str
+    stop_timeout: int | None
+    systemd_unit: str | None
+    systemctl_command: list[str]
+
+    @classmethod
+    def get_state(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str:
+        """
+        Only the containers with a state are deployed by this resource, the
+        other ones are managed by a service.
+        """
+        if entity.state is None:
+            raise inmanta.resources.IgnoreResourceException()
+
+        return entity.state
+
+    @classmethod
+    def get_options(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[str]:
+        """
+        Create the create command of the container, up to its image, using
+        the same options as the ones used to run the container in a service.
+        A persistent container is created with the options which let its
+        service track it, as if the service had created it.
+        """
+        service = persistent_service(entity)
+        if service is None:
+            return inmanta_plugins.podman.container_command(entity, "create")
+
+        return [
+            *inmanta_plugins.podman.container_command(
+                entity,
+                "create",
+                cgroups="no-conmon",
+                sdnotify="conmon",
+            ),
+            f"--label=PODMAN_SYSTEMD_UNIT={service.service_name}",
+        ]
+
+    @classmethod
+    def get_command(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[str]:
+        """
+        Split the command of the container into its arguments.
+        """
+        if entity.command is None:
+            return []
+
+        return shlex.split(entity.command)
+
+    @classmethod
+    def get_config_hash(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str:
+        """
+        Hash all the attributes used to create the container, the container
+        needs to be re-created when this hash changes.
+        """
+        config = {
+            "options": cls.get_options(exporter, entity),
+            "image": entity.image,
+            "command": cls.get_command(exporter, entity),
+        }
+        return hashlib.sha256(json.dumps(config).encode()).hexdigest()
+
+    @classmethod
+    def get_projection(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> dict:
+        """
+        Normalize the options of the container which podman reports when
+        inspecting the container, so that the handler can detect a container
+        which drifted from them without being re-created by us, i.e. updated
+        with podman update, or re-created by hand with our config label.
+        """
+        labels = {k: str(v) for k, v in entity.labels.items()}
+        if entity.auto_update is not None:
+            labels["io.containers.autoupdate"] = entity.auto_update
+
+        projection: dict[str, object] = {
+            "env": {k: str(v) for k, v in entity.env.items()},
+            "labels": labels,
+            "read_only": entity.read_only,
+            "add_capability": sorted({capability(c) for c in entity.add_capability}),
+            "drop_capability": sorted({capability(c) for c in entity.drop_capability}),
+        }
+        if entity.command is not None:
+            projection["command"] = shlex.split(entity.command)
+        if entity.user is not None and entity.group is None:
+            projection["user"] = entity.user
+        if entity.working_dir is not None:
+            projection["working_dir"] = entity.working_dir
+        if entity.hostname is not None:
+            projection["hostname"] = entity.hostname
+        if entity.stop_timeout is not None:
+            projection["stop_timeout"] = entity.stop_timeout
+        if entity.memory is not None:
+            projection["memory"] = parse_size(entity.memory)
+        if entity.pids_limit is not None:
+            projection["pids_limit"] = entity.pids_limit
+
+        # Only the ports published on a fixed host port can be compared, the
+        # other ones are picked by podman
+        publish: dict[str, list[str]] = {}
+        for port in entity.publish:
+            if port.host_port is None:
+                continue
+            host_ports = port_range(port.host_port)
+            container_ports = port_range(port.container_port)
+            if len(host_ports) != len(container_ports):
+                continue
+            for host_port, container_port in zip(host_ports, container_ports):
+                publish.setdefault(
+                    f"{container_port}/{port.protocol or 'tcp'}", []
+                ).append(f"{host_ip(port.ip)}:{host_port}")
+        projection["publish"] = {k: sorted(v) for k, v in publish.items()}
+
+        projection["volumes"] = {
+            volume.container_dir: volume_source(volume.source)
+            for volume in entity.volumes
+        }
+
+        return projection
+
+    @classmethod
+    def get_projection_hash(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str:
+        """
+        Hash the normalized options of the container, the handler hashes the
+        same options, as inspected on the host, to compare them.
+        """
+        return projection_hash(cls.get_projection(exporter, entity))
+
+    @classmethod
+    def get_image_id(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> None:
+        """
+        The id of the image can only be resolved on the host, so we just
+        return None
+        """
+        return None
+
+    @classmethod
+    def get_systemd_unit(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str | None:
+        """
+        The unit of the service running the container, if the container is
+        persistent.
+        """
+        service = persistent_service(entity)
+        return service.service_name if service is not None else None
+
+    @classmethod
+    def get_systemctl_command(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[str]:
+        """
+        The systemctl command to reach the manager of the service running the
+        container, if the container is persistent.
+        """
+        service = persistent_service(entity)
+        return list(service.systemctl_command) if service is not None else []
+
+
+@inmanta.agent.handler.provider("podman::Container", "")
+class ContainerHandler(
+    inmanta_plugins.podman.resources.image.LocalImagesHandler[ContainerResource],
+    inmanta.agent.handler.CRUDHandler[ContainerResource],
+):
+    def list_containers(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> dict[str, dict]:
+        """
+        List all the containers owned by the resource owner on the host, and
+        index them by id and name.
+        """
+        # List the ids of all the containers on the remote host
+        command = ["podman", "container", "ls", "--all", "--quiet", "--no-trunc"]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to list containers")
+
+        ids = stdout.split()
+        if not ids:
+            return {}
+
+        # Inspect all the containers at once, the output contains their labels,
+        # their image, their state and all the options they have been created with
+        command = ["podman", "container", "inspect", *ids]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5 + len(ids),
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to inspect containers")
+
+        return index_containers(json.loads(stdout))
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> None:
+        container = self.lookup(
+            ctx,
+            resource,
+            kind="container",
+            key=resource.name,
+            load=lambda: self.list_containers(ctx, resource),
+        )
+
+        # If the container is not in the snapshot, our container doesn't exist
+        if container is None:
+            raise inmanta.agent.handler.ResourcePurged()
+
+        config = container.get("Config") or {}
+        resource.config_hash = (config.get("Labels") or {}).get(CONFIG_LABEL)
+        resource.image_id = container.get("Image")
+
+        # Compare the options the container is actually running with to the
+        # desired ones, the config label alone doesn't tell whether the container
+        # has been modified since we created it
+        projection = container_projection(container, resource.projection)
+        if projection != resource.projection:
+            ctx.debug(
+                "Container %(name)s drifted from its desired options",
+                name=resource.name,
+                current=projection,
+                desired=resource.projection,
+            )
+        resource.projection_hash = projection_hash(projection)
+
+        if resource.state != "created":
+            # When the desired state is created, we don't care whether the
+            # container is running or not
+            resource.state = container_state(container)
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: ContainerResource,
+        desired: ContainerResource,
+    ) -> dict[str, dict[str, object]]:
+        # Resolve the image the container should use, if the image is not on the
+        # host (yet), or if its name is a short name, we can not know which one it
+        # will be, so we don't detect any change
+        name = inmanta_plugins.podman.resources.image.normalize_image_name(
+            desired.image
+        )
+        image = (
+            self.lookup_local_image(ctx, desired, key=name)
+            if name is not None and not desired.purged
+            else None
+        )
+        desired = desired.clone(
+            image_id=image["Id"] if image is not None else current.image_id,
+        )
+
+        return super().calculate_diff(ctx, current, desired)
+
+    def create_container(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> None:
+        """
+        Create the container, and start it if it should be running.
+        """
+        cmd = [
+            *resource.options,
+            f"--label={CONFIG_LABEL}={resource.config_hash}",
+            resource.image,
+            *resource.command,
+        ]
+
+        # Run the create command on the remote host, it might need to pull
+        # the image, so we don't apply any timeout
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=cmd,
+            timeout=None,
+        )
+
+        # The container has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "container").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to create container")
+
+        if resource.state == "running":
+            self.set_container_state(ctx, resource, state="running")
+
+    def remove_container(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> None:
+        """
+        Stop and remove the container.
+        """
+        cmd = ["podman", "container", "rm", "--force", resource.name]
+        if resource.stop_timeout is not None:
+            cmd.insert(-1, f"--time={resource.stop_timeout}")
+
+        # Run the rm command on the remote host
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=cmd,
+            timeout=(resource.stop_timeout or 10) + 10,
+        )
+
+        # The container has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "container").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to remove container")
+
+    def set_container_state(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+        *,
+        state: str,
+    ) -> None:
+        """
+        Start or stop the container.
+        """
+        if state == "running":
+            cmd = ["podman", "container", "start", resource.name]
+        else:
+            cmd = ["podman", "container", "stop", resource.name]
+            if resource.stop_timeout is not None:
+                cmd.insert(-1, f"--time={resource.stop_timeout}")
+
+        # Run the start or stop command on the remote host
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=cmd,
+            timeout=(resource.stop_timeout or 10) + 20,
+        )
+
+        # The container has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "container").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError(f"Failed to {cmd[2]} container")
+
+    def systemctl(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+        *,
+        operation: str,
+    ) -> int:
+        """
+        Run the given systemctl operation on the unit of the service running
+        the container, and return its exit code.  Only the stop and start
+        operations are expected to succeed, the others (i.e. is-active) are
+        queries.
+        """
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=[*resource.systemctl_command, operation, resource.systemd_unit],
+            timeout=(resource.stop_timeout or 10) + 70,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0 and operation in ["start", "stop"]:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError(f"Failed to {operation} unit {resource.systemd_unit}")
+
+        return ret
+
+    def create_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> None:
+        self.create_container(ctx, resource)
+        ctx.set_created()
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: ContainerResource,
+    ) -> None:
+        recreate = bool(changes.keys() & RECREATE_FIELDS)
+        if recreate and resource.systemd_unit is not None:
+            # The container is run by a service, stop the service while the
+            # container is re-created, and start it again if it was active
+            active = self.systemctl(ctx, resource, operation="is-active") == 0
+            self.systemctl(ctx, resource, operation="stop")
+            self.remove_container(ctx, resource)
+            self.create_container(ctx, resource)
+            if active:
+                self.systemctl(ctx, resource, operation="start")
+        elif recreate:
+            # The container drifted from its config, or its image changed, it
+            # can not be modified, it needs to be re-created
+            self.remove_container(ctx, resource)
+            self.create_container(ctx, resource)
+        elif "state" in changes:
+            self.set_container_state(ctx, resource, state=resource.state)
+
+        ctx.set_updated()
+
+    def delete_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ContainerResource,
+    ) -> None:
+        # Stop the container, within its stop timeout, and remove it
+        self.remove_container(ctx, resource)
+        ctx.set_purged()
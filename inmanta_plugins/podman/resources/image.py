@@ -16,8 +16,16 @@ limitations under the License.
 Contact: edvgui@gmail.com
 """
 
+import contextlib
+import copy
+import hashlib
 import json
+import posixpath
+import re
 import typing
+import urllib.parse
+
+import inmanta_plugins.mitogen
 
 import inmanta.agent.handler
 import inmanta.const
@@ -25,6 +33,12 @@ import inmanta.execute.proxy
 import inmanta.export
 import inmanta.resources
 import inmanta_plugins.podman.resources.abc
+import inmanta_plugins.podman.resources.cache
+import inmanta_podman
+
+# Label set on the images built by the ImageFromSource handler, holding the
+# fingerprint of the sources the image has been built from
+FINGERPRINT_LABEL = "io.inmanta.podman.fingerprint"
 
 
 def valid_digest(digest: str | None, repo_digests: list[str]) -> bool:
@@ -38,29 +52,246 @@ def valid_digest(digest: str | None, repo_digests: list[str]) -> bool:
     return digest in [repo_digest.split("@")[-1] for repo_digest in repo_digests]
 
 
+def normalize_image_name(name: str) -> str | None:
+    """
+    Normalize a fully qualified image reference the same way podman names it
+    when listing images, i.e. with an explicit tag, and with the library
+    namespace for docker hub images.  Return None for short names, which podman
+    resolves using the registries configuration of the host, and which can
+    therefore not be looked up in a listing of the images.
+
+    :param name: The image reference to normalize
+    """
+    domain, sep, remainder = name.partition("/")
+    if not sep or not ("." in domain or ":" in domain or domain == "localhost"):
+        # No domain in the reference, this is a short name
+        return None
+
+    if domain == "docker.io" and "/" not in remainder:
+        # Official images on docker hub are in the library namespace
+        remainder = f"library/{remainder}"
+
+    if "@" in remainder:
+        # Podman lists the digests of the images without their tag, the tag
+        # of a pinned reference is ignored anyway
+        path, _, digest = remainder.partition("@")
+        if ":" in path.rsplit("/", 1)[-1]:
+            path = path.rsplit(":", 1)[0]
+        remainder = f"{path}@{digest}"
+    elif ":" not in remainder.rsplit("/", 1)[-1]:
+        # No tag and no digest, podman uses the latest tag
+        remainder = f"{remainder}:latest"
+
+    return f"{domain}/{remainder}"
+
+
+def index_images(images: list[dict]) -> dict[str, dict]:
+    """
+    Index the images, as returned by the podman image ls command, by id,
+    name and repo digest.  This is the index of the images snapshot.
+
+    :param images: The images to index
+    """
+    return {
+        key: image
+        for image in images
+        for key in [
+            image["Id"],
+            *(image.get("Names") or []),
+            *(image.get("RepoDigests") or []),
+        ]
+    }
+
+
+def storage_podman_command(root: str | None) -> list[str]:
+    """
+    Get the podman command, with the global options selecting the storage with
+    the given root.
+
+    :param root: The root of the storage, None for the default storage of the owner.
+    """
+    if root is None:
+        return ["podman"]
+
+    return ["podman", f"--root={root}"]
+
+
+def storage_snapshot_kind(root: str | None) -> str:
+    """
+    Get the kind of the snapshot of the images in the storage with the given
+    root.  Each storage has its own snapshot.
+
+    :param root: The root of the storage, None for the default storage of the owner.
+    """
+    if root is None:
+        return "image"
+
+    return f"image:{root}"
+
+
+def parse_git_context(context: str) -> tuple[str, str, str | None] | None:
+    """
+    Parse a build context pointing to a git repository, the same way podman
+    detects it, and return the url of the repository, the ref to checkout and
+    the sub-directory to use as context.  Return None if the context is not a
+    git repository.  The context can have the format <url>#<ref>:<subdir>
+
+    :param context: The build context of the image
+    """
+    url, _, fragment = context.partition("#")
+    if not (
+        url.startswith("git://")
+        or url.startswith("github.com/")
+        or url.startswith("git@")
+        or (re.match(r"^https?://", url) and url.endswith(".git"))
+    ):
+        return None
+
+    ref, _, subdir = fragment.partition(":")
+    return url, ref or "HEAD", subdir or None
+
+
+LR = typing.TypeVar("LR", bound=inmanta_plugins.podman.resources.abc.ResourceABC)
+
+
+class LocalImagesHandler(inmanta_plugins.podman.resources.abc.HandlerABC[LR]):
+    """
+    Base handler for the resources which look up local images, in the snapshot
+    of the images of a storage, shared by all the handlers of the agent.
+    """
+
+    def list_local_images(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: LR,
+        *,
+        root: str | None = None,
+    ) -> dict[str, dict]:
+        """
+        List all the images of the storage with the given root, owned by the
+        resource owner on the host, and index them by id, name and repo digest.
+
+        :param root: The root of the storage, None for the default storage of the owner.
+        """
+        # Run the ls command on the remote host
+        command = [*storage_podman_command(root), "image", "ls", "--format=json"]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to list images")
+
+        return index_images(json.loads(stdout))
+
+    def lookup_local_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: LR,
+        *,
+        key: str,
+        root: str | None = None,
+    ) -> dict | None:
+        """
+        Lookup an image, by id, normalized name or repo digest, in the snapshot
+        of the images of the storage with the given root.  Returns None if the
+        image is not in the storage.
+
+        :param key: The id, normalized name or repo digest of the image.
+        :param root: The root of the storage, None for the default storage of the owner.
+        """
+        return self.lookup(
+            ctx,
+            resource,
+            kind=storage_snapshot_kind(root),
+            key=key,
+            load=lambda: self.list_local_images(ctx, resource, root=root),
+        )
+
+
 class ImageResource(
     inmanta_plugins.podman.resources.abc.ResourceABC,
     inmanta.resources.PurgeableResource,
 ):
-    fields = ("digest",)
+    fields = ("digest", "use_api")
     digest: str | None
+    use_api: bool
 
 
 IR = typing.TypeVar("IR", bound=ImageResource)
 
 
 class ImageHandler(
-    inmanta_plugins.podman.resources.abc.HandlerABC[IR],
+    LocalImagesHandler[IR],
     inmanta.agent.handler.CRUDHandler[IR],
 ):
 
+    def storage_root(self, resource: IR) -> str | None:
+        """
+        Get the root of the storage holding the image of the resource, or None
+        if the image is in the default storage of the owner.
+        """
+        return None
+
+    def transport(self, resource: IR) -> str | None:
+        """
+        Get the transport the image of the resource is pulled with, or None if
+        the image is pulled with the default transport.
+        """
+        return None
+
+    def podman_command(self, resource: IR) -> list[str]:
+        """
+        Get the podman command, with the global options selecting the storage
+        holding the image of the resource.
+        """
+        return storage_podman_command(self.storage_root(resource))
+
+    def snapshot_kind(self, resource: IR) -> str:
+        """
+        Get the kind of the snapshot of the images in the storage holding the
+        image of the resource.  Each storage has its own snapshot.
+        """
+        return storage_snapshot_kind(self.storage_root(resource))
+
     def inspect_local_image(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: IR,
     ) -> dict:
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="GET",
+                path=f"/images/{urllib.parse.quote(resource.name, safe='')}/json",
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            if status == 404:
+                # The image doesn't exist
+                raise LookupError()
+            if status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to inspect image")
+
+            return typing.cast(dict, content)
+
         # Run the inspect command on the remote host
-        command = ["podman", "image", "inspect", resource.name]
+        command = [*self.podman_command(resource), "image", "inspect", resource.name]
         stdout, stderr, ret = self.run_command(
             ctx,
             resource,
@@ -84,11 +315,128 @@ class ImageHandler(
 
         return json.loads(stdout)[0]
 
+    def list_local_images(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: IR,
+        *,
+        root: str | None = None,
+    ) -> dict[str, dict]:
+        # List the images with the libpod api if requested, with the cli otherwise
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="GET",
+                path="/images/json",
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is None:
+            return super().list_local_images(ctx, resource, root=root)
+
+        status, images = response
+        if status != 200:
+            ctx.error("%(content)s", status=status, content=images)
+            raise RuntimeError("Failed to list images")
+
+        return index_images(images)
+
+    def read_local_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: IR,
+    ) -> dict:
+        """
+        Get the local image matching the resource name, using the snapshot of
+        all the images of the resource owner on the host.  Raise a LookupError
+        if the image doesn't exist.
+        """
+        name = normalize_image_name(resource.name)
+        if name is None:
+            # Short names are resolved by podman, using the host config, we
+            # can only look them up using the inspect command
+            return self.inspect_local_image(ctx, resource)
+
+        image = self.lookup_local_image(
+            ctx,
+            resource,
+            key=name,
+            root=self.storage_root(resource),
+        )
+        if image is None:
+            raise LookupError()
+
+        # The snapshot is shared, we should never modify it
+        return copy.deepcopy(image)
+
+    def invalidate_local_image(self, resource: IR) -> None:
+        """
+        Mark the image of the resource as stale in the snapshot of the local
+        images.  This should be called after any change to the image.
+        """
+        name = normalize_image_name(resource.name)
+        if name is None:
+            # We don't know how podman resolved the short name, drop the
+            # full snapshot
+            self.snapshot(resource, self.snapshot_kind(resource)).invalidate()
+        else:
+            self.snapshot(resource, self.snapshot_kind(resource)).invalidate(name)
+
     def inspect_remote_image(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: IR,
     ) -> dict:
+        """
+        Get the manifest of the image in the registry, for the platform of the
+        host.  The manifests are cached and shared with all the other handlers
+        in the agent process, to avoid querying the registry for the same image
+        from every host.
+
+        The manifests of short names are resolved using the registries config
+        of the host, and the ones resolved with the credentials of an owner
+        using a custom auth file might not be accessible to the others, they
+        are never shared.
+        """
+        os, arch = self.get_platform(ctx, resource)
+        name = normalize_image_name(resource.name)
+        if name is None or self.host_facts(ctx, resource).registry_auth_file:
+            ctx.debug(
+                "Manifest of %(image)s can not be shared, skipping the manifest cache",
+                image=resource.name,
+            )
+            return self.resolve_remote_image(ctx, resource, os=os, arch=arch)
+
+        manifests = inmanta_plugins.podman.resources.cache.MANIFESTS
+        manifest = manifests.get(
+            (self.transport(resource) or "", name, os, arch),
+            lambda: self.resolve_remote_image(ctx, resource, os=os, arch=arch),
+        )
+        ctx.debug(
+            "Lookup %(image)s in manifest cache (hits=%(hits)d, misses=%(misses)d)",
+            image=resource.name,
+            hits=manifests.hits,
+            misses=manifests.misses,
+        )
+
+        # The cache is shared, we should never modify its content
+        return copy.deepcopy(manifest)
+
+    def resolve_remote_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: IR,
+        *,
+        os: str,
+        arch: str,
+    ) -> dict:
+        """
+        Query the registry, from the host, to get the manifest of the image
+        for the given platform.
+        """
         # Run the inspect command on the remote host
         command = ["podman", "manifest", "inspect", resource.name]
         stdout, stderr, ret = self.run_command(
@@ -113,7 +461,6 @@ class ImageHandler(
             raise RuntimeError("Failed to inspect image")
 
         # Filter all manifest to keep only the one matching our platform
-        os, arch = self.get_platform(ctx, resource)
         manifests = json.loads(stdout)
         for manifest in manifests["manifests"]:
             match manifest:
@@ -133,6 +480,38 @@ class ImageHandler(
                 f"Could not find any manifest for image {resource.name} on platform {os}/{arch}"
             )
 
+    def tag_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: IR,
+        *,
+        image_id: str,
+    ) -> None:
+        """
+        Name the image with the given id after the resource.  This is needed for
+        the images which are loaded from an archive, which may not carry any name.
+        """
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=[
+                *self.podman_command(resource),
+                "image",
+                "tag",
+                image_id,
+                resource.name,
+            ],
+            timeout=5,
+        )
+        self.invalidate_local_image(resource)
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to tag image")
+
     def calculate_diff(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
@@ -153,8 +532,29 @@ class ImageHandler(
         ctx: inmanta.agent.handler.HandlerContext,
         resource: IR,
     ) -> None:
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="DELETE",
+                path=f"/images/{urllib.parse.quote(resource.name, safe='')}",
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            self.invalidate_local_image(resource)
+            if status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to remove image")
+
+            ctx.set_purged()
+            return
+
         # Run the remove command on the remote host
-        command = ["podman", "image", "rm", resource.name]
+        command = [*self.podman_command(resource), "image", "rm", resource.name]
         _, stderr, ret = self.run_command(
             ctx,
             resource,
@@ -162,6 +562,9 @@ class ImageHandler(
             timeout=5,
         )
 
+        # The image has been removed, we can not trust the snapshot anymore
+        self.invalidate_local_image(resource)
+
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
@@ -184,10 +587,18 @@ class ImageFromSourceResource(ImageResource):
         "options",
         "context",
         "build_timeout",
+        "build_progress_timeout",
+        "fingerprint",
+        "build_image",
+        "image_id",
     )
     options: list[str]
     context: str | None
     build_timeout: int | None
+    build_progress_timeout: int | None
+    fingerprint: str | None
+    build_image: dict | None
+    image_id: str | None
 
     @classmethod
     def get_options(
@@ -221,6 +632,52 @@ class ImageFromSourceResource(ImageResource):
         """
         return None
 
+    @classmethod
+    def get_fingerprint(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> None:
+        """
+        The fingerprint of the sources is computed on the host, when
+        deploying the resource, so we just return None
+        """
+        return None
+
+    @classmethod
+    def get_build_image(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> dict | None:
+        """
+        Get the context, owner and name of the image this image is copied
+        from, or None if the image is built on its own host.
+        """
+        build_image = inmanta_plugins.mitogen.get_optional_relation(
+            entity, "build_image"
+        )
+        if build_image is None:
+            return None
+
+        return {
+            "via": inmanta_plugins.mitogen.get_resource_context(build_image),
+            "owner": build_image.owner,
+            "name": build_image.name,
+        }
+
+    @classmethod
+    def get_image_id(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> None:
+        """
+        The id of the image can only be resolved on the build host, so we
+        just return None
+        """
+        return None
+
 
 @inmanta.agent.handler.provider("podman::ImageFromSource", "")
 class ImageFromSourceHandler(ImageHandler[ImageFromSourceResource]):
@@ -230,17 +687,195 @@ class ImageFromSourceHandler(ImageHandler[ImageFromSourceResource]):
         resource: ImageFromSourceResource,
     ) -> None:
         try:
-            existing_image = self.inspect_local_image(ctx, resource)
+            existing_image = self.read_local_image(ctx, resource)
         except LookupError:
             # The image was not found
             raise inmanta.agent.handler.ResourcePurged()
 
         resource.digest = existing_image["Digest"]
+        resource.image_id = existing_image["Id"]
+        resource.fingerprint = (existing_image.get("Labels") or {}).get(
+            FINGERPRINT_LABEL
+        )
+
+    def build_source(
+        self,
+        resource: ImageFromSourceResource,
+    ) -> ImageFromSourceResource | None:
+        """
+        Get a resource object pointing to the image this image is copied from,
+        on its build host, or None if the image is built on its own host.
+        """
+        if resource.build_image is None:
+            return None
+
+        return resource.clone(
+            via=resource.build_image["via"],
+            owner=resource.build_image["owner"],
+            name=resource.build_image["name"],
+        )
+
+    def built_image_id(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        source: ImageFromSourceResource,
+    ) -> str | None:
+        """
+        Get the id of the image built on the build host, or None if it has
+        not been built yet.  The image is inspected directly, as the snapshot
+        of the build host might predate the build.
+        """
+        try:
+            return self.inspect_local_image(ctx, source)["Id"]
+        except LookupError:
+            return None
+
+    def resolve_git_ref(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromSourceResource,
+        *,
+        url: str,
+        ref: str,
+    ) -> str | None:
+        """
+        Resolve the ref of the git repository into a commit id, from the host.
+        Return None if the ref can not be resolved.
+        """
+        if re.fullmatch(r"[0-9a-f]{40}", ref):
+            # The ref is already a commit id
+            return ref
+
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=["git", "ls-remote", url, ref],
+            timeout=30,
+        )
+        if ret != 0:
+            ctx.debug(
+                "Failed to resolve ref %(ref)s of %(url)s: %(stderr)s",
+                ref=ref,
+                url=url,
+                stderr=stderr,
+            )
+            return None
+
+        for line in stdout.splitlines():
+            commit, _, name = line.partition("\t")
+            if name in [ref, f"refs/heads/{ref}", f"refs/tags/{ref}"]:
+                return commit
+
+        return None
+
+    def source_fingerprint(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromSourceResource,
+    ) -> str | None:
+        """
+        Compute the fingerprint of the sources of the image: the build options,
+        the Containerfile and the build context.  Return None if the sources
+        can not be fingerprinted, in which case the image should always be
+        rebuilt.
+
+        - For a local context, the content of the context directory and of the
+            Containerfile is hashed, on the host.
+        - For a git context, the ref is resolved into a commit id.
+        - Any other remote context can not be fingerprinted.
+        """
+        if resource.context is None:
+            return None
+
+        git_context = parse_git_context(resource.context)
+        if git_context is not None:
+            url, ref, _ = git_context
+            content = self.resolve_git_ref(ctx, resource, url=url, ref=ref)
+        elif re.match(r"^https?://", resource.context):
+            # Remote archive or Containerfile, we can't know if it changed
+            # without downloading it
+            content = None
+        else:
+            paths = [resource.context]
+            for option in resource.options:
+                if option.startswith("--file="):
+                    file = option.removeprefix("--file=")
+                    if not re.match(r"^https?://", file):
+                        paths.append(posixpath.join(resource.context, file))
+
+            with self.owner_proxy(ctx, resource) as proxy:
+                content = proxy.remote_call(inmanta_podman.fingerprint, paths)
+
+        if content is None:
+            return None
+
+        return hashlib.sha256(
+            json.dumps(
+                {
+                    "options": resource.options,
+                    "context": resource.context,
+                    "content": content,
+                },
+                sort_keys=True,
+            ).encode()
+        ).hexdigest()
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: ImageFromSourceResource,
+        desired: ImageFromSourceResource,
+    ) -> dict[str, dict[str, typing.Any]]:
+        if desired.purged:
+            # The image should be removed, we don't care about its sources
+            desired = desired.clone(
+                fingerprint=current.fingerprint,
+                image_id=current.image_id,
+            )
+            return super().calculate_diff(ctx, current, desired)
+
+        source = self.build_source(desired)
+        if source is not None:
+            # The image is copied from the build host, the images are the same
+            # when they have the same (content-addressed) id
+            desired = desired.clone(
+                fingerprint=current.fingerprint,
+                image_id=self.built_image_id(ctx, source),
+            )
+            changes = super().calculate_diff(ctx, current, desired)
+            if current.image_id == desired.image_id:
+                changes.pop("digest", None)
+
+            return changes
+
+        fingerprint = self.source_fingerprint(ctx, desired)
+        if fingerprint is None:
+            # We can't tell whether the sources changed, always rebuild
+            ctx.debug(
+                "Sources of image %(image)s can not be fingerprinted",
+                image=desired.name,
+            )
+            desired = desired.clone(
+                fingerprint=current.fingerprint,
+                image_id=current.image_id,
+            )
+            return super().calculate_diff(ctx, current, desired)
+
+        desired = desired.clone(fingerprint=fingerprint, image_id=current.image_id)
+        changes = super().calculate_diff(ctx, current, desired)
+        if current.fingerprint == desired.fingerprint:
+            # The image has been built from the same sources, there is no
+            # need to build it again
+            changes.pop("digest", None)
+
+        return changes
 
     def build_image(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: ImageFromSourceResource,
+        *,
+        fingerprint: str | None,
     ) -> None:
         # Create build command
         cmd = [
@@ -250,32 +885,111 @@ class ImageFromSourceHandler(ImageHandler[ImageFromSourceResource]):
             f"--tag={resource.name}",
             *resource.options,
         ]
+        if fingerprint is not None:
+            # Save the fingerprint of the sources in the image, to know next
+            # time if it needs to be rebuilt
+            cmd.append(f"--label={FINGERPRINT_LABEL}={fingerprint}")
         if resource.context is not None:
             cmd.append(resource.context)
 
-        # Run the create command on the remote host
-        _, stderr, ret = self.run_command(
-            ctx,
-            resource,
-            command=cmd,
-            timeout=resource.build_timeout,
-        )
+        # Run the create command on the remote host, and follow its progress
+        try:
+            output, ret = self.stream_command(
+                ctx,
+                resource,
+                command=cmd,
+                timeout=resource.build_timeout,
+                progress_timeout=resource.build_progress_timeout,
+            )
+        finally:
+            # The image has been modified, we can not trust the snapshot anymore
+            self.invalidate_local_image(resource)
 
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
-                "%(stderr)s",
+                "%(output)s",
                 exit_code=ret,
-                stderr=stderr,
+                output=output,
             )
             raise RuntimeError("Failed to build image")
 
+    def copy_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromSourceResource,
+        *,
+        source: ImageFromSourceResource,
+    ) -> None:
+        """
+        Copy the image built on the build host to the host of the resource.
+        The image is saved as an oci archive on the build host, and streamed,
+        chunk by chunk, through the agent, into podman image load.
+        """
+        image_id = self.built_image_id(ctx, source)
+        if image_id is None:
+            raise RuntimeError(
+                f"Image {source.name} has not been built on the build host"
+            )
+
+        same_store = source.owner == resource.owner and (
+            inmanta_plugins.mitogen.context_hash(source.via)
+            == inmanta_plugins.mitogen.context_hash(resource.via)
+        )
+        if not same_store:
+            archive = self.read_command_output(
+                ctx,
+                source,
+                command=[
+                    "podman",
+                    "image",
+                    "save",
+                    "--format=oci-archive",
+                    image_id,
+                ],
+                progress_timeout=resource.build_progress_timeout,
+            )
+            try:
+                with contextlib.closing(archive):
+                    output, ret = self.write_command_input(
+                        ctx,
+                        resource,
+                        command=["podman", "image", "load"],
+                        chunks=archive,
+                        timeout=resource.build_timeout,
+                        progress_timeout=resource.build_progress_timeout,
+                    )
+            finally:
+                # The image has been modified, we can not trust the snapshot anymore
+                self.invalidate_local_image(resource)
+
+            # If the command failed, something went wrong
+            if ret != 0:
+                ctx.error(
+                    "%(output)s",
+                    exit_code=ret,
+                    output=output,
+                )
+                raise RuntimeError("Failed to load image")
+
+        # The archive is saved from the image id, it doesn't carry any name,
+        # tag the image with the name of the resource
+        self.tag_image(ctx, resource, image_id=image_id)
+
     def create_resource(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: ImageFromSourceResource,
     ) -> None:
-        self.build_image(ctx, resource)
+        source = self.build_source(resource)
+        if source is not None:
+            self.copy_image(ctx, resource, source=source)
+        else:
+            self.build_image(
+                ctx,
+                resource,
+                fingerprint=self.source_fingerprint(ctx, resource),
+            )
         ctx.set_created()
 
     def update_resource(
@@ -284,9 +998,17 @@ class ImageFromSourceHandler(ImageHandler[ImageFromSourceResource]):
         changes: dict[str, dict[str, object]],
         resource: ImageFromSourceResource,
     ) -> None:
-        self.build_image(ctx, resource)
+        source = self.build_source(resource)
+        if source is not None:
+            self.copy_image(ctx, resource, source=source)
+        else:
+            self.build_image(
+                ctx,
+                resource,
+                fingerprint=changes.get("fingerprint", {}).get("desired"),
+            )
 
-        if not valid_digest(
+        if "digest" in changes and not valid_digest(
             changes["digest"]["current"],
             self.inspect_local_image(ctx, resource)["RepoDigests"],
         ):
@@ -300,29 +1022,116 @@ class ImageFromSourceHandler(ImageHandler[ImageFromSourceResource]):
     agent="host.name",
 )
 class ImageFromRegistryResource(ImageResource):
-    fields = ("transport", "digest", "pull_timeout")
+    fields = (
+        "transport",
+        "digest",
+        "pull_timeout",
+        "pull_progress_timeout",
+        "store",
+        "copy_from",
+    )
     transport: str | None
     digest: str | None
     pull_timeout: int | None
+    pull_progress_timeout: int | None
+    store: str | None
+    copy_from: list[str]
+
+    @classmethod
+    def get_store(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str | None:
+        """
+        Get the path of the shared store the image is pulled into, if any.
+        """
+        store = inmanta_plugins.mitogen.get_optional_relation(entity, "store")
+        if store is None:
+            return None
+
+        return store.path
+
+    @classmethod
+    def get_use_api(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> bool:
+        """
+        The libpod api only serves the storage of the owner, the images of a
+        shared store are always managed with the cli.
+        """
+        return entity.use_api and cls.get_store(exporter, entity) is None
 
 
 @inmanta.agent.handler.provider("podman::ImageFromRegistry", "")
 class ImageFromRegistryHandler(ImageHandler[ImageFromRegistryResource]):
+    def storage_root(self, resource: ImageFromRegistryResource) -> str | None:
+        return resource.store
+
+    def transport(self, resource: ImageFromRegistryResource) -> str | None:
+        return resource.transport
+
+    def list_copied_images(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromRegistryResource,
+    ) -> dict[str, dict]:
+        """
+        Get the registry digests recorded for all the images copied into the
+        storage of the resource owner, indexed by image id.
+        """
+        with self.owner_proxy(ctx, resource) as proxy:
+            return typing.cast(
+                dict[str, dict],
+                proxy.remote_call(inmanta_podman.copied_images_digests),
+            )
+
+    def registry_digests(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromRegistryResource,
+        image: dict,
+    ) -> tuple[str, list[str]]:
+        """
+        Get the digest and the repo digests of the given local image, in the
+        registry.  An image copied from another owner doesn't preserve the
+        digests of the registry, the ones recorded when the image was copied
+        are used instead, from their own snapshot.
+        """
+        copied = (
+            self.lookup(
+                ctx,
+                resource,
+                kind="copied-image",
+                key=image["Id"],
+                load=lambda: self.list_copied_images(ctx, resource),
+            )
+            if resource.copy_from
+            else None
+        )
+        if copied is None:
+            return image["Digest"], image["RepoDigests"]
+
+        return copied["digest"], [*image["RepoDigests"], *copied["repo_digests"]]
+
     def read_resource(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: ImageFromRegistryResource,
     ) -> None:
         try:
-            existing_image = self.inspect_local_image(ctx, resource)
+            existing_image = self.read_local_image(ctx, resource)
         except LookupError:
             # The image was not found
             raise inmanta.agent.handler.ResourcePurged()
 
-        if not valid_digest(resource.digest, existing_image["RepoDigests"]):
+        digest, repo_digests = self.registry_digests(ctx, resource, existing_image)
+        if not valid_digest(resource.digest, repo_digests):
             # Only detect a different digest if the desired digest (which may be None)
             # is not part of the image ones
-            resource.digest = existing_image["Digest"]
+            resource.digest = digest
 
     def calculate_diff(
         self,
@@ -339,6 +1148,23 @@ class ImageFromRegistryHandler(ImageHandler[ImageFromRegistryResource]):
 
         return super().calculate_diff(ctx, current, desired)
 
+    def facts(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromRegistryResource,
+    ) -> dict[str, str]:
+        """
+        Report the digest of the image pulled on the host, the containers
+        using this image are pinned to it.
+        """
+        try:
+            image = self.read_local_image(ctx, resource)
+        except LookupError:
+            # The image has not been pulled yet
+            return {}
+
+        return {"digest": self.registry_digests(ctx, resource, image)[0]}
+
     def pull_image(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
@@ -351,29 +1177,159 @@ class ImageFromRegistryHandler(ImageHandler[ImageFromRegistryResource]):
         if resource.digest is not None:
             source = f"{source}@{resource.digest}"
 
-        # Run the create command on the remote host
-        _, stderr, ret = self.run_command(
-            ctx,
-            resource,
-            command=["podman", "image", "pull", source],
-            timeout=resource.pull_timeout,
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="POST",
+                path=f"/images/pull?{urllib.parse.urlencode({'reference': source, 'quiet': 'true'})}",
+                stream=True,
+                timeout=resource.pull_timeout,
+            )
+            if resource.use_api
+            else None
         )
+        if response is not None:
+            status, reports = response
+            self.invalidate_local_image(resource)
+            errors = [report["error"] for report in reports if report.get("error")]
+            if status != 200 or errors:
+                ctx.error("%(errors)s", status=status, errors=errors or reports)
+                raise RuntimeError("Failed to pull image")
+
+            return
+
+        # Run the create command on the remote host, and follow its progress
+        try:
+            output, ret = self.stream_command(
+                ctx,
+                resource,
+                command=[*self.podman_command(resource), "image", "pull", source],
+                timeout=resource.pull_timeout,
+                progress_timeout=resource.pull_progress_timeout,
+            )
+        finally:
+            # The image has been modified, we can not trust the snapshot anymore
+            self.invalidate_local_image(resource)
 
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
-                "%(stderr)s",
+                "%(output)s",
                 exit_code=ret,
-                stderr=stderr,
+                output=output,
             )
             raise RuntimeError("Failed to pull image")
 
+    def copy_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromRegistryResource,
+    ) -> bool:
+        """
+        Copy the image from the storage of one of the other owners of the host
+        which already have it, with the desired digest, instead of pulling it
+        from the registry (podman image scp).  Return False if no owner has the
+        image, or if the copy failed, the image should then be pulled.
+        """
+        if not resource.copy_from:
+            return False
+
+        if resource.store is not None:
+            ctx.warning(
+                "Image %(image)s is pulled into a store, it can not be copied from another owner, pulling it instead",
+                image=resource.name,
+            )
+            return False
+
+        if self.host_facts(ctx, resource, as_owner=False).user != "root":
+            ctx.warning(
+                "Copying image %(image)s from another owner requires root privileges, pulling it instead",
+                image=resource.name,
+            )
+            return False
+
+        try:
+            digest = (
+                resource.digest or self.inspect_remote_image(ctx, resource)["digest"]
+            )
+        except LookupError:
+            return False
+
+        destination = resource.owner or self.whoami(ctx, resource)
+        for owner in resource.copy_from:
+            if owner == destination:
+                continue
+
+            try:
+                image = self.read_local_image(ctx, resource.clone(owner=owner))
+            except LookupError:
+                continue
+            except Exception as e:
+                ctx.warning(
+                    "Failed to read the images of %(owner)s: %(error)s",
+                    owner=owner,
+                    error=str(e),
+                )
+                continue
+
+            if not valid_digest(digest, image["RepoDigests"]):
+                continue
+
+            # Transferring an image between two users requires root privileges,
+            # the copy is made as the user of the proxy
+            _, stderr, ret = self.run_command(
+                ctx,
+                resource.clone(owner=None),
+                command=[
+                    "podman",
+                    "image",
+                    "scp",
+                    f"{owner}@localhost::{image['Id']}",
+                    f"{destination}@localhost::",
+                ],
+                timeout=resource.pull_timeout,
+            )
+            self.invalidate_local_image(resource)
+            if ret != 0:
+                ctx.warning(
+                    "Failed to copy image %(image)s from %(owner)s, pulling it instead: %(stderr)s",
+                    image=resource.name,
+                    owner=owner,
+                    exit_code=ret,
+                    stderr=stderr,
+                )
+                return False
+
+            # The image is copied by id, without its name, and the digests of the
+            # registry are lost, record them to recognize the image later on
+            self.tag_image(ctx, resource, image_id=image["Id"])
+            with self.owner_proxy(ctx, resource) as proxy:
+                proxy.remote_call(
+                    inmanta_podman.record_copied_image_digests,
+                    image["Id"],
+                    {"digest": image["Digest"], "repo_digests": image["RepoDigests"]},
+                )
+            self.snapshot(resource, "copied-image").invalidate(image["Id"])
+
+            ctx.info(
+                "Copied image %(image)s from %(owner)s",
+                image=resource.name,
+                owner=owner,
+            )
+            return True
+
+        return False
+
     def create_resource(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: ImageFromRegistryResource,
     ) -> None:
-        self.pull_image(ctx, resource)
+        if not self.copy_image(ctx, resource):
+            self.pull_image(ctx, resource)
+        image = self.read_local_image(ctx, resource)
+        ctx.set_fact("digest", self.registry_digests(ctx, resource, image)[0])
         ctx.set_created()
 
     def update_resource(
@@ -384,9 +1340,209 @@ class ImageFromRegistryHandler(ImageHandler[ImageFromRegistryResource]):
     ) -> None:
         self.pull_image(ctx, resource)
 
+        image = self.inspect_local_image(ctx, resource)
+        ctx.set_fact("digest", image["Digest"])
         if not valid_digest(
             changes["digest"]["current"],
-            self.inspect_local_image(ctx, resource)["RepoDigests"],
+            image["RepoDigests"],
         ):
             # If the digest has changed, we have a different image
             ctx.set_updated()
+
+
+def read_chunks(path: str) -> typing.Iterator[bytes]:
+    """
+    Read the file at the given path, on the agent, in chunks.
+
+    :param path: The path of the file
+    """
+    with open(path, "rb") as f:
+        while chunk := f.read(inmanta_plugins.podman.resources.abc.CHUNK_SIZE):
+            yield chunk
+
+
+@inmanta.resources.resource(
+    name="podman::ImageFromArchive",
+    id_attribute="uri",
+    agent="host.name",
+)
+class ImageFromArchiveResource(ImageResource):
+    fields = (
+        "path",
+        "agent_path",
+        "load_timeout",
+        "load_progress_timeout",
+        "image_id",
+    )
+    path: str | None
+    agent_path: str | None
+    load_timeout: int | None
+    load_progress_timeout: int | None
+    image_id: str | None
+
+    @classmethod
+    def get_digest(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> None:
+        """
+        The digest is only known once the image is loaded, so we just
+        return None
+        """
+        return None
+
+    @classmethod
+    def get_image_id(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> None:
+        """
+        The id of the image is read from the archive, when deploying the
+        resource, so we just return None
+        """
+        return None
+
+
+@inmanta.agent.handler.provider("podman::ImageFromArchive", "")
+class ImageFromArchiveHandler(ImageHandler[ImageFromArchiveResource]):
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromArchiveResource,
+    ) -> None:
+        try:
+            existing_image = self.read_local_image(ctx, resource)
+        except LookupError:
+            # The image was not found
+            raise inmanta.agent.handler.ResourcePurged()
+
+        resource.digest = existing_image["Digest"]
+        resource.image_id = existing_image["Id"]
+
+    def archive_image_id(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromArchiveResource,
+    ) -> str:
+        """
+        Read the id of the image in the archive, on the agent or on the host,
+        without unpacking the archive.
+        """
+        if resource.agent_path is not None:
+            archive = resource.agent_path
+            image_id = inmanta_podman.archive_image_id(archive)
+        else:
+            archive = str(resource.path)
+            with self.owner_proxy(ctx, resource) as proxy:
+                image_id = proxy.remote_call(inmanta_podman.archive_image_id, archive)
+
+        if image_id is None:
+            raise RuntimeError(f"Failed to read the image id in archive {archive}")
+
+        return str(image_id)
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: ImageFromArchiveResource,
+        desired: ImageFromArchiveResource,
+    ) -> dict[str, dict[str, typing.Any]]:
+        if desired.purged:
+            # The image should be removed, we don't care about the archive
+            desired = desired.clone(image_id=current.image_id)
+            return super().calculate_diff(ctx, current, desired)
+
+        desired = desired.clone(image_id=self.archive_image_id(ctx, desired))
+        changes = super().calculate_diff(ctx, current, desired)
+        if current.image_id == desired.image_id:
+            # The image of the archive is already loaded
+            changes.pop("digest", None)
+
+        return changes
+
+    def load_image(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromArchiveResource,
+        *,
+        image_id: str,
+    ) -> None:
+        """
+        Load the archive, unless an image with the same id is already present
+        on the host, then name the image after the resource.
+        """
+        existing_image = self.lookup_local_image(
+            ctx,
+            resource,
+            key=image_id,
+            root=self.storage_root(resource),
+        )
+        if existing_image is not None:
+            ctx.debug(
+                "Image %(image_id)s is already present, skipping the load",
+                image_id=image_id,
+            )
+            self.tag_image(ctx, resource, image_id=image_id)
+            return
+
+        try:
+            if resource.agent_path is not None:
+                # Stream the archive from the agent into the load command
+                output, ret = self.write_command_input(
+                    ctx,
+                    resource,
+                    command=["podman", "image", "load"],
+                    chunks=read_chunks(resource.agent_path),
+                    timeout=resource.load_timeout,
+                    progress_timeout=resource.load_progress_timeout,
+                )
+            else:
+                # Run the load command on the remote host, and follow its progress
+                output, ret = self.stream_command(
+                    ctx,
+                    resource,
+                    command=["podman", "image", "load", f"--input={resource.path}"],
+                    timeout=resource.load_timeout,
+                    progress_timeout=resource.load_progress_timeout,
+                )
+        finally:
+            # The images have been modified, we can not trust the snapshot anymore
+            self.snapshot(resource, "image").invalidate(image_id)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(output)s",
+                exit_code=ret,
+                output=output,
+            )
+            raise RuntimeError("Failed to load image")
+
+        self.tag_image(ctx, resource, image_id=image_id)
+
+    def create_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImageFromArchiveResource,
+    ) -> None:
+        self.load_image(
+            ctx,
+            resource,
+            image_id=self.archive_image_id(ctx, resource),
+        )
+        ctx.set_created()
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: ImageFromArchiveResource,
+    ) -> None:
+        self.load_image(
+            ctx,
+            resource,
+            image_id=str(changes["image_id"]["desired"]),
+        )
+        ctx.set_updated()
@@ -0,0 +1,404 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import datetime
+import json
+import re
+import time
+
+import inmanta_plugins.mitogen
+
+import inmanta.agent.handler
+import inmanta.execute.proxy
+import inmanta.export
+import inmanta.resources
+import inmanta_plugins.podman.resources.abc
+import inmanta_plugins.podman.resources.image
+
+
+def parse_time(value: str | int | float) -> float:
+    """
+    Convert a time reported by podman, either a unix timestamp or a rfc 3339
+    string (with nanoseconds), into a unix timestamp.
+
+    :param value: The time to convert
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    # Python doesn't parse more than microseconds
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value.replace("Z", "+00:00"))
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def is_protected(image: dict, *, keep: list[str], references: list[str]) -> bool:
+    """
+    Check whether the image is in the allowlist: one of its names matches one
+    of the keep patterns, or it is referenced by one of the managed images and
+    containers.
+
+    :param image: The image, as returned by the podman image ls command
+    :param keep: Regexes matching the names of the images to keep
+    :param references: References (names or digests) of the images to keep
+    """
+    names: list[str] = image.get("Names") or []
+    repo_digests: list[str] = image.get("RepoDigests") or []
+    if any(re.fullmatch(pattern, name) for pattern in keep for name in names):
+        return True
+
+    for reference in references:
+        normalized = inmanta_plugins.podman.resources.image.normalize_image_name(
+            reference
+        )
+        if normalized is not None:
+            if normalized in names or normalized in repo_digests:
+                return True
+            continue
+
+        # Short names are resolved by podman, using the registries of the host,
+        # keep all the images they could resolve to
+        if ":" not in reference and "@" not in reference:
+            reference = f"{reference}:latest"
+        if any(name.endswith(f"/{reference}") for name in [*names, *repo_digests]):
+            return True
+
+    return False
+
+
+def select_images(
+    images: list[dict],
+    df: dict,
+    *,
+    now: float,
+    max_age: int | None,
+    keep_last: int | None,
+    high_water_mark: int | None,
+    keep: list[str],
+    references: list[str],
+) -> list[str]:
+    """
+    Select the images to remove, according to the policy, and return their ids,
+    the least recently used first.  Only the images which are not used by any
+    container and are not in the allowlist can be removed.  An image is last used
+    when it is created, or when the latest of its containers is created.
+
+    :param images: The images, as returned by the podman image ls command
+    :param df: The disk usage, as returned by the podman system df -v command
+    :param now: The current time, as a unix timestamp
+    :param max_age: Remove the images which have not been used for that many seconds
+    :param keep_last: Only keep that many of the most recent images of each repository
+    :param high_water_mark: Remove the least recently used images until the images
+        use less than that many bytes on disk
+    :param keep: Regexes matching the names of the images to keep
+    :param references: References (names or digests) of the images to keep
+    """
+
+    def image_id(prefix: str) -> str | None:
+        # The disk usage report might use truncated ids
+        return next((i["Id"] for i in images if i["Id"].startswith(prefix)), None)
+
+    unique_sizes = {
+        image_id(report["ImageID"]): report.get("UniqueSize") or 0
+        for report in df.get("Images") or []
+    }
+
+    last_used = {image["Id"]: parse_time(image["Created"]) for image in images}
+    for container in df.get("Containers") or []:
+        used_id = image_id(container.get("Image") or "-")
+        if used_id is not None:
+            last_used[used_id] = max(
+                last_used[used_id], parse_time(container["Created"])
+            )
+
+    candidates = {
+        image["Id"]
+        for image in images
+        if not image.get("Containers")
+        and not is_protected(image, keep=keep, references=references)
+    }
+    selected: set[str] = set()
+
+    if keep_last is not None:
+        # Group the images by repository, the most recent first
+        repositories: dict[str, list[str]] = {}
+        for image in sorted(images, key=lambda i: last_used[i["Id"]], reverse=True):
+            for repository in {
+                name.rsplit(":", 1)[0] for name in image.get("Names") or []
+            }:
+                repositories.setdefault(repository, []).append(image["Id"])
+
+        for ids in repositories.values():
+            selected.update(candidates.intersection(ids[keep_last:]))
+
+    if max_age is not None:
+        selected.update(i for i in candidates if now - last_used[i] > max_age)
+
+    if high_water_mark is not None:
+        # Removing an image only frees the layers it doesn't share with the other
+        # images, remove the least recently used ones until enough space is freed
+        usage = df.get("ImagesSize") or 0
+        usage -= sum(unique_sizes.get(i, 0) for i in selected)
+        for candidate in sorted(candidates - selected, key=lambda i: last_used[i]):
+            if usage <= high_water_mark:
+                break
+
+            selected.add(candidate)
+            usage -= unique_sizes.get(candidate, 0)
+
+    return sorted(selected, key=lambda i: (last_used[i], i))
+
+
+def removal_references(image_id: str, image: dict | None) -> list[str]:
+    """
+    Get the references to pass to podman image rm to remove the image with the
+    given id.  An image with multiple names can not be removed by id without
+    forcing it, it is removed by removing all its names instead.
+
+    :param image_id: The id of the image to remove.
+    :param image: The image, as listed by podman, if it is still on the host.
+    """
+    names = (image or {}).get("Names") or []
+    if len(names) > 1:
+        return list(names)
+
+    return [image_id]
+
+
+@inmanta.resources.resource(
+    name="podman::ImagePrune",
+    id_attribute="uri",
+    agent="host.name",
+)
+class ImagePruneResource(
+    inmanta_plugins.podman.resources.abc.ResourceABC,
+    inmanta.resources.PurgeableResource,
+):
+    fields = (
+        "max_age",
+        "keep_last",
+        "high_water_mark",
+        "keep",
+        "references",
+        "store",
+        "removed",
+    )
+    max_age: int | None
+    keep_last: int | None
+    high_water_mark: int | None
+    keep: list[str]
+    references: list[str]
+    store: str | None
+    removed: list[str]
+
+    @classmethod
+    def get_store(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str | None:
+        """
+        Get the path of the shared store whose images are pruned, if any.
+        """
+        store = inmanta_plugins.mitogen.get_optional_relation(entity, "store")
+        if store is None:
+            return None
+
+        return store.path
+
+    @classmethod
+    def get_references(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[str]:
+        """
+        Get the references of the images of the managed images and containers,
+        which should never be removed.
+        """
+        references = {image.name for image in entity.images}
+        for container in entity.containers:
+            source_image = inmanta_plugins.mitogen.get_optional_relation(
+                container, "source_image"
+            )
+            if source_image is not None:
+                # The image of the container is pinned to the digest of its image
+                # resource, which might not be known yet, use its name instead
+                references.add(source_image.name)
+            else:
+                references.add(container.image)
+
+        return sorted(references)
+
+    @classmethod
+    def get_removed(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[str]:
+        """
+        No image matching the policy should be left on the host
+        """
+        return []
+
+
+@inmanta.agent.handler.provider("podman::ImagePrune", "")
+class ImagePruneHandler(
+    inmanta_plugins.podman.resources.image.LocalImagesHandler[ImagePruneResource],
+    inmanta.agent.handler.CRUDHandler[ImagePruneResource],
+):
+    def podman_command(self, resource: ImagePruneResource) -> list[str]:
+        """
+        Get the podman command, with the global options selecting the storage
+        whose images are pruned, the same way the image handlers do it.
+        """
+        return inmanta_plugins.podman.resources.image.storage_podman_command(
+            resource.store
+        )
+
+    def snapshot_kind(self, resource: ImagePruneResource) -> str:
+        """
+        Get the kind of the snapshot of the images of the storage whose images
+        are pruned, the same way the image handlers do it.
+        """
+        return inmanta_plugins.podman.resources.image.storage_snapshot_kind(
+            resource.store
+        )
+
+    def podman_json(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImagePruneResource,
+        *,
+        command: list[str],
+    ) -> object:
+        """
+        Run a podman command with a json output, on the host, and return
+        its parsed output.
+        """
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=30,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError(f"Failed to run {' '.join(command[:3])}")
+
+        return json.loads(stdout)
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ImagePruneResource,
+    ) -> None:
+        # Take a single snapshot of the images and of the disk usage, and
+        # select the images to remove from it
+        images = self.podman_json(
+            ctx,
+            resource,
+            command=[*self.podman_command(resource), "image", "ls", "--format=json"],
+        )
+        df = self.podman_json(
+            ctx,
+            resource,
+            command=[
+                *self.podman_command(resource),
+                "system",
+                "df",
+                "--verbose",
+                "--format=json",
+            ],
+        )
+        resource.removed = select_images(
+            images if isinstance(images, list) else [],
+            df if isinstance(df, dict) else {},
+            now=time.time(),
+            max_age=resource.max_age,
+            keep_last=resource.keep_last,
+            high_water_mark=resource.high_water_mark,
+            keep=resource.keep,
+            references=resource.references,
+        )
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: ImagePruneResource,
+        desired: ImagePruneResource,
+    ) -> dict[str, dict[str, object]]:
+        if desired.purged:
+            # The resource doesn't exist on the host, purging it only stops
+            # pruning the images
+            return {}
+
+        return super().calculate_diff(ctx, current, desired)
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: ImagePruneResource,
+    ) -> None:
+        removed = changes["removed"]["current"]
+        assert isinstance(removed, list)
+
+        # The images are not used by any container, but the ones with multiple
+        # names can only be removed by id with --force, which would also remove
+        # the containers created since they were selected, remove their names
+        references = [
+            reference
+            for image_id in removed
+            for reference in removal_references(
+                image_id,
+                self.lookup_local_image(
+                    ctx,
+                    resource,
+                    key=image_id,
+                    root=resource.store,
+                ),
+            )
+        ]
+
+        # Remove all the images at once
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=[*self.podman_command(resource), "image", "rm", *references],
+            timeout=5 + len(references),
+        )
+
+        # The images have been removed, we can not trust the snapshot anymore
+        self.snapshot(resource, self.snapshot_kind(resource)).invalidate()
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to remove images")
+
+        ctx.set_updated()
@@ -16,7 +16,10 @@ limitations under the License.
 Contact: edvgui@gmail.com
 """
 
+import copy
 import json
+import typing
+import urllib.parse
 
 import inmanta.agent.handler
 import inmanta.const
@@ -25,6 +28,11 @@ import inmanta.export
 import inmanta.resources
 import inmanta_plugins.podman.resources.abc
 
+# Keys of the network config which can be modified on an existing network,
+# using the podman network update command.  A change to any other key requires
+# to re-create the network.
+UPDATABLE_CONFIG_KEYS = {"network_dns_servers"}
+
 
 def merge(
     base_config: dict | list[dict] | object,
@@ -79,8 +87,9 @@ class NetworkResource(
     inmanta_plugins.podman.resources.abc.ResourceABC,
     inmanta.resources.PurgeableResource,
 ):
-    fields = ("config",)
+    fields = ("config", "use_api")
     config: dict
+    use_api: bool
 
     @classmethod
     def get_config(
@@ -118,6 +127,9 @@ class NetworkResource(
                 for route in entity.routes
             ]
 
+        if entity.dns:
+            config["network_dns_servers"] = list(entity.dns)
+
         if entity.labels:
             config["labels"] = entity.labels
 
@@ -127,6 +139,22 @@ class NetworkResource(
         return config
 
 
+def changed_config_keys(current_config: dict, desired_config: dict) -> set[str]:
+    """
+    Get the keys of the network config whose value differs between the current
+    and the desired config.  When they are all updatable, the network can be
+    updated in place, otherwise it must be re-created.
+
+    :param current_config: The config of the network on the host.
+    :param desired_config: The config that the network should have.
+    """
+    return {
+        k
+        for k in current_config.keys() | desired_config.keys()
+        if current_config.get(k) != desired_config.get(k)
+    }
+
+
 def build_create_command(config: dict) -> list[str]:
     """
     Helper method to build the podman network create command based on
@@ -149,6 +177,7 @@ def build_create_command(config: dict) -> list[str]:
     if not config["dns_enabled"]:
         cmd.append("--disable-dns")
 
+    cmd.extend([f"--dns={d}" for d in config.get("network_dns_servers", [])])
     cmd.extend([f"--opt={k}={v}" for k, v in config.get("options", {}).items()])
     cmd.extend([f"--label={k}={v}" for k, v in config.get("labels", {}).items()])
 
@@ -177,6 +206,25 @@ def build_create_command(config: dict) -> list[str]:
     return cmd
 
 
+def build_update_command(current_config: dict, desired_config: dict) -> list[str]:
+    """
+    Helper method to build the podman network update command, which brings
+    the updatable part of the current config to the desired config.
+
+    :param current_config: The config of the network on the host.
+    :param desired_config: The config that the network should have.
+    """
+    current_dns = current_config.get("network_dns_servers") or []
+    desired_dns = desired_config.get("network_dns_servers") or []
+
+    cmd = ["podman", "network", "update"]
+    cmd.extend([f"--dns-add={d}" for d in desired_dns if d not in current_dns])
+    cmd.extend([f"--dns-drop={d}" for d in current_dns if d not in desired_dns])
+    cmd.append(desired_config["name"])
+
+    return cmd
+
+
 @inmanta.agent.handler.provider("podman::Network", "")
 class NetworkHandler(
     inmanta_plugins.podman.resources.abc.HandlerABC[NetworkResource],
@@ -243,6 +291,20 @@ class NetworkHandler(
                 pass
 
         updated_config = merge(current.config, desired.config)
+
+        # The merge keeps the current dns servers when none are desired, they
+        # are compared explicitly, regardless of their order
+        current_dns = current.config.get("network_dns_servers") or []
+        desired_dns = desired.config.get("network_dns_servers") or []
+        if sorted(current_dns) != sorted(desired_dns):
+            updated_config["network_dns_servers"] = desired_dns
+        elif "network_dns_servers" in current.config:
+            updated_config["network_dns_servers"] = current.config[
+                "network_dns_servers"
+            ]
+        else:
+            updated_config.pop("network_dns_servers", None)
+
         if current.config == updated_config:
             # If by applying the desired state to the current config
             # (using the merge helper) we don't detect any change, then
@@ -258,13 +320,37 @@ class NetworkHandler(
 
         return diff
 
-    def read_resource(
+    def list_networks(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: NetworkResource,
-    ) -> None:
-        # Run the inspect command on the remote host
-        command = ["podman", "network", "inspect", resource.name]
+    ) -> dict[str, dict]:
+        """
+        List all the networks owned by the resource owner on the host, and
+        index them by name.
+        """
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="GET",
+                path="/networks/json",
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            if status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to list networks")
+
+            return {network["name"]: network for network in content}
+
+        # Run the ls command on the remote host, its output contains the full
+        # config of each network, the same way the inspect command does
+        command = ["podman", "network", "ls", "--format=json"]
         stdout, stderr, ret = self.run_command(
             ctx,
             resource,
@@ -272,11 +358,6 @@ class NetworkHandler(
             timeout=5,
         )
 
-        # If we receive an empty list, our network doesn't exist
-        if stdout.strip() == "[]":
-            ctx.info("%(stderr)s", stderr=stderr)
-            raise inmanta.agent.handler.ResourcePurged()
-
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
@@ -284,16 +365,60 @@ class NetworkHandler(
                 exit_code=ret,
                 stderr=stderr,
             )
-            raise RuntimeError("Failed to inspect network")
+            raise RuntimeError("Failed to list networks")
+
+        return {network["name"]: network for network in json.loads(stdout)}
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NetworkResource,
+    ) -> None:
+        config = self.lookup(
+            ctx,
+            resource,
+            kind="network",
+            key=resource.name,
+            load=lambda: self.list_networks(ctx, resource),
+        )
+
+        # If the network is not in the snapshot, our network doesn't exist
+        if config is None:
+            raise inmanta.agent.handler.ResourcePurged()
 
-        # Load the inspect result
-        resource.config = json.loads(stdout)[0]
+        # Load the inspect result, the snapshot is shared, we should never
+        # modify it
+        resource.config = copy.deepcopy(config)
 
     def create_resource(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         resource: NetworkResource,
     ) -> None:
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="POST",
+                path="/networks/create",
+                # The api expects the same structure as the one returned by
+                # the inspect command, which is what our config is
+                body=resource.config,
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            self.snapshot(resource, "network").invalidate(resource.name)
+            if status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to create network")
+
+            ctx.set_created()
+            return
+
         # Run the create command on the remote host
         command = build_create_command(resource.config)
         _, stderr, ret = self.run_command(
@@ -303,6 +428,9 @@ class NetworkHandler(
             timeout=5,
         )
 
+        # The network has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "network").invalidate(resource.name)
+
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
@@ -314,13 +442,96 @@ class NetworkHandler(
 
         ctx.set_created()
 
+    def update_network(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NetworkResource,
+        *,
+        current_config: dict,
+        desired_config: dict,
+    ) -> None:
+        """
+        Update the existing network, without re-creating it, the containers
+        attached to it are not disconnected.
+        """
+        current_dns = current_config.get("network_dns_servers") or []
+        desired_dns = desired_config.get("network_dns_servers") or []
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="POST",
+                path=f"/networks/{urllib.parse.quote(resource.name, safe='')}/update",
+                body={
+                    "adddns": [d for d in desired_dns if d not in current_dns],
+                    "removedns": [d for d in current_dns if d not in desired_dns],
+                },
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            self.snapshot(resource, "network").invalidate(resource.name)
+            if status != 204 and status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to update network")
+
+            return
+
+        # Run the update command on the remote host
+        command = build_update_command(current_config, desired_config)
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # The network has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "network").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to update network")
+
     def update_resource(
         self,
         ctx: inmanta.agent.handler.HandlerContext,
         changes: dict[str, dict[str, object]],
         resource: NetworkResource,
     ) -> None:
+        current_config = typing.cast(dict, changes["config"]["current"])
+        desired_config = typing.cast(dict, changes["config"]["desired"])
+        changed_keys = sorted(changed_config_keys(current_config, desired_config))
+        if set(changed_keys) <= UPDATABLE_CONFIG_KEYS:
+            # All the changes can be applied on the existing network
+            ctx.info(
+                "Updating network %(network)s in place, changed keys: %(keys)s",
+                network=resource.name,
+                keys=changed_keys,
+            )
+            self.update_network(
+                ctx,
+                resource,
+                current_config=current_config,
+                desired_config=desired_config,
+            )
+            ctx.set_updated()
+            return
+
         # We can't update the network, se we first delete it, then re-create it
+        ctx.info(
+            "Re-creating network %(network)s, changed keys: %(keys)s",
+            network=resource.name,
+            keys=changed_keys,
+        )
         self.delete_resource(ctx, resource)
 
         # Reset change value to make sure we can call create_resource
@@ -339,8 +550,29 @@ class NetworkHandler(
         ctx: inmanta.agent.handler.HandlerContext,
         resource: NetworkResource,
     ) -> None:
-        # Run the create command on the remote host
-        command = ["podman", "network", "remove", resource.name]
+        response = (
+            self.api_request(
+                ctx,
+                resource,
+                method="DELETE",
+                path=f"/networks/{urllib.parse.quote(resource.name, safe='')}",
+                timeout=5,
+            )
+            if resource.use_api
+            else None
+        )
+        if response is not None:
+            status, content = response
+            self.snapshot(resource, "network").invalidate(resource.name)
+            if status != 200:
+                ctx.error("%(content)s", status=status, content=content)
+                raise RuntimeError("Failed to remove network")
+
+            ctx.set_purged()
+            return
+
+        # Run the remove command on the remote host
+        command = ["podman", "network", "rm", resource.name]
         _, stderr, ret = self.run_command(
             ctx,
             resource,
@@ -348,6 +580,9 @@ class NetworkHandler(
             timeout=5,
         )
 
+        # The network has been removed, we can not trust the snapshot anymore
+        self.snapshot(resource, "network").invalidate(resource.name)
+
         # If the command failed, something went wrong
         if ret != 0:
             ctx.error(
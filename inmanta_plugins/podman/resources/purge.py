@@ -0,0 +1,256 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import json
+
+import inmanta.agent.handler
+import inmanta.execute.proxy
+import inmanta.export
+import inmanta.resources
+import inmanta_plugins.podman.resources.abc
+import inmanta_plugins.podman.resources.container
+import inmanta_plugins.podman.resources.image
+
+# Kinds of objects that can be purged, in the order in which they are removed:
+# the containers first, as they use all the other objects.  Each kind maps to
+# the podman command managing it and the arguments of its ls command.
+PURGE_KINDS = {
+    "container": ["container", "ls", "--all", "--quiet", "--no-trunc"],
+    "image": ["image", "ls"],
+    "network": ["network", "ls"],
+    "volume": ["volume", "ls"],
+}
+
+
+def index_objects(kind: str, objects: list[dict]) -> dict[str, dict]:
+    """
+    Index the objects of the given kind, as returned by their podman ls command
+    (or inspect command, for containers), the same way the handler of each kind
+    does it for its snapshot.
+
+    :param kind: The kind of the objects (container, image, network, volume)
+    :param objects: The objects to index
+    """
+    match kind:
+        case "container":
+            return inmanta_plugins.podman.resources.container.index_containers(objects)
+        case "image":
+            return inmanta_plugins.podman.resources.image.index_images(objects)
+        case "network":
+            return {network["name"]: network for network in objects}
+        case "volume":
+            return {volume["Name"]: volume for volume in objects}
+        case _:
+            raise ValueError(f"Unsupported kind of object: {kind}")
+
+
+def object_key(kind: str, name: str) -> str:
+    """
+    Get the key of the object with the given name in the snapshot of its kind.
+    The images are indexed by their normalized name, or their id.
+
+    :param kind: The kind of the object (container, image, network, volume)
+    :param name: The name of the object, as given in the resource
+    """
+    if kind == "image":
+        return inmanta_plugins.podman.resources.image.normalize_image_name(name) or name
+
+    return name
+
+
+@inmanta.resources.resource(
+    name="podman::Purge",
+    id_attribute="uri",
+    agent="host.name",
+)
+class PurgeResource(
+    inmanta_plugins.podman.resources.abc.ResourceABC,
+    inmanta.resources.PurgeableResource,
+):
+    fields = (
+        "containers",
+        "images",
+        "networks",
+        "volumes",
+        "present",
+    )
+    containers: list[str]
+    images: list[str]
+    networks: list[str]
+    volumes: list[str]
+    present: dict[str, list[str]]
+
+    @classmethod
+    def get_present(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> dict[str, list[str]]:
+        """
+        None of the objects to purge should be left on the host
+        """
+        return {}
+
+
+@inmanta.agent.handler.provider("podman::Purge", "")
+class PurgeHandler(
+    inmanta_plugins.podman.resources.abc.HandlerABC[PurgeResource],
+    inmanta.agent.handler.CRUDHandler[PurgeResource],
+):
+    def list_objects(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: PurgeResource,
+        *,
+        kind: str,
+    ) -> dict[str, dict]:
+        """
+        List all the objects of the given kind owned by the resource owner on
+        the host, the same way their handlers do it, to share the same snapshot.
+        """
+        # Run the ls command on the remote host, the containers are listed by id
+        # and then inspected, as their handler does it
+        command = [
+            "podman",
+            *PURGE_KINDS[kind],
+            *(["--format=json"] if kind != "container" else []),
+        ]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError(f"Failed to list {kind}s")
+
+        if kind != "container":
+            return index_objects(kind, json.loads(stdout))
+
+        ids = stdout.split()
+        if not ids:
+            return {}
+
+        # Inspect all the containers at once
+        command = ["podman", "container", "inspect", *ids]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5 + len(ids),
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to inspect containers")
+
+        return index_objects(kind, json.loads(stdout))
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: PurgeResource,
+    ) -> None:
+        # Lookup all the objects in the snapshot of their kind, only the ones
+        # which still exist need to be removed
+        present: dict[str, list[str]] = {}
+        for kind in PURGE_KINDS:
+            for name in getattr(resource, f"{kind}s"):
+                if (
+                    self.lookup(
+                        ctx,
+                        resource,
+                        kind=kind,
+                        key=object_key(kind, name),
+                        load=lambda: self.list_objects(ctx, resource, kind=kind),
+                    )
+                    is not None
+                ):
+                    present.setdefault(kind, []).append(name)
+
+        resource.present = present
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: PurgeResource,
+        desired: PurgeResource,
+    ) -> dict[str, dict[str, object]]:
+        if desired.purged:
+            # The resource doesn't exist on the host, purging it only stops
+            # removing the objects
+            return {}
+
+        return super().calculate_diff(ctx, current, desired)
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: PurgeResource,
+    ) -> None:
+        present = changes["present"]["current"]
+        assert isinstance(present, dict)
+
+        # Remove all the objects of each kind at once, in order
+        for kind in PURGE_KINDS:
+            names = present.get(kind)
+            if not names:
+                continue
+
+            command = [
+                "podman",
+                kind,
+                "rm",
+                *(["--force"] if kind == "container" else []),
+                *names,
+            ]
+            _, stderr, ret = self.run_command(
+                ctx,
+                resource,
+                command=command,
+                timeout=5 + len(names),
+            )
+
+            # The objects have been removed, we can not trust the snapshot anymore
+            self.snapshot(resource, kind).invalidate(
+                *(object_key(kind, name) for name in names)
+            )
+
+            # If the command failed, something went wrong
+            if ret != 0:
+                ctx.error(
+                    "%(stderr)s",
+                    exit_code=ret,
+                    stderr=stderr,
+                )
+                raise RuntimeError(f"Failed to remove {kind}s")
+
+        ctx.set_updated()
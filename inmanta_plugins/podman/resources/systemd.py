@@ -0,0 +1,1046 @@
+"""
+Copyright 2026 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import hashlib
+import json
+import typing
+
+import inmanta.agent.handler
+import inmanta.execute.proxy
+import inmanta.export
+import inmanta.resources
+import inmanta_plugins.podman.resources.abc
+import inmanta_plugins.podman.resources.image
+import inmanta_podman
+
+# Properties of the units read by the handler
+UNIT_PROPERTIES = ["Id", "LoadState", "ActiveState", "UnitFileState"]
+
+# Active states in which the unit is considered active, as for
+# `systemctl is-active`, plus the transitional ones which will end up active
+ACTIVE_STATES = {"active", "activating", "reloading", "refreshing"}
+
+# Unit file states in which the unit is considered enabled or disabled.  The
+# units in any other state (static, generated, transient, masked, ...) can not
+# be enabled nor disabled, we don't try to change them.
+ENABLED_STATES = {"enabled", "enabled-runtime", "alias", "indirect"}
+DISABLED_STATES = {"disabled"}
+
+
+def show_blocks(stdout: str) -> list[dict[str, str]]:
+    """
+    Parse the output of the `systemctl show` command, which prints one block
+    of properties per unit, separated by empty lines.
+
+    :param stdout: The output of the command.
+    """
+    return [
+        dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        for block in stdout.strip().split("\n\n")
+        if block.strip()
+    ]
+
+
+def parse_show_output(stdout: str, units: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Parse the output of the `systemctl show` command, for the given units.  The
+    command prints one block of properties per unit, separated by empty lines,
+    in the same order as the units on the command line.
+
+    :param stdout: The output of the command.
+    :param units: The units passed to the command, in the same order.
+    """
+    blocks = show_blocks(stdout)
+    if len(blocks) != len(units):
+        raise ValueError(
+            f"Expected the properties of {len(units)} units, got {len(blocks)}: {stdout}"
+        )
+
+    return dict(zip(units, blocks))
+
+
+def unit_template(unit: str) -> str | None:
+    """
+    Get the name of the template of the given unit, if it is an instance of a
+    template unit, i.e. container-worker@.service for container-worker@1.service.
+
+    :param unit: The name of the unit.
+    """
+    if "@" not in unit:
+        return None
+
+    prefix, suffix = unit.split("@", 1)
+    return f"{prefix}@.{suffix.rsplit('.', 1)[-1]}"
+
+
+def index_show_output(stdout: str) -> dict[str, dict]:
+    """
+    Index the units shown by the `systemctl show '*'` command, i.e. all the units
+    loaded by the manager, by their id.  The template units, which can not be
+    loaded themselves, are indexed with the list of their loaded instances.
+
+    :param stdout: The output of the command.
+    """
+    index: dict[str, dict] = {}
+    for unit in show_blocks(stdout):
+        index[unit["Id"]] = unit
+        template = unit_template(unit["Id"])
+        if template is not None:
+            index.setdefault(template, {"Id": template, "Instances": []})[
+                "Instances"
+            ].append(unit["Id"])
+
+    return index
+
+
+def unit_snapshot_kind(systemctl_command: list[str]) -> str:
+    """
+    Get the kind of the snapshot holding the units of the systemd manager
+    reached with the given systemctl command.
+
+    :param systemctl_command: The systemctl command of the manager.
+    """
+    return f"unit:{' '.join(systemctl_command)}"
+
+
+def read_unit_state(unit: dict[str, str]) -> tuple[bool, bool | None]:
+    """
+    Get whether the unit is active, and whether it is enabled, from its
+    properties.  The enabled state is None when the unit can not be enabled
+    nor disabled.
+
+    :param unit: The properties of the unit, as returned by systemctl show.
+    """
+    if unit.get("UnitFileState") in ENABLED_STATES:
+        enabled = True
+    elif unit.get("UnitFileState") in DISABLED_STATES:
+        enabled = False
+    else:
+        enabled = None
+
+    return unit.get("ActiveState") in ACTIVE_STATES, enabled
+
+
+def instance_units(template: str, instances: list[str]) -> list[str]:
+    """
+    Get the names of the given instances of a template unit, i.e. the instances
+    1 and 2 of container-worker@.service are container-worker@1.service and
+    container-worker@2.service.
+
+    :param template: The name of the template unit.
+    :param instances: The names of the instances.
+    """
+    prefix, suffix = template.split("@.", 1)
+    return [f"{prefix}@{instance}.{suffix}" for instance in instances]
+
+
+def config_hash_with_image(config_hash: str | None, image_id: str | None) -> str | None:
+    """
+    Add the id of the image used by a unit to the hash of its config.
+
+    :param config_hash: The hash of the config files of the unit, None if the
+        config of the unit is not tracked.
+    :param image_id: The id of the image used by the unit, None if the unit
+        doesn't use any image, and an empty string if the image is not on
+        the host.
+    """
+    if config_hash is None or image_id is None:
+        return config_hash
+
+    return hashlib.sha256(f"{config_hash}:{image_id}".encode()).hexdigest()
+
+
+class SystemdResource(
+    inmanta_plugins.podman.resources.abc.ResourceABC,
+    inmanta.resources.PurgeableResource,
+):
+    fields = ("systemctl_command",)
+    systemctl_command: list[str]
+
+
+SR = typing.TypeVar("SR", bound=SystemdResource)
+
+
+class SystemdHandler(inmanta_plugins.podman.resources.image.LocalImagesHandler[SR]):
+    def show_units(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: SR,
+        units: list[str],
+    ) -> dict[str, dict]:
+        """
+        Read the state of all the given units, with a single systemctl show
+        command, and index them by the name they have been queried with.
+        """
+        command = [
+            *resource.systemctl_command,
+            "show",
+            f"--property={','.join(UNIT_PROPERTIES)}",
+            *units,
+        ]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5 + len(units),
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to show units")
+
+        return parse_show_output(stdout, units)
+
+    def list_units(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: SR,
+    ) -> dict[str, dict]:
+        """
+        Read the state of all the units loaded by the systemd manager, with a
+        single systemctl show command, and index them by id.
+        """
+        command = [
+            *resource.systemctl_command,
+            "show",
+            f"--property={','.join(UNIT_PROPERTIES)}",
+            "*",
+        ]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=30,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to show units")
+
+        return index_show_output(stdout)
+
+    def read_units(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: SR,
+        units: list[str],
+    ) -> dict[str, dict]:
+        """
+        Read the state of the given units from the snapshot of the units of the
+        systemd manager.  The units which are not loaded by the manager are not
+        in the snapshot, they are all shown with a single command.
+        """
+        states = {
+            unit: self.lookup(
+                ctx,
+                resource,
+                kind=unit_snapshot_kind(resource.systemctl_command),
+                key=unit,
+                load=lambda: self.list_units(ctx, resource),
+            )
+            for unit in units
+        }
+        missing = [unit for unit, state in states.items() if state is None]
+        if missing:
+            states.update(self.show_units(ctx, resource, missing))
+
+        return typing.cast(dict[str, dict], states)
+
+    def systemctl_units(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: SR,
+        *,
+        operation: str,
+        units: list[str],
+    ) -> None:
+        """
+        Run the given systemctl operation (start, stop, restart, try-restart,
+        enable, disable, daemon-reload) on all the given units at once, i.e. the
+        unit of the resource, all the instances of a template unit, or all the
+        units of a bundle.
+        """
+        if not units and operation != "daemon-reload":
+            return
+
+        command = [*resource.systemctl_command, operation, *units]
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=300,
+        )
+
+        # The units have been modified, we can not trust the snapshot of the
+        # units of the manager anymore, a reload modifies all of them
+        self.snapshot(
+            resource, unit_snapshot_kind(resource.systemctl_command)
+        ).invalidate(*units, *{unit_template(unit) or unit for unit in units})
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError(f"Failed to {operation} units {units}")
+
+
+@inmanta.resources.resource(
+    name="podman::services::UnitState",
+    id_attribute="uri",
+    agent="host.name",
+)
+class UnitStateResource(SystemdResource):
+    fields = (
+        "active",
+        "enabled",
+        "config_hash",
+        "image",
+        "restart_unit",
+        "instances",
+    )
+    active: bool | None
+    enabled: bool | None
+    config_hash: str | None
+    image: str | None
+    restart_unit: str
+    instances: list[str]
+
+    @classmethod
+    def get_config_hash(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str | None:
+        """
+        Hash the content of all the config files of the unit, and the name of
+        its image.  The unit is restarted when this hash changes.  The id of the
+        image can only be resolved on the host, the handler adds it to the hash.
+        Units which should not be running don't need to be restarted, their hash
+        is None.
+        """
+        if not entity.active or not entity.config_files:
+            return None
+
+        config = {
+            "files": {
+                file.path: file.content
+                for file in entity.config_files
+                if not file.purged
+            },
+            "image": entity.image,
+        }
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def get_restart_unit(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> str:
+        """
+        The unit to restart when the config changes, the unit itself if no
+        other unit is specified.
+        """
+        return entity.restart_unit if entity.restart_unit is not None else entity.name
+
+
+@inmanta.agent.handler.provider("podman::services::UnitState", "")
+class UnitStateHandler(
+    SystemdHandler[UnitStateResource],
+    inmanta.agent.handler.CRUDHandler[UnitStateResource],
+):
+    def read_config_hash(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: UnitStateResource,
+    ) -> None:
+        """
+        Read the hash of the config the unit has been (re)started with.
+        """
+        if resource.config_hash is None:
+            return
+
+        with self.owner_proxy(ctx, resource) as proxy:
+            hashes = proxy.remote_call(
+                inmanta_podman.unit_config_hashes,
+                "--user" in resource.systemctl_command,
+                [resource.restart_unit],
+            )
+        resource.config_hash = hashes[resource.restart_unit]
+
+    def read_template(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: UnitStateResource,
+    ) -> None:
+        """
+        Read the state of the instances of a template unit.  The unit is active
+        (or enabled) if all its desired instances are.  Its current instances are
+        the desired ones, followed by the other ones which are active or enabled,
+        and should therefore be stopped and disabled.
+        """
+        # Read the state of all the instances which are desired or loaded
+        # from the snapshot of the units of the manager
+        desired = instance_units(resource.name, resource.instances)
+        template = self.lookup(
+            ctx,
+            resource,
+            kind=unit_snapshot_kind(resource.systemctl_command),
+            key=resource.name,
+            load=lambda: self.list_units(ctx, resource),
+        )
+        loaded = template["Instances"] if template is not None else []
+        units = [*desired, *sorted(set(loaded) - set(desired))]
+        states = {
+            unit: read_unit_state(properties)
+            for unit, properties in self.read_units(ctx, resource, units).items()
+        }
+        prefix, suffix = resource.name.split("@.", 1)
+        extra = [
+            unit.removeprefix(f"{prefix}@").removesuffix(f".{suffix}")
+            for unit in units[len(desired) :]
+            if states[unit][0] or states[unit][1]
+        ]
+
+        ctx.debug(
+            "Template unit %(unit)s has %(active)d/%(desired)d active instances, and %(extra)d extra instances",
+            unit=resource.name,
+            active=sum(1 for unit in desired if states[unit][0]),
+            desired=len(desired),
+            extra=len(extra),
+        )
+
+        if resource.purged:
+            # The instances should be stopped and disabled, the unit "exists"
+            # as long as any of them isn't
+            if not any(active or enabled for active, enabled in states.values()):
+                raise inmanta.agent.handler.ResourcePurged()
+            resource.instances = [*resource.instances, *extra]
+            return
+
+        # Only report the state that we manage, and that can be changed.  The
+        # instances are running if they all are, and stopped if none of them is
+        if resource.active is not None:
+            resource.active = (all if resource.active else any)(
+                states[unit][0] for unit in desired
+            )
+        if resource.enabled is not None:
+            resource.enabled = (all if resource.enabled else any)(
+                bool(states[unit][1]) for unit in desired
+            )
+        resource.instances = [*resource.instances, *extra]
+
+        self.read_config_hash(ctx, resource)
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: UnitStateResource,
+    ) -> None:
+        if "@." in resource.name:
+            # The unit is a template, we manage its instances
+            self.read_template(ctx, resource)
+            return
+
+        unit = self.read_units(ctx, resource, [resource.name])[resource.name]
+        ctx.debug(
+            "Unit %(unit)s is %(active_state)s and %(unit_file_state)s",
+            unit=resource.name,
+            active_state=unit.get("ActiveState"),
+            unit_file_state=unit.get("UnitFileState") or unit.get("LoadState"),
+        )
+
+        active, enabled = read_unit_state(unit)
+
+        if resource.purged:
+            # The unit should be stopped and disabled, it "exists" as long
+            # as it isn't
+            if not active and not enabled:
+                raise inmanta.agent.handler.ResourcePurged()
+            resource.active = active
+            resource.enabled = enabled
+            return
+
+        # Only report the state that we manage, and that can be changed
+        if resource.active is not None:
+            resource.active = active
+        if resource.enabled is not None and enabled is not None:
+            resource.enabled = enabled
+
+        self.read_config_hash(ctx, resource)
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: UnitStateResource,
+        desired: UnitStateResource,
+    ) -> dict[str, dict[str, object]]:
+        # Add the id of the image the unit uses to its config hash, if the image
+        # is not on the host (yet), its id will be added once it is, which will
+        # restart the unit
+        name = (
+            inmanta_plugins.podman.resources.image.normalize_image_name(desired.image)
+            if desired.image is not None
+            else None
+        )
+        if desired.config_hash is not None and name is not None:
+            image = self.lookup_local_image(ctx, desired, key=name)
+            desired = desired.clone(
+                config_hash=config_hash_with_image(
+                    desired.config_hash,
+                    image["Id"] if image is not None else "",
+                ),
+            )
+
+        return super().calculate_diff(ctx, current, desired)
+
+    def update_template(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: UnitStateResource,
+    ) -> None:
+        """
+        Update the instances of a template unit: apply the desired state to all
+        the desired instances, stop and disable all the other ones.
+        """
+        units = instance_units(resource.name, resource.instances)
+        if "enabled" in changes:
+            self.systemctl_units(
+                ctx,
+                resource,
+                operation="enable" if resource.enabled else "disable",
+                units=units,
+            )
+        if "active" in changes:
+            self.systemctl_units(
+                ctx,
+                resource,
+                operation="start" if resource.active else "stop",
+                units=units,
+            )
+        if "instances" in changes:
+            extra = instance_units(
+                resource.name,
+                [
+                    instance
+                    for instance in typing.cast(
+                        list[str], changes["instances"]["current"]
+                    )
+                    if instance not in resource.instances
+                ],
+            )
+            self.systemctl_units(ctx, resource, operation="stop", units=extra)
+            self.systemctl_units(ctx, resource, operation="disable", units=extra)
+        if "config_hash" in changes:
+            if (
+                changes["config_hash"]["current"] is not None
+                and "active" not in changes
+            ):
+                # The instances have been started with another config, restart them
+                self.systemctl_units(
+                    ctx,
+                    resource,
+                    operation="try-restart",
+                    units=units,
+                )
+
+            with self.owner_proxy(ctx, resource) as proxy:
+                proxy.remote_call(
+                    inmanta_podman.record_unit_config_hashes,
+                    "--user" in resource.systemctl_command,
+                    {resource.restart_unit: changes["config_hash"]["desired"]},
+                )
+
+    def create_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: UnitStateResource,
+    ) -> None:
+        # The unit state is never purged, unless the resource is, there is
+        # nothing to create
+        raise RuntimeError(f"Unit {resource.name} can not be created")
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: UnitStateResource,
+    ) -> None:
+        if "@." in resource.name:
+            # The unit is a template, we manage its instances
+            self.update_template(ctx, changes, resource)
+            ctx.set_updated()
+            return
+
+        if "enabled" in changes:
+            self.systemctl_units(
+                ctx,
+                resource,
+                operation="enable" if resource.enabled else "disable",
+                units=[resource.name],
+            )
+        if "active" in changes:
+            self.systemctl_units(
+                ctx,
+                resource,
+                operation="start" if resource.active else "stop",
+                units=[resource.name],
+            )
+        if "config_hash" in changes:
+            config_hash = changes["config_hash"]["desired"]
+            if (
+                changes["config_hash"]["current"] is not None
+                and "active" not in changes
+            ):
+                # The unit has been started with another config, restart it.
+                # When no config has been recorded, the unit has been started
+                # since the manager started, we adopt it as it is.
+                self.systemctl_units(
+                    ctx,
+                    resource,
+                    operation="try-restart",
+                    units=[resource.restart_unit],
+                )
+
+            with self.owner_proxy(ctx, resource) as proxy:
+                proxy.remote_call(
+                    inmanta_podman.record_unit_config_hashes,
+                    "--user" in resource.systemctl_command,
+                    {resource.restart_unit: config_hash},
+                )
+
+        ctx.set_updated()
+
+    def delete_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: UnitStateResource,
+    ) -> None:
+        if "@." in resource.name:
+            # Stop all the instances of the template unit, which have been read
+            # in the current state of the resource
+            units = instance_units(resource.name, resource.instances)
+            self.systemctl_units(ctx, resource, operation="stop", units=units)
+            self.systemctl_units(ctx, resource, operation="disable", units=units)
+            ctx.set_purged()
+            return
+
+        # Stop the unit first, then make sure it doesn't start again on boot
+        self.systemctl_units(ctx, resource, operation="stop", units=[resource.name])
+        self.systemctl_units(ctx, resource, operation="disable", units=[resource.name])
+        ctx.set_purged()
+
+
+@inmanta.resources.resource(
+    name="podman::services::ServiceBundle",
+    id_attribute="uri",
+    agent="host.name",
+)
+class ServiceBundleResource(SystemdResource):
+    fields = (
+        "directories",
+        "files",
+        "units",
+    )
+    directories: list[dict]
+    files: list[dict]
+    units: list[dict]
+
+    @classmethod
+    def get_directories(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[dict]:
+        """
+        Collect the directories of all the services of the bundle.
+        """
+        directories = {
+            directory.path: {
+                "path": directory.path,
+                "permissions": directory.permissions,
+                "owner": directory.owner,
+                "group": directory.group,
+            }
+            for service in entity.manager.services
+            for directory in [
+                service._systemd_config_dir,
+                service._container_config_dir,
+            ]
+            if directory is not None
+        }
+        return sorted(directories.values(), key=lambda d: d["path"])
+
+    @classmethod
+    def get_files(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[dict]:
+        """
+        Collect the unit files (service, timer, socket and proxy) of all the services
+        of the bundle.  The files which should be removed only keep their path.
+        """
+        files = {
+            file.path: (
+                {"path": file.path, "purged": True}
+                if file.purged
+                else {
+                    "path": file.path,
+                    "content": file.content,
+                    "permissions": file.permissions,
+                    "owner": file.owner,
+                    "group": file.group,
+                    "purged": False,
+                }
+            )
+            for service in entity.manager.services
+            for file in [service.unit, service.timer, service.socket, service.proxy]
+            if file is not None
+        }
+        return sorted(files.values(), key=lambda f: f["path"])
+
+    @classmethod
+    def get_units(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> list[dict]:
+        """
+        Collect the desired state of the main unit of all the services of the
+        bundle.  The units of the services in the restart state are restarted
+        on each deployment, the other ones when their config hash changes.
+        """
+        units = [
+            {
+                "name": service._unit_state.name,
+                "active": service._unit_state.active,
+                "enabled": service._unit_state.enabled,
+                "restart": service.state == "restart",
+                "config_hash": UnitStateResource.get_config_hash(
+                    exporter, service._unit_state
+                ),
+                "image": service._unit_state.image,
+                "restart_unit": UnitStateResource.get_restart_unit(
+                    exporter, service._unit_state
+                ),
+            }
+            for service in entity.manager.services
+        ]
+        return sorted(units, key=lambda u: u["name"])
+
+
+@inmanta.agent.handler.provider("podman::services::ServiceBundle", "")
+class ServiceBundleHandler(
+    SystemdHandler[ServiceBundleResource],
+    inmanta.agent.handler.CRUDHandler[ServiceBundleResource],
+):
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ServiceBundleResource,
+    ) -> None:
+        # Read all the files and directories at once
+        with self.owner_proxy(ctx, resource) as proxy:
+            states = typing.cast(
+                dict[str, dict | None],
+                proxy.remote_call(
+                    inmanta_podman.file_states,
+                    [d["path"] for d in resource.directories]
+                    + [f["path"] for f in resource.files],
+                ),
+            )
+
+        def current(desired: dict, state: dict | None) -> dict:
+            # Only report the attributes which are managed
+            if state is None:
+                return {"path": desired["path"], "purged": True}
+            return {
+                **{
+                    k: state.get(k) if v is not None else None
+                    for k, v in desired.items()
+                },
+                "path": desired["path"],
+                "purged": False,
+            }
+
+        resource.files = [current(f, states[f["path"]]) for f in resource.files]
+        resource.directories = [
+            {k: v for k, v in current(d, states[d["path"]]).items() if k in d}
+            for d in resource.directories
+        ]
+
+        # Read the state of all the units from the snapshot of the units of
+        # the manager, shared with its UnitState resources
+        properties = self.read_units(ctx, resource, [u["name"] for u in resource.units])
+
+        # Read the hash of the config the units have been (re)started with
+        restart_units = [
+            u["restart_unit"] for u in resource.units if u["config_hash"] is not None
+        ]
+        hashes = {}
+        if restart_units:
+            with self.owner_proxy(ctx, resource) as proxy:
+                hashes = proxy.remote_call(
+                    inmanta_podman.unit_config_hashes,
+                    "--user" in resource.systemctl_command,
+                    restart_units,
+                )
+
+        units = []
+        for unit in resource.units:
+            active, enabled = read_unit_state(properties[unit["name"]])
+            units.append(
+                {
+                    **unit,
+                    "active": active if unit["active"] is not None else None,
+                    "enabled": (
+                        enabled
+                        if unit["enabled"] is not None and enabled is not None
+                        else unit["enabled"]
+                    ),
+                    # A restart is never done, it is always needed
+                    "restart": False,
+                    "config_hash": (
+                        hashes.get(unit["restart_unit"])
+                        if unit["config_hash"] is not None
+                        else None
+                    ),
+                }
+            )
+        resource.units = units
+
+    def removed(self, resource: ServiceBundleResource) -> ServiceBundleResource:
+        """
+        Get the state of the bundle once it is removed: all its units are stopped
+        and disabled, and all its files are removed.  The directories are left
+        untouched, they might be used by other services.
+        """
+        return resource.clone(
+            purged=False,
+            directories=[],
+            files=[{"path": f["path"], "purged": True} for f in resource.files],
+            units=[
+                {
+                    **unit,
+                    "active": False,
+                    "enabled": False,
+                    "restart": False,
+                    "config_hash": None,
+                }
+                for unit in resource.units
+            ],
+        )
+
+    def removal_changes(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ServiceBundleResource,
+    ) -> dict[str, dict[str, object]]:
+        """
+        Read the current state of the bundle, and compare it to its removed
+        state.
+        """
+        removed = self.removed(resource)
+        current = removed.clone()
+        self.read_resource(ctx, current)
+        return super().calculate_diff(ctx, current, removed)
+
+    def calculate_diff(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        current: ServiceBundleResource,
+        desired: ServiceBundleResource,
+    ) -> dict[str, dict[str, object]]:
+        if desired.purged:
+            # The bundle is purged once all its units are stopped and disabled,
+            # and all its files are removed
+            if not self.removal_changes(ctx, desired):
+                return {}
+            return {"purged": {"current": False, "desired": True}}
+
+        # Add the id of the image each unit uses to its config hash, the same
+        # way the UnitState handler does it
+        def image_id(image: str | None) -> str | None:
+            name = (
+                inmanta_plugins.podman.resources.image.normalize_image_name(image)
+                if image is not None
+                else None
+            )
+            if name is None:
+                return None
+            local_image = self.lookup_local_image(ctx, desired, key=name)
+            return local_image["Id"] if local_image is not None else ""
+
+        desired = desired.clone(
+            units=[
+                {
+                    **unit,
+                    "config_hash": config_hash_with_image(
+                        unit["config_hash"],
+                        (
+                            image_id(unit["image"])
+                            if unit["config_hash"] is not None
+                            else None
+                        ),
+                    ),
+                }
+                for unit in desired.units
+            ],
+        )
+
+        return super().calculate_diff(ctx, current, desired)
+
+    def create_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ServiceBundleResource,
+    ) -> None:
+        # The bundle is never purged, unless the resource is, there is
+        # nothing to create
+        raise RuntimeError(f"Service bundle {resource.name} can not be created")
+
+    def apply(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: ServiceBundleResource,
+    ) -> None:
+        """
+        Bring the files and the units of the bundle from their current state,
+        in the changes, to the desired state of the resource.
+        """
+
+        def current(field: str) -> list[dict]:
+            if field not in changes:
+                return getattr(resource, field)
+            return typing.cast(list[dict], changes[field]["current"])
+
+        # Select the units for which the given key should change to the
+        # given value, the desired config hash of the units is only known
+        # once the diff has been calculated
+        current_units = {u["name"]: u for u in current("units")}
+        desired_units = typing.cast(
+            list[dict],
+            changes["units"]["desired"] if "units" in changes else resource.units,
+        )
+
+        def units(key: str, value: bool) -> list[str]:
+            return [
+                u["name"]
+                for u in desired_units
+                if u[key] is value and current_units[u["name"]][key] is not value
+            ]
+
+        # Stop and disable the units first, their files might be removed
+        self.systemctl_units(
+            ctx, resource, operation="stop", units=units("active", False)
+        )
+        self.systemctl_units(
+            ctx, resource, operation="disable", units=units("enabled", False)
+        )
+
+        # Write all the files which changed, then reload the manager once
+        directories = [
+            d for d in resource.directories if d not in current("directories")
+        ]
+        files = [f for f in resource.files if f not in current("files")]
+        if directories or files:
+            with self.owner_proxy(ctx, resource) as proxy:
+                proxy.remote_call(inmanta_podman.apply_files, directories, files)
+            self.systemctl_units(ctx, resource, operation="daemon-reload", units=[])
+
+        # Then enable, start and restart the units
+        self.systemctl_units(
+            ctx, resource, operation="enable", units=units("enabled", True)
+        )
+        self.systemctl_units(
+            ctx, resource, operation="start", units=units("active", True)
+        )
+        self.systemctl_units(
+            ctx, resource, operation="restart", units=units("restart", True)
+        )
+
+        # Restart the running units which have been started with another config,
+        # then record the config of all the units which have been (re)started
+        started = units("active", True)
+        configs = {
+            u["restart_unit"]: (
+                u["config_hash"],
+                current_units[u["name"]]["config_hash"],
+            )
+            for u in desired_units
+            if u["config_hash"] is not None
+            and u["config_hash"] != current_units[u["name"]]["config_hash"]
+        }
+        self.systemctl_units(
+            ctx,
+            resource,
+            operation="try-restart",
+            units=[
+                u["restart_unit"]
+                for u in desired_units
+                if u["restart_unit"] in configs
+                and configs[u["restart_unit"]][1] is not None
+                and u["name"] not in started
+            ],
+        )
+        if configs:
+            with self.owner_proxy(ctx, resource) as proxy:
+                proxy.remote_call(
+                    inmanta_podman.record_unit_config_hashes,
+                    "--user" in resource.systemctl_command,
+                    {unit: hashes[0] for unit, hashes in configs.items()},
+                )
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: ServiceBundleResource,
+    ) -> None:
+        self.apply(ctx, changes, resource)
+        ctx.set_updated()
+
+    def delete_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: ServiceBundleResource,
+    ) -> None:
+        # Stop and disable all the units, remove all the files and reload the
+        # manager, the same way the services removed from the bundle are
+        self.apply(
+            ctx,
+            self.removal_changes(ctx, resource),
+            self.removed(resource),
+        )
+        ctx.set_purged()
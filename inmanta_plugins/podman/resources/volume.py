@@ -0,0 +1,204 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import json
+
+import inmanta.agent.handler
+import inmanta.execute.proxy
+import inmanta.export
+import inmanta.resources
+import inmanta_plugins.podman.resources.abc
+
+
+@inmanta.resources.resource(
+    name="podman::NamedVolume",
+    id_attribute="uri",
+    agent="host.name",
+)
+class NamedVolumeResource(
+    inmanta_plugins.podman.resources.abc.ResourceABC,
+    inmanta.resources.PurgeableResource,
+):
+    fields = ("config",)
+    config: dict
+
+    @classmethod
+    def get_config(
+        cls,
+        exporter: inmanta.export.Exporter,
+        entity: inmanta.execute.proxy.DynamicProxy,
+    ) -> dict:
+        """
+        Build the volume expected config, with the same keys as the ones
+        returned by the inspect command.
+        """
+        return {
+            "Driver": entity.driver if entity.driver is not None else "local",
+            "Labels": dict(entity.labels),
+            "Options": dict(entity.options),
+        }
+
+
+def build_create_command(name: str, config: dict) -> list[str]:
+    """
+    Helper method to build the podman volume create command based on
+    the config that can be read from the resource.
+
+    :param name: The name of the volume.
+    :param config: The config that should be converted to a create command.
+    """
+    cmd = ["podman", "volume", "create", f"--driver={config['Driver']}"]
+    cmd.extend([f"--opt={k}={v}" for k, v in config["Options"].items()])
+    cmd.extend([f"--label={k}={v}" for k, v in config["Labels"].items()])
+    cmd.append(name)
+
+    return cmd
+
+
+@inmanta.agent.handler.provider("podman::NamedVolume", "")
+class NamedVolumeHandler(
+    inmanta_plugins.podman.resources.abc.HandlerABC[NamedVolumeResource],
+    inmanta.agent.handler.CRUDHandler[NamedVolumeResource],
+):
+    def list_volumes(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NamedVolumeResource,
+    ) -> dict[str, dict]:
+        """
+        List all the volumes owned by the resource owner on the host, and
+        index them by name.
+        """
+        # Run the ls command on the remote host, its output contains the
+        # config of each volume, the same way the inspect command does
+        command = ["podman", "volume", "ls", "--format=json"]
+        stdout, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to list volumes")
+
+        return {volume["Name"]: volume for volume in json.loads(stdout)}
+
+    def read_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NamedVolumeResource,
+    ) -> None:
+        volume = self.lookup(
+            ctx,
+            resource,
+            kind="volume",
+            key=resource.name,
+            load=lambda: self.list_volumes(ctx, resource),
+        )
+
+        # If the volume is not in the snapshot, our volume doesn't exist
+        if volume is None:
+            raise inmanta.agent.handler.ResourcePurged()
+
+        # Only keep the keys that we manage, the snapshot is shared, we
+        # should never modify it
+        resource.config = {
+            "Driver": volume.get("Driver"),
+            "Labels": dict(volume.get("Labels") or {}),
+            "Options": dict(volume.get("Options") or {}),
+        }
+
+    def create_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NamedVolumeResource,
+    ) -> None:
+        # Run the create command on the remote host
+        command = build_create_command(resource.name, resource.config)
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # The volume has been modified, we can not trust the snapshot anymore
+        self.snapshot(resource, "volume").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to create volume")
+
+        ctx.set_created()
+
+    def update_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        changes: dict[str, dict[str, object]],
+        resource: NamedVolumeResource,
+    ) -> None:
+        # The config of a volume can not be changed, and re-creating it would
+        # drop its content, this is left to the user
+        ctx.error(
+            "The config of volume %(volume)s doesn't match the desired one",
+            volume=resource.name,
+            changes=changes,
+        )
+        raise RuntimeError(
+            f"Volume {resource.name} can not be updated, it must be removed first"
+        )
+
+    def delete_resource(
+        self,
+        ctx: inmanta.agent.handler.HandlerContext,
+        resource: NamedVolumeResource,
+    ) -> None:
+        # Run the remove command on the remote host
+        command = ["podman", "volume", "rm", resource.name]
+        _, stderr, ret = self.run_command(
+            ctx,
+            resource,
+            command=command,
+            timeout=5,
+        )
+
+        # The volume has been removed, we can not trust the snapshot anymore
+        self.snapshot(resource, "volume").invalidate(resource.name)
+
+        # If the command failed, something went wrong
+        if ret != 0:
+            ctx.error(
+                "%(stderr)s",
+                exit_code=ret,
+                stderr=stderr,
+            )
+            raise RuntimeError("Failed to remove volume")
+
+        ctx.set_purged()
@@ -0,0 +1,724 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+
+This file should stay compatible with as many versions of python as possible
+as its code will be pickled and sent to remote devices which might have very
+old python versions installed.  It should only depend on the standard library.
+Minimal python version we aim at is python3.6
+"""
+
+import collections
+import grp
+import hashlib
+import http.client
+import json
+import os
+import posixpath
+import pwd
+import re
+import selectors
+import socket
+import stat
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import typing
+
+# Version of the libpod api that we use, all the endpoints we use are available
+# since this version
+LIBPOD_API_PREFIX = "/v4.0.0/libpod"
+
+# Pool of persistent connections to the libpod api, indexed by the path of
+# the socket they are connected to.  As the mitogen context is long-lived,
+# these connections are reused across all the calls for the same owner.
+_connections = {}  # type: typing.Dict[str, UnixHTTPConnection]
+_connections_lock = threading.Lock()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    Http connection going over a unix socket instead of a tcp socket.
+    """
+
+    def __init__(self, socket_path: str, timeout: typing.Optional[int] = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def api_socket_path(owner: typing.Optional[str] = None) -> typing.Optional[str]:
+    """
+    Get the path to the socket of the podman api service of the given user,
+    or None if the socket doesn't exist or can not be used by the current user.
+
+    :param owner: The user owning the podman service, if None, the current user
+        is used.
+    """
+    uid = os.getuid() if owner is None else pwd.getpwnam(owner).pw_uid
+    if uid == 0:
+        path = "/run/podman/podman.sock"
+    else:
+        path = "/run/user/%d/podman/podman.sock" % uid
+
+    if not os.path.exists(path) or not os.access(path, os.R_OK | os.W_OK):
+        return None
+
+    return path
+
+
+def api_request(
+    method: str,
+    path: str,
+    body: typing.Optional[str] = None,
+    timeout: typing.Optional[int] = None,
+) -> typing.Optional[typing.Tuple[int, str]]:
+    """
+    Send a request to the libpod api of the current user, and return the status
+    code and the body of the response.  Return None if the api socket of the
+    user is not available.
+
+    :param method: The http method of the request.
+    :param path: The path of the endpoint, relative to the libpod api root.
+    :param body: The json-serialized body of the request, if any.
+    :param timeout: The maximum duration the request can take.
+    """
+    socket_path = api_socket_path()
+    if socket_path is None:
+        return None
+
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+
+    with _connections_lock:
+        for attempt in range(2):
+            connection = _connections.get(socket_path)
+            if connection is None:
+                connection = UnixHTTPConnection(socket_path)
+                _connections[socket_path] = connection
+
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+
+            try:
+                connection.request(method, LIBPOD_API_PREFIX + path, body, headers)
+                response = connection.getresponse()
+                return response.status, response.read().decode("utf-8")
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ):
+                # The server closed our persistent connection, open a new one
+                # and try again, only once
+                connection.close()
+                del _connections[socket_path]
+                if attempt > 0:
+                    raise
+            except Exception:
+                # Don't keep a connection in an unknown state in the pool
+                connection.close()
+                del _connections[socket_path]
+                raise
+
+    raise RuntimeError("Unreachable")
+
+
+def host_facts(timeout: typing.Optional[int] = None) -> typing.Dict[str, typing.Any]:
+    """
+    Gather the facts about the host and the current user that the podman
+    handlers need.  The podman related facts are None if podman can not
+    be queried.
+
+    :param timeout: The maximum duration the podman info command can take.
+    """
+    facts = {
+        "user": pwd.getpwuid(os.getuid()).pw_name,
+        "os": None,
+        "arch": None,
+        "podman_version": None,
+        "storage_driver": None,
+        "network_backend": None,
+        "registry_auth_file": os.environ.get("REGISTRY_AUTH_FILE"),
+    }  # type: typing.Dict[str, typing.Any]
+
+    try:
+        result = subprocess.run(
+            ["podman", "info", "--format=json"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return facts
+
+    if result.returncode != 0:
+        return facts
+
+    info = json.loads(result.stdout.decode("utf-8"))
+    facts["os"] = info.get("host", {}).get("os")
+    facts["arch"] = info.get("host", {}).get("arch")
+    facts["network_backend"] = info.get("host", {}).get("networkBackend")
+    facts["storage_driver"] = info.get("store", {}).get("graphDriverName")
+    facts["podman_version"] = info.get("version", {}).get("Version")
+    return facts
+
+
+def fingerprint(paths: typing.List[str]) -> str:
+    """
+    Compute a content hash of the given files and directories.  Directories
+    are walked recursively, in a stable order, and the relative path, the
+    mode and the content of each file (or the target of each symlink) is
+    included in the hash.  Paths which don't exist are hashed as such, so
+    that their creation changes the fingerprint.
+
+    :param paths: The files and directories to hash.
+    """
+    digest = hashlib.sha256()
+
+    def hash_file(path: str, name: str) -> None:
+        stat = os.lstat(path)
+        digest.update((f"{name}\0{stat.st_mode:o}\0").encode())
+        if os.path.islink(path):
+            digest.update(os.readlink(path).encode("utf-8"))
+        elif os.path.isfile(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        digest.update(b"\0")
+
+    for path in paths:
+        digest.update(("%s\0" % path).encode("utf-8"))
+        if not os.path.lexists(path):
+            digest.update(b"<missing>\0")
+        elif not os.path.isdir(path) or os.path.islink(path):
+            hash_file(path, ".")
+        else:
+            for root, dirs, files in os.walk(path):
+                # Walk the tree in a stable order
+                dirs.sort()
+                for name in sorted(dirs + files):
+                    full_path = os.path.join(root, name)
+                    hash_file(full_path, os.path.relpath(full_path, path))
+
+    return digest.hexdigest()
+
+
+def parse_progress(progress: typing.Dict[str, object], line: str) -> None:
+    """
+    Update the progress of a podman build or pull command, based on a line
+    of its output.
+
+    :param progress: The progress so far, it is updated in place.
+    :param line: The line of output to parse.
+    """
+    step = re.match(r"^STEP (\d+/\d+)", line)
+    if step is not None:
+        progress["step"] = step.group(1)
+
+    blob = re.match(r"^Copying blob (?:sha256:)?([0-9a-f]+)(.*)$", line)
+    if blob is not None:
+        blobs = typing.cast(typing.Dict[str, bool], progress.setdefault("blobs", {}))
+        blobs[blob.group(1)] = blobs.get(blob.group(1), False) or bool(
+            re.search(r"\b(done|skipped)\b", blob.group(2))
+        )
+        progress["layers"] = "%d/%d" % (sum(blobs.values()), len(blobs))
+
+    size = re.search(r"([\d.]+\s*[KMGT]?i?B) / ([\d.]+\s*[KMGT]?i?B)", line)
+    if size is not None:
+        progress["bytes"] = f"{size.group(1)} / {size.group(2)}"
+
+
+def stream(
+    command: str,
+    arguments: typing.List[str],
+    sender: typing.Any,
+    env: typing.Optional[typing.Dict[str, str]] = None,
+    cwd: typing.Optional[str] = None,
+    timeout: typing.Optional[int] = None,
+    progress_timeout: typing.Optional[int] = None,
+    progress_interval: float = 10,
+    max_lines: int = 100,
+) -> typing.Dict[str, object]:
+    """
+    Execute a long running command (i.e. podman build or pull), and report its
+    progress while it runs.  Only the last lines of the output are kept in
+    memory, and returned once the command exits.  The stdout and stderr of
+    the command are merged.
+
+    If the command doesn't output anything for longer than the progress
+    timeout, it is considered stalled, and is killed.  If the command takes
+    longer than the timeout, it is killed and a TimeoutExpired error is raised.
+
+    :param command: The command to execute.
+    :param arguments: The arguments of the command.
+    :param sender: The mitogen sender to send the progress reports to.
+    :param env: A dictionary with environment variables.
+    :param cwd: The working dir to execute the command in.
+    :param timeout: The maximum duration the command can take.
+    :param progress_timeout: The maximum duration the command can run without
+        printing anything.
+    :param progress_interval: The interval, in seconds, between two progress
+        reports.
+    :param max_lines: The amount of lines of output to keep.
+    """
+    current_env = os.environ.copy()
+    if env is not None:
+        current_env.update(env)
+
+    if (not env or "PYTHONPATH" not in env) and "PYTHONPATH" in current_env:
+        # Remove the inherited python path
+        del current_env["PYTHONPATH"]
+
+    cmds = [command] + arguments
+    process = subprocess.Popen(
+        cmds,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        env=current_env,
+        cwd=cwd,
+    )
+
+    output = collections.deque(maxlen=max_lines)  # type: typing.Deque[str]
+    progress = {"lines": 0}  # type: typing.Dict[str, object]
+    partial = b""
+    stalled = False
+    start = last_output = last_report = time.monotonic()
+
+    def add_line(raw: bytes) -> None:
+        # Progress bars redraw the same line using carriage returns, we only
+        # keep the last state of the line
+        line = raw.decode("utf-8", errors="replace").rstrip("\r").split("\r")[-1]
+        output.append(line)
+        progress["lines"] = typing.cast(int, progress["lines"]) + 1
+        parse_progress(progress, line)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        while True:
+            now = time.monotonic()
+            if timeout is not None and now - start > timeout:
+                process.kill()
+                process.wait()
+                raise subprocess.TimeoutExpired(cmds, timeout)
+
+            if progress_timeout is not None and now - last_output > progress_timeout:
+                process.kill()
+                stalled = True
+                break
+
+            if selector.select(timeout=1):
+                chunk = os.read(process.stdout.fileno(), 65536)
+                if not chunk:
+                    # The command closed its output, it is done
+                    break
+
+                last_output = now
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                for line in lines:
+                    add_line(line)
+
+            if now - last_report >= progress_interval:
+                last_report = now
+                report = {k: v for k, v in progress.items() if k != "blobs"}
+                report["elapsed"] = int(now - start)
+                report["last_line"] = output[-1] if output else None
+                sender.send(report)
+
+    if partial:
+        add_line(partial)
+
+    return {
+        "output": "\n".join(output).strip(),
+        "returncode": process.wait(),
+        "stalled": stalled,
+        "lines": progress["lines"],
+    }
+
+
+# Processes started with open_process, and the file holding their stderr,
+# indexed by their pid, until they are closed with close_process
+_Process = typing.Tuple[subprocess.Popen, typing.IO[bytes]]
+_PROCESSES = {}  # type: typing.Dict[int, _Process]
+
+
+def open_process(command: str, arguments: typing.List[str], mode: str) -> int:
+    """
+    Start a command whose input (mode "w") or output (mode "r") is transferred
+    in chunks by the caller, using write_process or read_process.  The stderr
+    of the command is kept aside, and returned when the process is closed.
+    Return the pid of the process, identifying it in the other calls.
+
+    :param command: The command to execute.
+    :param arguments: The arguments of the command.
+    :param mode: "r" to read the output of the command, "w" to write its input.
+    """
+    current_env = os.environ.copy()
+    if "PYTHONPATH" in current_env:
+        # Remove the inherited python path
+        del current_env["PYTHONPATH"]
+
+    stderr = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [command] + arguments,
+        stdin=subprocess.PIPE if mode == "w" else subprocess.DEVNULL,
+        stdout=subprocess.PIPE if mode == "r" else subprocess.DEVNULL,
+        stderr=stderr,
+        env=current_env,
+    )
+    _PROCESSES[process.pid] = (process, stderr)
+    return process.pid
+
+
+def read_process(pid: int, size: int) -> bytes:
+    """
+    Read the next chunk of the output of a process started with open_process.
+    Return an empty chunk once the process closed its output.
+
+    :param pid: The pid of the process.
+    :param size: The size of the chunk to read, only the last chunk can be smaller.
+    """
+    process, _ = _PROCESSES[pid]
+    return process.stdout.read(size)
+
+
+def write_process(pid: int, chunk: bytes) -> None:
+    """
+    Write the next chunk of the input of a process started with open_process.
+
+    :param pid: The pid of the process.
+    :param chunk: The data to write.
+    """
+    process, _ = _PROCESSES[pid]
+    process.stdin.write(chunk)
+    process.stdin.flush()
+
+
+def close_process(
+    pid: int, timeout: typing.Optional[int] = None, kill: bool = False
+) -> typing.Dict[str, object]:
+    """
+    Close the input and output of a process started with open_process, and wait
+    for it to exit.  Return its return code and the end of its stderr.
+
+    :param pid: The pid of the process.
+    :param timeout: The maximum duration to wait for the process to exit, after
+        which it is killed.
+    :param kill: Kill the process right away, when the transfer was aborted.
+    """
+    process, stderr = _PROCESSES.pop(pid)
+    if kill:
+        process.kill()
+
+    for pipe in [process.stdin, process.stdout]:
+        if pipe is not None:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                # The process already exited
+                pass
+
+    try:
+        returncode = process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        returncode = process.wait()
+
+    stderr.seek(0)
+    lines = collections.deque(stderr, maxlen=100)  # type: typing.Deque[bytes]
+    stderr.close()
+
+    return {
+        "returncode": returncode,
+        "stderr": b"".join(lines).decode("utf-8", errors="replace").strip(),
+    }
+
+
+def archive_image_id(path: str) -> typing.Optional[str]:
+    """
+    Read the id of the image (the digest of its config) contained in an oci or
+    docker archive, without unpacking it.  The archive can be compressed with
+    gzip, bzip2, xz or zstd (which requires the zstd command).  When the archive
+    contains more than one image, the id of the first one is returned.  Return
+    None if the archive doesn't exist, or doesn't contain any image.
+
+    :param path: The path to the archive.
+    """
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "rb") as f:
+        zstd = f.read(4) == b"\x28\xb5\x2f\xfd"
+
+    members = {}  # type: typing.Dict[str, bytes]
+    process = None  # type: typing.Optional[subprocess.Popen]
+    try:
+        if zstd:
+            process = subprocess.Popen(
+                ["zstd", "--decompress", "--stdout", path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            tar = tarfile.open(fileobj=process.stdout, mode="r|")
+        else:
+            tar = tarfile.open(path, mode="r|*")
+
+        with tar:
+            # The archive is read as a stream, only the small json documents
+            # (index, manifests and configs) are kept, the layers are skipped
+            for member in tar:
+                if not member.isfile() or member.size > 1024 * 1024:
+                    continue
+
+                content = tar.extractfile(member).read()
+                if content.lstrip()[:1] in [b"{", b"["]:
+                    members[posixpath.normpath(member.name)] = content
+    except tarfile.TarError:
+        return None
+    finally:
+        if process is not None:
+            process.stdout.close()
+            process.wait()
+
+    def read(name: str) -> typing.Any:
+        return json.loads(members[name].decode("utf-8"))
+
+    def blob(digest: str) -> str:
+        return posixpath.join("blobs", *digest.split(":", 1))
+
+    try:
+        if "manifest.json" in members:
+            # Docker archive, the config is named after its digest, either
+            # <digest>.json or blobs/sha256/<digest>
+            config = read("manifest.json")[0]["Config"]
+            return posixpath.basename(config).split(".")[0]
+
+        # Oci archive, follow the index (and any nested index) down to the
+        # manifest of the first image
+        descriptor = read("index.json")["manifests"][0]
+        while descriptor.get("mediaType", "").endswith("image.index.v1+json"):
+            descriptor = read(blob(descriptor["digest"]))["manifests"][0]
+
+        return read(blob(descriptor["digest"]))["config"]["digest"].split(":")[-1]
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def _copied_images_dir() -> str:
+    """
+    Get the directory in which the registry digests of the images copied from
+    the storage of another owner are recorded.  It lives in the data directory
+    of the current user, next to its storage, and is therefore persistent.
+    """
+    if os.getuid() == 0:
+        return "/var/lib/inmanta-podman/images"
+
+    data_home = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data_home, "inmanta-podman", "images")
+
+
+def copied_images_digests() -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    """
+    Get the registry digests recorded for all the images which were copied from
+    another owner, indexed by the id of the image.
+    """
+    directory = _copied_images_dir()
+    try:
+        image_ids = [name for name in os.listdir(directory) if not name.startswith(".")]
+    except FileNotFoundError:
+        return {}
+
+    digests = {}
+    for image_id in image_ids:
+        try:
+            with open(os.path.join(directory, image_id)) as f:
+                digests[image_id] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+
+    return digests
+
+
+def record_copied_image_digests(
+    image_id: str, digests: typing.Dict[str, typing.Any]
+) -> None:
+    """
+    Record the registry digests of an image copied from another owner.  Copying
+    an image (save and load) doesn't preserve its registry digests.
+
+    :param image_id: The id of the image.
+    :param digests: The digest and the repo digests of the original image.
+    """
+    directory = _copied_images_dir()
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    tmp_path = os.path.join(directory, ".%s.%d.tmp" % (image_id, os.getpid()))
+    with open(tmp_path, "w") as f:
+        json.dump(digests, f)
+    os.replace(tmp_path, os.path.join(directory, image_id))
+
+
+def file_states(
+    paths: typing.List[str],
+) -> typing.Dict[str, typing.Optional[typing.Dict[str, typing.Any]]]:
+    """
+    Get the state of the given files and directories: their content (None for
+    directories), their permissions (as an int written in octal, i.e. 644) and
+    the name of their owner and group.  The state of the paths which don't
+    exist is None.
+
+    :param paths: The paths of the files and directories.
+    """
+
+    def name(getter: typing.Callable[[int], typing.Any], id: int) -> str:
+        try:
+            return getter(id)[0]
+        except KeyError:
+            return str(id)
+
+    states = {}  # type: typing.Dict[str, typing.Optional[typing.Dict[str, typing.Any]]]
+    for path in paths:
+        try:
+            stats = os.lstat(path)
+        except FileNotFoundError:
+            states[path] = None
+            continue
+
+        content = None
+        if stat.S_ISREG(stats.st_mode):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                content = f.read()
+
+        states[path] = {
+            "content": content,
+            "permissions": int(oct(stat.S_IMODE(stats.st_mode))[2:]),
+            "owner": name(pwd.getpwuid, stats.st_uid),
+            "group": name(grp.getgrgid, stats.st_gid),
+        }
+
+    return states
+
+
+def apply_files(
+    directories: typing.List[typing.Dict[str, typing.Any]],
+    files: typing.List[typing.Dict[str, typing.Any]],
+) -> None:
+    """
+    Create the given directories, then write (or remove) the given files, and
+    set the permissions, owner and group of both, when they are not None.  The
+    files are written atomically, they are first written next to their final
+    path, then moved in place.
+
+    :param directories: The directories to create, with their path, permissions,
+        owner and group.
+    :param files: The files to write, with their path, content, permissions, owner,
+        group and whether they should be removed (purged).
+    """
+
+    def set_attributes(path: str, attributes: typing.Dict[str, typing.Any]) -> None:
+        if attributes.get("permissions") is not None:
+            os.chmod(path, int(str(attributes["permissions"]), 8))
+        if attributes.get("owner") is not None or attributes.get("group") is not None:
+            os.chown(
+                path,
+                (
+                    pwd.getpwnam(attributes["owner"]).pw_uid
+                    if attributes.get("owner") is not None
+                    else -1
+                ),
+                (
+                    grp.getgrnam(attributes["group"]).gr_gid
+                    if attributes.get("group") is not None
+                    else -1
+                ),
+            )
+
+    for directory in directories:
+        os.makedirs(directory["path"], exist_ok=True)
+        set_attributes(directory["path"], directory)
+
+    for file in files:
+        if file.get("purged"):
+            if os.path.lexists(file["path"]):
+                os.remove(file["path"])
+            continue
+
+        tmp_path = "%s.%d.tmp" % (file["path"], os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(file["content"])
+        set_attributes(tmp_path, file)
+        os.replace(tmp_path, file["path"])
+
+
+def _unit_config_dir(user: bool) -> str:
+    """
+    Get the directory in which the hash of the config each unit has been
+    (re)started with is recorded.  It lives in the runtime directory of the
+    systemd manager, and is therefore cleared when the manager stops.
+
+    :param user: Whether the units belong to the manager of the current user
+        instead of the system one.
+    """
+    if user:
+        return "/run/user/%d/inmanta-podman/units" % os.getuid()
+    else:
+        return "/run/inmanta-podman/units"
+
+
+def unit_config_hashes(
+    user: bool, units: typing.List[str]
+) -> typing.Dict[str, typing.Optional[str]]:
+    """
+    Get the hash of the config each of the given units has been (re)started with,
+    or None if no hash has been recorded for the unit since the manager started.
+
+    :param user: Whether the units belong to the manager of the current user
+        instead of the system one.
+    :param units: The names of the units.
+    """
+    hashes = {}  # type: typing.Dict[str, typing.Optional[str]]
+    for unit in units:
+        try:
+            with open(os.path.join(_unit_config_dir(user), unit)) as f:
+                hashes[unit] = f.read().strip() or None
+        except FileNotFoundError:
+            hashes[unit] = None
+
+    return hashes
+
+
+def record_unit_config_hashes(user: bool, hashes: typing.Dict[str, str]) -> None:
+    """
+    Record the hash of the config the given units have just been (re)started with.
+
+    :param user: Whether the units belong to the manager of the current user
+        instead of the system one.
+    :param hashes: The hash of the config of each unit, indexed by unit name.
+    """
+    directory = _unit_config_dir(user)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    for unit, config_hash in hashes.items():
+        tmp_path = os.path.join(directory, ".%s.%d.tmp" % (unit, os.getpid()))
+        with open(tmp_path, "w") as f:
+            f.write(config_hash + "\n")
+        os.replace(tmp_path, os.path.join(directory, unit))
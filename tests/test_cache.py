@@ -0,0 +1,110 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import concurrent.futures
+import threading
+
+import pytest
+
+from inmanta_plugins.podman.resources.cache import ManifestCache, Snapshot
+from inmanta_plugins.podman.resources.image import normalize_image_name
+
+
+@pytest.mark.parametrize(
+    ("name", "normalized"),
+    [
+        ("alpine", None),
+        ("library/alpine:3", None),
+        ("docker.io/alpine", "docker.io/library/alpine:latest"),
+        ("docker.io/library/nginx:1.27", "docker.io/library/nginx:1.27"),
+        ("ghcr.io/linuxcontainers/alpine", "ghcr.io/linuxcontainers/alpine:latest"),
+        ("localhost/app", "localhost/app:latest"),
+        ("registry:5000/app", "registry:5000/app:latest"),
+        ("quay.io/app@sha256:abc", "quay.io/app@sha256:abc"),
+        ("quay.io/app:1.0@sha256:abc", "quay.io/app@sha256:abc"),
+        ("registry:5000/app:1.0@sha256:abc", "registry:5000/app@sha256:abc"),
+    ],
+)
+def test_normalize_image_name(name: str, normalized: str | None) -> None:
+    assert normalize_image_name(name) == normalized
+
+
+def test_snapshot() -> None:
+    loads: list[int] = []
+
+    def load() -> dict[str, dict]:
+        loads.append(1)
+        return {"a": {"name": "a"}}
+
+    snapshot = Snapshot("network")
+
+    # The first lookup loads the snapshot, the next ones reuse it
+    assert snapshot.lookup("a", load) == {"name": "a"}
+    assert snapshot.lookup("b", load) is None
+    assert len(loads) == 1
+    assert (snapshot.hits, snapshot.misses) == (1, 1)
+
+    # Invalidating a key only reloads the snapshot when that key is read
+    snapshot.invalidate("a")
+    assert snapshot.lookup("b", load) is None
+    assert len(loads) == 1
+    assert snapshot.lookup("a", load) == {"name": "a"}
+    assert len(loads) == 2
+
+    # Invalidating the full snapshot reloads it on the next lookup
+    snapshot.invalidate()
+    assert snapshot.lookup("b", load) is None
+    assert len(loads) == 3
+    assert (snapshot.hits, snapshot.misses) == (2, 3)
+
+
+def test_manifest_cache() -> None:
+    loads: list[str] = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def load() -> dict:
+        loads.append("nginx")
+        started.set()
+        release.wait(timeout=5)
+        return {"digest": "sha256:abc"}
+
+    def missing() -> dict:
+        loads.append("missing")
+        raise LookupError()
+
+    manifests = ManifestCache(ttl=60, negative_ttl=60)
+
+    # Concurrent lookups of the same manifest only query the registry once
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [
+            pool.submit(manifests.get, ("nginx", "linux", "amd64"), load)
+            for _ in range(4)
+        ]
+        started.wait(timeout=5)
+        release.set()
+        assert [f.result() for f in futures] == [{"digest": "sha256:abc"}] * 4
+
+    assert loads == ["nginx"]
+
+    # Missing manifests are cached as well
+    for _ in range(2):
+        with pytest.raises(LookupError):
+            manifests.get(("missing", "linux", "amd64"), missing)
+
+    assert loads == ["nginx", "missing"]
@@ -0,0 +1,254 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import json
+
+from pytest_inmanta.plugin import Project
+
+from inmanta_plugins.podman.resources.container import (
+    container_projection,
+    projection_hash,
+)
+
+
+def test_model(
+    project: Project,
+    purged: bool = False,
+    state: str | None = "running",
+    env: dict[str, str] = {"A": "a"},
+) -> None:
+    model = f"""
+        import podman
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::ImageFromRegistry(
+            host=host,
+            name="docker.io/library/alpine:latest",
+        )
+
+        podman::Container(
+            host=host,
+            name="test-container",
+            image="docker.io/library/alpine:latest",
+            command="sleep infinity",
+            env={json.dumps(env)},
+            state={json.dumps(state)},
+            purged={json.dumps(purged)},
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+
+def test_export(project: Project) -> None:
+    # Containers without a state are managed by a service, they are
+    # not exported
+    test_model(project, state=None)
+    assert project.get_resource("podman::Container") is None
+
+    test_model(project, state="running")
+    resource = project.get_resource("podman::Container")
+    assert resource is not None
+    assert resource.command == ["sleep", "infinity"]
+    assert "--env=A=a" in resource.options
+    config_hash = resource.config_hash
+
+    # Changing any attribute of the container changes its config hash
+    test_model(project, state="running", env={"A": "b"})
+    resource = project.get_resource("podman::Container")
+    assert resource is not None
+    assert resource.config_hash != config_hash
+
+    # The options podman reports are normalized into the projection
+    assert resource.projection["command"] == ["sleep", "infinity"]
+    assert resource.projection["env"] == {"A": "b"}
+    assert resource.projection_hash == projection_hash(resource.projection)
+
+
+def test_projection() -> None:
+    desired = {
+        "command": ["sleep", "infinity"],
+        "env": {"A": "a"},
+        "labels": {"io.containers.autoupdate": "registry"},
+        "read_only": False,
+        "add_capability": ["CAP_NET_ADMIN"],
+        "drop_capability": [],
+        "memory": 536870912,
+        "publish": {"80/tcp": [":8080"]},
+        "volumes": {"/data": "data", "/etc/app": "/srv/app"},
+    }
+    container = {
+        "Id": "abc",
+        "Name": "test-container",
+        "Config": {
+            "Cmd": ["sleep", "infinity"],
+            "Env": ["PATH=/usr/bin", "A=a", "container=podman"],
+            "Labels": {
+                "io.containers.autoupdate": "registry",
+                "io.inmanta.podman.config": "123",
+            },
+        },
+        "HostConfig": {
+            "CapAdd": ["CAP_NET_ADMIN"],
+            "CapDrop": ["CAP_AUDIT_WRITE"],
+            "Memory": 536870912,
+            "ReadonlyRootfs": False,
+            "PortBindings": {"80/tcp": [{"HostIp": "", "HostPort": "8080"}]},
+        },
+        "Mounts": [
+            {"Type": "volume", "Name": "data", "Destination": "/data"},
+            {"Type": "bind", "Source": "/srv/app", "Destination": "/etc/app"},
+        ],
+    }
+
+    # Only the desired options are read, whatever the image and podman add
+    assert container_projection(container, desired) == desired
+
+    # Updating the container with podman update is detected
+    container["HostConfig"]["Memory"] = 1073741824
+    assert container_projection(container, desired)["memory"] == 1073741824
+
+    # Re-creating the container by hand, with our label, is detected
+    container["HostConfig"]["PortBindings"] = {}
+    container["Config"]["Env"] = ["A=b"]
+    projection = container_projection(container, desired)
+    assert projection["publish"] == {}
+    assert projection["env"] == {"A": "b"}
+    assert projection_hash(projection) != projection_hash(desired)
+
+
+def test_deploy(project: Project) -> None:
+    # Make sure the container is there, and running
+    test_model(project, purged=False)
+    project.deploy_resource("podman::ImageFromRegistry")
+    project.deploy_resource("podman::Container")
+    assert not project.dryrun_resource("podman::Container")
+
+    # Changing the config of the container requires to re-create it
+    test_model(project, purged=False, env={"A": "b"})
+    assert "config_hash" in project.dryrun_resource("podman::Container")
+    project.deploy_resource("podman::Container")
+    assert not project.dryrun_resource("podman::Container")
+
+    # Stopping the container doesn't re-create it
+    test_model(project, purged=False, state="stopped", env={"A": "b"})
+    assert project.dryrun_resource("podman::Container").keys() == {"state"}
+    project.deploy_resource("podman::Container")
+    assert not project.dryrun_resource("podman::Container")
+
+    # Make sure the container is gone
+    test_model(project, purged=True)
+    assert project.dryrun_resource("podman::Container")
+    project.deploy_resource("podman::Container")
+    assert not project.dryrun_resource("podman::Container")
+
+
+def test_source_image(project: Project) -> None:
+    model = """
+        import podman
+        import podman::services
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        pinned = podman::ImageFromRegistry(
+            host=host,
+            name="docker.io/library/alpine:3.20",
+            digest="sha256:abc",
+        )
+
+        latest = podman::ImageFromRegistry(
+            host=host,
+            name="docker.io/library/alpine:latest",
+        )
+
+        podman::Container(
+            host=host,
+            name="pinned",
+            source_image=pinned,
+            command="sleep infinity",
+            state="running",
+        )
+
+        podman::Container(
+            host=host,
+            name="latest",
+            source_image=latest,
+            command="sleep infinity",
+            state="running",
+        )
+
+        podman::services::SystemdContainer(
+            container=podman::Container(
+                host=host,
+                name="quadlet",
+                source_image=pinned,
+            ),
+            state="running",
+            quadlet=true,
+            systemd_unit_dir="/tmp/systemd/user",
+            systemd_container_dir="/tmp/containers/systemd",
+            systemctl_command=["systemctl", "--user"],
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    # The container is pinned to the digest of its image, which it never pulls,
+    # and it is deployed after its image
+    pinned = project.get_resource("podman::ImageFromRegistry", digest="sha256:abc")
+    resource = project.get_resource("podman::Container", name="pinned")
+    assert resource is not None
+    assert resource.image == "docker.io/library/alpine:3.20@sha256:abc"
+    assert "--pull=never" in resource.options
+    assert pinned.id in resource.requires
+
+    unit = next(
+        r
+        for r in project.resources.values()
+        if getattr(r, "path", None)
+        == "/tmp/containers/systemd/container-quadlet.container"
+    )
+    assert "Image=docker.io/library/alpine:3.20@sha256:abc\n" in unit.content
+    assert "Pull=never\n" in unit.content
+    assert pinned.id in unit.requires
+
+    # The digest of the other image is only known once it has been pulled
+    latest = project.get_resource("podman::ImageFromRegistry", digest=None)
+    project.add_fact(latest.id.resource_str(), "digest", "sha256:def")
+    project.compile(model, no_dedent=False)
+    resource = project.get_resource("podman::Container", name="latest")
+    assert resource is not None
+    assert resource.image == "docker.io/library/alpine:latest@sha256:def"
@@ -257,3 +257,26 @@ def test_deploy_with_dependencies(project: Project) -> None:
             }
         )
         dry_run_result.assert_has_no_changes()
+
+
+def test_single_daemon_reload(project: Project) -> None:
+    """
+    All the services of the same owner, on the same host, share a single
+    daemon-reload command, which runs after all their unit files are written.
+    """
+    project.compile(build_model(), no_dedent=False)
+
+    reloads = [
+        r
+        for r in project.resources.values()
+        if r.id.entity_type == "exec::Run" and r.command.endswith("daemon-reload")
+    ]
+    assert len(reloads) == 1
+
+    unit_files = {
+        r.id.resource_str()
+        for r in project.resources.values()
+        if getattr(r, "path", "").endswith(".service")
+    }
+    assert len(unit_files) == 2
+    assert unit_files <= {req.resource_str() for req in reloads[0].requires}
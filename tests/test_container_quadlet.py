@@ -305,3 +305,111 @@ def test_deploy(project: Project) -> None:
             }
         )
         dry_run_result.assert_has_no_changes()
+
+
+def test_quadlet_objects(project: Project) -> None:
+    model = """
+        import podman
+        import podman::container_like
+        import podman::container
+        import podman::network
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        network = podman::Network(
+            host=host,
+            name="app-net",
+            subnets=[podman::network::Subnet(subnet="172.43.0.0/24")],
+            managed=false,
+        )
+        volume = podman::NamedVolume(
+            host=host,
+            name="app-data",
+            labels={"app": "test"},
+            managed=false,
+        )
+        image = podman::ImageFromRegistry(
+            host=host,
+            name="docker.io/library/alpine:3.20",
+            managed=false,
+        )
+
+        podman::services::SystemdNetwork(
+            network=network,
+            state="configured",
+            systemd_unit_dir="/tmp/systemd/user",
+            systemd_container_dir="/tmp/containers/systemd",
+            systemctl_command=["systemctl", "--user"],
+        )
+        podman::services::SystemdVolume(
+            volume=volume,
+            state="configured",
+            systemd_unit_dir="/tmp/systemd/user",
+            systemd_container_dir="/tmp/containers/systemd",
+            systemctl_command=["systemctl", "--user"],
+        )
+        podman::services::SystemdImage(
+            from_registry=image,
+            state="configured",
+            systemd_unit_dir="/tmp/systemd/user",
+            systemd_container_dir="/tmp/containers/systemd",
+            systemctl_command=["systemctl", "--user"],
+        )
+
+        podman::services::SystemdContainer(
+            container=podman::Container(
+                host=host,
+                name="app",
+                image="docker.io/library/alpine:3.20",
+                networks=[BridgeNetwork(name="app-net", ip="172.43.0.2")],
+                volumes=[Volume(source="app-data", container_dir="/data", options=["Z"])],
+            ),
+            state="configured",
+            quadlet=true,
+            systemd_unit_dir="/tmp/systemd/user",
+            systemd_container_dir="/tmp/containers/systemd",
+            systemctl_command=["systemctl", "--user"],
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    def content(name: str) -> str:
+        return next(
+            r.content
+            for r in project.resources.values()
+            if getattr(r, "path", None) == f"/tmp/containers/systemd/{name}"
+        )
+
+    # The objects are defined by quadlet files
+    network = content("app-net.network")
+    assert "NetworkName=app-net\n" in network
+    assert "Subnet=172.43.0.0/24\n" in network
+    volume = content("app-data.volume")
+    assert "VolumeName=app-data\n" in volume
+    assert "Label=app=test\n" in volume
+    image = content("docker.io-library-alpine-3.20.image")
+    assert "Image=docker.io/library/alpine:3.20\n" in image
+
+    # The container references the quadlet files instead of the objects
+    container = content("container-app.container")
+    assert "Image=docker.io-library-alpine-3.20.image\n" in container
+    assert "Network=app-net.network:ip=172.43.0.2\n" in container
+    assert "Volume=app-data.volume:/data:Z\n" in container
+
+    # The objects are not managed by the agent
+    assert not [
+        r
+        for r in project.resources.values()
+        if r.is_type("podman::Network")
+        or r.is_type("podman::NamedVolume")
+        or r.is_type("podman::ImageFromRegistry")
+    ]
@@ -336,3 +336,132 @@ def test_deploy(project: Project) -> None:
             }
         )
         dry_run_result.assert_has_no_changes()
+
+
+def test_persistent(project: Project) -> None:
+    model = """
+        import podman
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::services::SystemdContainer(
+            container=podman::Container(
+                host=host,
+                name="job",
+                image="docker.io/library/alpine:latest",
+                command="date",
+                state="created",
+            ),
+            state="running",
+            on_calendar="minutely",
+            persistent=true,
+            systemd_unit_dir="/tmp/systemd/user",
+            systemctl_command=["systemctl", "--user"],
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    # The unit only starts and stops the container, it never creates nor
+    # removes it
+    unit = project.get_resource(
+        "files::SystemdUnitFile", path="/tmp/systemd/user/container-job.service"
+    )
+    assert unit is not None
+    assert "ExecStart=/usr/bin/podman container start --attach job\n" in unit.content
+    assert "ExecStop=/usr/bin/podman container stop --ignore --time=10 job\n" in (
+        unit.content
+    )
+    assert "ExecStopPost" not in unit.content
+
+    # The container is created with the options of the service
+    container = project.get_resource("podman::Container")
+    assert container is not None
+    assert container.systemd_unit == "container-job.service"
+    assert container.systemctl_command == ["systemctl", "--user"]
+    assert "--sdnotify=conmon" in container.options
+    assert "--cgroups=no-conmon" in container.options
+    assert "--label=PODMAN_SYSTEMD_UNIT=container-job.service" in container.options
+
+    # The container is created before the unit is started
+    for resource in project.resources.values():
+        if resource.is_type("exec::Run") and "start" in resource.command:
+            assert container.id in resource.requires
+
+
+def test_idle_timeout(project: Project) -> None:
+    model = """
+        import podman
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::services::SystemdContainer(
+            container=podman::Container(
+                host=host,
+                name="web",
+                image="docker.io/library/nginx:latest",
+                publish=[
+                    podman::Publish(ip="127.0.0.1", host_port="18080", container_port="80"),
+                ],
+            ),
+            state="running",
+            listen_stream=["8080"],
+            idle_timeout=300,
+            proxy_address="127.0.0.1:18080",
+            systemd_unit_dir="/tmp/systemd/user",
+            systemctl_command=["systemctl", "--user"],
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    def content(path: str) -> str:
+        unit = project.get_resource("files::SystemdUnitFile", path=path)
+        assert unit is not None
+        return unit.content
+
+    # The socket activates the proxy, not the service
+    socket = content("/tmp/systemd/user/container-web.socket")
+    assert "Service=container-web-proxy.service\n" in socket
+    assert "Requires=container-web.service\n" not in socket
+
+    # The proxy starts the service, and exits when idle
+    proxy = content("/tmp/systemd/user/container-web-proxy.service")
+    assert "Requires=container-web.socket\n" in proxy
+    assert "Requires=container-web.service\n" in proxy
+    assert "After=container-web.service\n" in proxy
+    assert (
+        "ExecStart=/usr/lib/systemd/systemd-socket-proxyd"
+        " --exit-idle-time=300s 127.0.0.1:18080\n"
+    ) in proxy
+
+    # The service is stopped with the proxy
+    service = content("/tmp/systemd/user/container-web.service")
+    assert "BindsTo=container-web-proxy.service\n" in service
+
+    # The path to the proxy binary can be changed, i.e. on debian
+    project.compile(
+        model.replace(
+            "idle_timeout=300,",
+            'idle_timeout=300, socket_proxyd="/lib/systemd/systemd-socket-proxyd",',
+        ),
+        no_dedent=False,
+    )
+    proxy = content("/tmp/systemd/user/container-web-proxy.service")
+    assert "ExecStart=/lib/systemd/systemd-socket-proxyd --exit-idle-time" in proxy
@@ -0,0 +1,129 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import hashlib
+import json
+import pathlib
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+from pytest_inmanta.plugin import Project
+
+import inmanta_podman
+
+
+def test_model(project: Project) -> None:
+    model = """
+        import podman
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::ImageFromArchive(
+            host=host,
+            name="localhost/app:latest",
+            agent_path="/var/lib/images/app.tar.zst",
+            load_timeout=600,
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+    resource = project.get_resource("podman::ImageFromArchive")
+    assert resource is not None
+    assert resource.path is None
+    assert resource.agent_path == "/var/lib/images/app.tar.zst"
+    assert resource.load_timeout == 600
+    assert resource.image_id is None
+
+
+def write_archive(directory: pathlib.Path, files: dict[str, bytes]) -> None:
+    directory.mkdir()
+    for name, content in files.items():
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_bytes(content)
+
+
+def test_archive_image_id(tmp_path: pathlib.Path) -> None:
+    config = json.dumps({"architecture": "amd64", "os": "linux"}).encode()
+    config_digest = hashlib.sha256(config).hexdigest()
+    layer = b"\0" * 4096
+    layer_digest = hashlib.sha256(layer).hexdigest()
+    manifest = json.dumps(
+        {
+            "schemaVersion": 2,
+            "config": {"digest": f"sha256:{config_digest}"},
+            "layers": [{"digest": f"sha256:{layer_digest}"}],
+        }
+    ).encode()
+    manifest_digest = hashlib.sha256(manifest).hexdigest()
+
+    write_archive(
+        tmp_path / "oci",
+        {
+            "oci-layout": b'{"imageLayoutVersion": "1.0.0"}',
+            "index.json": json.dumps(
+                {
+                    "schemaVersion": 2,
+                    "manifests": [{"digest": f"sha256:{manifest_digest}"}],
+                }
+            ).encode(),
+            f"blobs/sha256/{manifest_digest}": manifest,
+            f"blobs/sha256/{config_digest}": config,
+            f"blobs/sha256/{layer_digest}": layer,
+        },
+    )
+    write_archive(
+        tmp_path / "docker",
+        {
+            "manifest.json": json.dumps(
+                [{"Config": f"{config_digest}.json", "Layers": [f"{layer_digest}.tar"]}]
+            ).encode(),
+            f"{config_digest}.json": config,
+            f"{layer_digest}.tar": layer,
+        },
+    )
+
+    for kind, mode in [("oci", "w"), ("docker", "w"), ("oci", "w:gz")]:
+        archive = tmp_path / f"{kind}.{mode}.tar"
+        with tarfile.open(archive, mode) as tar:
+            tar.add(tmp_path / kind, arcname=".")
+
+        assert inmanta_podman.archive_image_id(str(archive)) == config_digest
+
+    # Missing archive, or archive without any image
+    assert inmanta_podman.archive_image_id(str(tmp_path / "missing.tar")) is None
+    (tmp_path / "empty.tar").write_bytes(b"not an archive")
+    assert inmanta_podman.archive_image_id(str(tmp_path / "empty.tar")) is None
+
+    if shutil.which("zstd") is None:
+        pytest.skip("The zstd command is not available")
+
+    subprocess.run(["zstd", "-q", str(tmp_path / "docker.w.tar")], check=True)
+    archive = tmp_path / "docker.w.tar.zst"
+    assert inmanta_podman.archive_image_id(str(archive)) == config_digest
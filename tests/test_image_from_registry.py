@@ -17,10 +17,13 @@ Contact: edvgui@gmail.com
 """
 
 import json
+import pathlib
 
+import pytest
 from pytest_inmanta.plugin import Project
 
 import inmanta.const
+import inmanta_podman
 
 
 def test_model(
@@ -137,3 +140,113 @@ def test_deploy(project: Project) -> None:
         res.discovered_resource_id for res in result.discovered_resources
     ]
     assert image_resource_id not in discovered_resources
+
+
+def test_store(project: Project) -> None:
+    model = """
+        import podman
+        import podman::image
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        store = podman::image::Store(host=host, path="/var/lib/containers/shared")
+
+        podman::ImageFromRegistry(
+            host=host,
+            name="ghcr.io/linuxcontainers/alpine:latest",
+            store=store,
+            use_api=true,
+        )
+
+        for tenant in ["tenant1", "tenant2"]:
+            podman::image::StorageConfig(
+                host=host,
+                owner=tenant,
+                path=f"/home/{tenant}/.config/containers/storage.conf",
+                stores=[store],
+            )
+        end
+    """
+
+    project.compile(model, no_dedent=False)
+
+    # The image is pulled once, into the store, with the cli
+    directory = project.get_resource(
+        "files::Directory", path="/var/lib/containers/shared"
+    )
+    assert directory is not None
+    image = project.get_resource("podman::ImageFromRegistry")
+    assert image is not None
+    assert image.store == "/var/lib/containers/shared"
+    assert not image.use_api
+    assert directory.id in image.requires
+
+    # Each tenant resolves the images from the store
+    for tenant in ["tenant1", "tenant2"]:
+        storage_conf = project.get_resource(
+            "files::TextFile",
+            path=f"/home/{tenant}/.config/containers/storage.conf",
+        )
+        assert storage_conf is not None
+        assert storage_conf.owner == tenant
+        assert 'additionalimagestores = [\n  "/var/lib/containers/shared",\n]' in (
+            storage_conf.content
+        )
+        assert directory.id in storage_conf.requires
+
+
+def test_copy_from(project: Project) -> None:
+    model = """
+        import podman
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::ImageFromRegistry(
+            host=host,
+            owner="tenant2",
+            name="ghcr.io/linuxcontainers/alpine:latest",
+            digest="sha256:abc",
+            copy_from=["root", "tenant1"],
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+    resource = project.get_resource("podman::ImageFromRegistry")
+    assert resource is not None
+    assert resource.copy_from == ["root", "tenant1"]
+    assert resource.digest == "sha256:abc"
+
+
+def test_copied_image_digests(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(inmanta_podman, "_copied_images_dir", lambda: str(tmp_path))
+
+    # Nothing has been recorded for the image yet
+    assert inmanta_podman.copied_images_digests() == {}
+
+    digests = {
+        "digest": "sha256:def",
+        "repo_digests": ["ghcr.io/linuxcontainers/alpine@sha256:def"],
+    }
+    inmanta_podman.record_copied_image_digests("abc", digests)
+    assert inmanta_podman.copied_images_digests() == {"abc": digests}
@@ -17,10 +17,14 @@ Contact: edvgui@gmail.com
 """
 
 import json
+import pathlib
 
+import pytest
 from pytest_inmanta.plugin import Project
 
 import inmanta.const
+import inmanta_podman
+from inmanta_plugins.podman.resources.image import parse_git_context
 
 
 def test_model(project: Project, purged: bool = False) -> None:
@@ -100,8 +104,8 @@ def test_deploy(project: Project) -> None:
     test_model(project, purged=False)
     project.deploy_resource("podman::ImageFromSource")
 
-    # We can't make a dryrun, but we can assert that rebuilding the
-    # image didn't bring any change
+    # The sources didn't change, the image doesn't need to be rebuilt
+    assert not project.dryrun_resource("podman::ImageFromSource")
     project.deploy_resource(
         "podman::ImageFromSource", change=inmanta.const.Change.nochange
     )
@@ -111,3 +115,161 @@ def test_deploy(project: Project) -> None:
     assert project.dryrun_resource("podman::ImageFromSource")
     project.deploy_resource("podman::ImageFromSource")
     assert not project.dryrun_resource("podman::ImageFromSource")
+
+
+@pytest.mark.parametrize(
+    ("context", "expected"),
+    [
+        ("/tmp/context", None),
+        ("https://example.com/context.tar.gz", None),
+        (
+            "https://github.com/alpinelinux/docker-alpine.git",
+            ("https://github.com/alpinelinux/docker-alpine.git", "HEAD", None),
+        ),
+        (
+            "https://github.com/alpinelinux/docker-alpine.git#v3.20:x86_64",
+            ("https://github.com/alpinelinux/docker-alpine.git", "v3.20", "x86_64"),
+        ),
+        ("git://example.com/repo#main", ("git://example.com/repo", "main", None)),
+    ],
+)
+def test_parse_git_context(
+    context: str, expected: tuple[str, str, str | None] | None
+) -> None:
+    assert parse_git_context(context) == expected
+
+
+def test_fingerprint(tmp_path: pathlib.Path) -> None:
+    context = tmp_path / "context"
+    context.mkdir()
+    (context / "Containerfile").write_text("FROM alpine\n")
+    (context / "data").mkdir()
+    (context / "data" / "a.txt").write_text("a")
+
+    paths = [str(context), str(tmp_path / "Containerfile")]
+    fingerprint = inmanta_podman.fingerprint(paths)
+    assert fingerprint == inmanta_podman.fingerprint(paths)
+
+    # Changing the content of a file changes the fingerprint
+    (context / "data" / "a.txt").write_text("b")
+    assert inmanta_podman.fingerprint(paths) != fingerprint
+    fingerprint = inmanta_podman.fingerprint(paths)
+
+    # Creating a missing file changes the fingerprint
+    (tmp_path / "Containerfile").write_text("FROM alpine\n")
+    assert inmanta_podman.fingerprint(paths) != fingerprint
+
+
+def test_stream() -> None:
+    class Sender:
+        def __init__(self) -> None:
+            self.reports: list[dict] = []
+
+        def send(self, report: dict) -> None:
+            self.reports.append(report)
+
+    # Only the last lines of the output are kept, and the progress is reported
+    sender = Sender()
+    result = inmanta_podman.stream(
+        "sh",
+        ["-c", "for i in 1 2 3; do echo STEP $i/3: RUN true; sleep 0.5; done"],
+        sender,
+        progress_interval=0.2,
+        max_lines=2,
+    )
+    assert result == {
+        "output": "STEP 2/3: RUN true\nSTEP 3/3: RUN true",
+        "returncode": 0,
+        "stalled": False,
+        "lines": 3,
+    }
+    assert sender.reports
+    assert sender.reports[-1]["step"] in ["2/3", "3/3"]
+
+    # A command which doesn't print anything is stalled
+    result = inmanta_podman.stream(
+        "sh",
+        ["-c", "echo start; sleep 10"],
+        Sender(),
+        progress_timeout=1,
+    )
+    assert result["stalled"]
+    assert result["output"] == "start"
+
+
+def test_build_once(project: Project) -> None:
+    model = """
+        import podman
+        import std
+        import mitogen
+
+
+        builder = std::Host(
+            name="builder",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+        worker = std::Host(
+            name="worker",
+            remote_agent=true,
+            ip="127.0.0.2",
+            os=std::linux,
+        )
+
+        built = podman::ImageFromSource(
+            host=builder,
+            name="localhost/app:latest",
+            context="/tmp/app",
+        )
+        podman::ImageFromSource(
+            host=worker,
+            owner="app",
+            name="localhost/app:latest",
+            build_image=built,
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+    built = project.get_resource("podman::ImageFromSource", owner=None)
+    assert built is not None
+    assert built.build_image is None
+
+    # The image is copied from the image built on the builder host
+    copied = project.get_resource("podman::ImageFromSource", owner="app")
+    assert copied is not None
+    assert copied.build_image is not None
+    assert copied.build_image["owner"] is None
+    assert copied.build_image["name"] == "localhost/app:latest"
+    assert copied.build_image["via"] == built.via
+    assert copied.image_id is None
+    assert built.id in copied.requires
+
+
+def test_process_transfer() -> None:
+    # Stream the output of a command into the input of another one, in chunks
+    reader = inmanta_podman.open_process(
+        "sh", ["-c", "head -c 300000 /dev/zero; echo saved >&2"], "r"
+    )
+    writer = inmanta_podman.open_process(
+        "sh", ["-c", "test $(wc -c) -eq 300000 && echo loaded >&2"], "w"
+    )
+    while chunk := inmanta_podman.read_process(reader, 65536):
+        assert len(chunk) <= 65536
+        inmanta_podman.write_process(writer, chunk)
+
+    assert inmanta_podman.close_process(reader, 5) == {
+        "returncode": 0,
+        "stderr": "saved",
+    }
+    assert inmanta_podman.close_process(writer, 5) == {
+        "returncode": 0,
+        "stderr": "loaded",
+    }
+
+    # An aborted transfer kills the command
+    reader = inmanta_podman.open_process("sh", ["-c", "yes"], "r")
+    assert inmanta_podman.read_process(reader, 4)
+    assert inmanta_podman.close_process(reader, 5, True)["returncode"] != 0
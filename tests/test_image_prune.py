@@ -0,0 +1,246 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import json
+
+from pytest_inmanta.plugin import Project
+
+from inmanta_plugins.podman.resources.image_prune import (
+    removal_references,
+    select_images,
+)
+
+
+def test_model(project: Project) -> None:
+    model = """
+        import podman
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        image = podman::ImageFromRegistry(
+            host=host,
+            name="docker.io/library/nginx:latest",
+        )
+
+        container = podman::Container(
+            host=host,
+            name="web",
+            source_image=image,
+        )
+
+        other = podman::Container(
+            host=host,
+            name="db",
+            image="postgres:16",
+        )
+
+        podman::ImagePrune(
+            host=host,
+            keep_last=2,
+            high_water_mark=10 * 1024 * 1024 * 1024,
+            keep=["localhost/.*"],
+            containers=[container, other],
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+    resource = project.get_resource("podman::ImagePrune")
+    assert resource is not None
+    assert resource.max_age is None
+    assert resource.keep_last == 2
+    assert resource.keep == ["localhost/.*"]
+    assert resource.references == [
+        "docker.io/library/nginx:latest",
+        "postgres:16",
+    ]
+    assert resource.store is None
+    assert resource.removed == []
+
+
+def test_store(project: Project) -> None:
+    model = """
+        import podman
+        import podman::image
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::ImagePrune(
+            host=host,
+            max_age=7 * 24 * 3600,
+            store=podman::image::Store(host=host, path="/var/lib/containers/shared"),
+        )
+    """
+
+    project.compile(model, no_dedent=False)
+
+    resource = project.get_resource("podman::ImagePrune")
+    assert resource is not None
+    assert resource.owner is None
+    assert resource.store == "/var/lib/containers/shared"
+
+
+def test_deploy(project: Project) -> None:
+    def model(purged: bool) -> None:
+        project.compile(
+            f"""
+                import podman
+                import std
+                import mitogen
+
+
+                host = std::Host(
+                    name="localhost",
+                    remote_agent=true,
+                    ip="127.0.0.1",
+                    os=std::linux,
+                    via=mitogen::Local(),
+                )
+
+                podman::ImageFromRegistry(
+                    host=host,
+                    name="docker.io/library/busybox:1.36",
+                )
+
+                podman::ImagePrune(
+                    host=host,
+                    max_age=0,
+                    keep=["(?!docker[.]io/library/busybox:).*"],
+                    purged={json.dumps(purged)},
+                )
+            """,
+            no_dedent=False,
+        )
+
+    # Make sure the image is there
+    model(purged=False)
+    project.deploy_resource("podman::ImageFromRegistry")
+    assert not project.dryrun_resource("podman::ImageFromRegistry")
+
+    # Purging the prune resource doesn't remove anything
+    model(purged=True)
+    assert not project.dryrun_resource("podman::ImagePrune")
+    project.deploy_resource("podman::ImagePrune")
+    assert not project.dryrun_resource("podman::ImageFromRegistry")
+
+    # The image is not used by any container, it is reported by the dryrun
+    # and removed
+    model(purged=False)
+    assert project.dryrun_resource("podman::ImagePrune")["removed"]["current"]
+    project.deploy_resource("podman::ImagePrune")
+    assert not project.dryrun_resource("podman::ImagePrune")
+    assert project.dryrun_resource("podman::ImageFromRegistry")
+
+
+def test_removal_references() -> None:
+    # The images with multiple names are removed by name, to avoid --force
+    image = {"Id": "a1", "Names": ["docker.io/library/nginx:1.25", "nginx:stable"]}
+    assert removal_references("a1", image) == [
+        "docker.io/library/nginx:1.25",
+        "nginx:stable",
+    ]
+    assert removal_references("a1", {"Id": "a1", "Names": ["nginx:1.25"]}) == ["a1"]
+    assert removal_references("a1", {"Id": "a1", "Names": None}) == ["a1"]
+    assert removal_references("a1", None) == ["a1"]
+
+
+def test_select_images() -> None:
+    day = 24 * 3600
+    now = 100 * day
+
+    def image(id: str, name: str, created: int, containers: int = 0) -> dict:
+        return {
+            "Id": id,
+            "Names": [name],
+            "RepoDigests": [f"{name.rsplit(':', 1)[0]}@sha256:{id}"],
+            "Created": created,
+            "Containers": containers,
+        }
+
+    images = [
+        image("a1", "docker.io/library/nginx:1.25", now - 30 * day),
+        image("a2", "docker.io/library/nginx:1.26", now - 20 * day),
+        image("a3", "docker.io/library/nginx:1.27", now - 10 * day, containers=1),
+        image("b1", "docker.io/library/postgres:15", now - 40 * day, containers=1),
+        image("b2", "docker.io/library/postgres:16", now - 35 * day),
+        image("c1", "localhost/app:latest", now - 50 * day),
+    ]
+    df = {
+        "ImagesSize": 600,
+        "Images": [
+            {"ImageID": i["Id"], "UniqueSize": 100, "Size": 100} for i in images
+        ],
+        "Containers": [
+            # The container was created recently, from an older image
+            {"Image": "b1", "Created": "1970-04-10T00:00:00.123456789Z"},
+        ],
+    }
+
+    def select(**kwargs: object) -> list[str]:
+        policy = dict(
+            max_age=None,
+            keep_last=None,
+            high_water_mark=None,
+            keep=[],
+            references=[],
+        )
+        policy.update(kwargs)
+        return select_images(images, df, now=now, **policy)
+
+    # No policy, nothing to remove
+    assert select() == []
+
+    # Images used by a container are kept, whatever their age
+    assert select(max_age=5 * day) == ["c1", "b2", "a1", "a2"]
+    assert select(max_age=25 * day) == ["c1", "b2", "a1"]
+
+    # Only the most recent image of each repository is kept, b1 has been
+    # used more recently than b2
+    assert select(keep_last=1) == ["b2", "a1", "a2"]
+
+    # The allowlist protects the images by name, digest or short name
+    assert select(
+        max_age=5 * day,
+        keep=["localhost/.*"],
+        references=[
+            "docker.io/library/nginx@sha256:a1",
+            "postgres:16",
+        ],
+    ) == ["a2"]
+
+    # The least recently used images are removed until the usage is low enough
+    assert select(high_water_mark=400) == ["c1", "b2"]
+    assert select(high_water_mark=400, keep_last=2) == ["c1", "a1"]
@@ -20,12 +20,19 @@ import json
 
 from pytest_inmanta.plugin import Project
 
+from inmanta_plugins.podman.resources.network import (
+    build_update_command,
+    changed_config_keys,
+)
+
 
 def test_model(
     project: Project,
     purged: bool = False,
     subnets: list[str] = ["172.45.0.0/24"],
     routes: list[dict] = ["10.0.0.0/24"],
+    use_api: bool = False,
+    dns: list[str] = [],
 ) -> None:
     model = f"""
         import podman
@@ -56,6 +63,8 @@ def test_model(
             options={{"isolate": "true"}},
             labels={{"test": "a"}},
             purged={json.dumps(purged)},
+            use_api={json.dumps(use_api)},
+            dns={json.dumps(dns)},
         )
 
         podman::NetworkDiscovery(
@@ -117,3 +126,68 @@ def test_deploy(project: Project) -> None:
         res.discovered_resource_id for res in result.discovered_resources
     ]
     assert network_resource_id not in discovered_resources
+
+
+def test_deploy_api(project: Project) -> None:
+    # Make sure the network is there, using the libpod api (or the cli
+    # if the podman service is not running)
+    test_model(project, purged=False, use_api=True)
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+    # Make sure the network is gone
+    test_model(project, purged=True, use_api=True)
+    assert project.dryrun_resource("podman::Network")
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+
+def test_build_update_command() -> None:
+    assert build_update_command(
+        {"name": "test-net", "network_dns_servers": ["1.1.1.1", "8.8.8.8"]},
+        {"name": "test-net", "network_dns_servers": ["8.8.8.8", "9.9.9.9"]},
+    ) == [
+        "podman",
+        "network",
+        "update",
+        "--dns-add=9.9.9.9",
+        "--dns-drop=1.1.1.1",
+        "test-net",
+    ]
+
+
+def test_update_in_place(project: Project) -> None:
+    # Make sure the network is there, with a dns server
+    test_model(project, purged=False, dns=["1.1.1.1"])
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+    # Changing the dns servers can be done on the existing network
+    test_model(project, purged=False, dns=["8.8.8.8"])
+    changes = project.dryrun_resource("podman::Network")
+    assert set(changes) == {"config"}
+    assert changed_config_keys(
+        changes["config"]["current"], changes["config"]["desired"]
+    ) == {"network_dns_servers"}
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+    # Removing all the dns servers is detected as well
+    test_model(project, purged=False)
+    changes = project.dryrun_resource("podman::Network")
+    assert changes["config"]["desired"]["network_dns_servers"] == []
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+    # Changing the subnets requires to re-create the network
+    test_model(project, purged=False, dns=["8.8.8.8"], subnets=["172.47.0.0/24"])
+    changes = project.dryrun_resource("podman::Network")
+    assert "subnets" in changed_config_keys(
+        changes["config"]["current"], changes["config"]["desired"]
+    )
+    project.deploy_resource("podman::Network")
+    assert not project.dryrun_resource("podman::Network")
+
+    # Cleanup
+    test_model(project, purged=True)
+    project.deploy_resource("podman::Network")
@@ -0,0 +1,104 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import json
+
+from pytest_inmanta.plugin import Project
+
+
+def test_model(
+    project: Project,
+    purged: bool = False,
+    containers: list[str] = ["web", "db"],
+    images: list[str] = ["docker.io/library/nginx:latest"],
+    networks: list[str] = ["app"],
+    volumes: list[str] = [],
+    objects: bool = False,
+) -> None:
+    model = f"""
+        import podman
+        import std
+        import mitogen
+
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::Purge(
+            host=host,
+            containers={json.dumps(containers)},
+            images={json.dumps(images)},
+            networks={json.dumps(networks)},
+            volumes={json.dumps(volumes)},
+            purged={json.dumps(purged)},
+        )
+
+        if {json.dumps(objects)}:
+            podman::Network(host=host, name="test-purge-net")
+            podman::NamedVolume(host=host, name="test-purge-volume")
+        end
+    """
+
+    project.compile(model, no_dedent=False)
+
+    resource = project.get_resource("podman::Purge")
+    assert resource is not None
+    assert resource.containers == containers
+    assert resource.images == images
+    assert resource.networks == networks
+    assert resource.volumes == volumes
+    assert resource.present == {}
+
+
+def test_deploy(project: Project) -> None:
+    purge = dict(
+        containers=[],
+        images=[],
+        networks=["test-purge-net"],
+        volumes=["test-purge-volume"],
+    )
+
+    # Make sure the objects to purge are there
+    test_model(project, objects=True, **purge)
+    project.deploy_resource("podman::Network")
+    project.deploy_resource("podman::NamedVolume")
+
+    # The dryrun reports the objects which still exist
+    changes = project.dryrun_resource("podman::Purge")
+    assert changes["present"]["current"] == {
+        "network": ["test-purge-net"],
+        "volume": ["test-purge-volume"],
+    }
+
+    # Purging the purge resource itself doesn't remove anything
+    test_model(project, purged=True, **purge)
+    assert not project.dryrun_resource("podman::Purge")
+    project.deploy_resource("podman::Purge")
+    test_model(project, objects=True, **purge)
+    assert not project.dryrun_resource("podman::Network")
+    assert not project.dryrun_resource("podman::NamedVolume")
+
+    # Make sure the objects are gone, the ones which don't exist are ignored
+    test_model(project, **(purge | dict(containers=["test-purge-missing"])))
+    project.deploy_resource("podman::Purge")
+    assert not project.dryrun_resource("podman::Purge")
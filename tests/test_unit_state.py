@@ -0,0 +1,298 @@
+"""
+Copyright 2026 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+import pathlib
+
+import pytest
+from pytest_inmanta.plugin import Project
+
+import inmanta_podman
+from inmanta_plugins.podman.resources.systemd import (
+    config_hash_with_image,
+    index_show_output,
+    instance_units,
+    parse_show_output,
+    unit_template,
+)
+
+
+def test_parse_show_output() -> None:
+    stdout = (
+        "Id=a.service\nLoadState=loaded\nActiveState=active\nUnitFileState=enabled\n"
+        "\n"
+        "Id=b.service\nLoadState=not-found\nActiveState=inactive\nUnitFileState=\n"
+    )
+    assert parse_show_output(stdout, ["a.service", "b"]) == {
+        "a.service": {
+            "Id": "a.service",
+            "LoadState": "loaded",
+            "ActiveState": "active",
+            "UnitFileState": "enabled",
+        },
+        "b": {
+            "Id": "b.service",
+            "LoadState": "not-found",
+            "ActiveState": "inactive",
+            "UnitFileState": "",
+        },
+    }
+
+    with pytest.raises(ValueError):
+        parse_show_output(stdout, ["a.service"])
+
+
+def test_instance_units() -> None:
+    assert instance_units("container-worker@.service", ["1", "2"]) == [
+        "container-worker@1.service",
+        "container-worker@2.service",
+    ]
+
+    assert unit_template("container-worker@1.service") == "container-worker@.service"
+    assert unit_template("container-db.service") is None
+
+
+def test_index_show_output() -> None:
+    # All the loaded units are indexed by id, and the templates by the list
+    # of their loaded instances
+    stdout = (
+        "Id=container-worker@1.service\nLoadState=loaded\nActiveState=active\n"
+        "\n"
+        "Id=container-db.service\nLoadState=loaded\nActiveState=failed\n"
+        "\n"
+        "Id=container-worker@4.service\nLoadState=loaded\nActiveState=inactive\n"
+    )
+    units = index_show_output(stdout)
+    assert units["container-db.service"]["ActiveState"] == "failed"
+    assert units["container-worker@4.service"]["ActiveState"] == "inactive"
+    assert units["container-worker@.service"]["Instances"] == [
+        "container-worker@1.service",
+        "container-worker@4.service",
+    ]
+    assert index_show_output("") == {}
+
+
+def test_config_hash(tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # The image id is only added to the config of the units using an image
+    assert config_hash_with_image(None, "sha256:abc") is None
+    assert config_hash_with_image("abc", None) == "abc"
+    assert config_hash_with_image("abc", "") != config_hash_with_image("abc", "def")
+
+    # The hashes are recorded in the runtime directory of the manager
+    monkeypatch.setattr(inmanta_podman, "_unit_config_dir", lambda user: str(tmp_path))
+    assert inmanta_podman.unit_config_hashes(True, ["a.service"]) == {"a.service": None}
+    inmanta_podman.record_unit_config_hashes(True, {"a.service": "abc"})
+    assert inmanta_podman.unit_config_hashes(True, ["a.service", "b.service"]) == {
+        "a.service": "abc",
+        "b.service": None,
+    }
+
+
+@pytest.mark.parametrize(
+    ("state", "enabled", "active_value", "enabled_value"),
+    [
+        ("running", True, True, True),
+        ("stopped", False, False, False),
+        ("configured", True, None, None),
+        ("restart", True, None, True),
+    ],
+)
+def test_model(
+    project: Project,
+    state: str,
+    enabled: bool,
+    active_value: bool | None,
+    enabled_value: bool | None,
+) -> None:
+    model = f"""
+        import podman
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        for name in ["db", "app"]:
+            podman::services::SystemdContainer(
+                container=podman::Container(
+                    host=host,
+                    name=name,
+                    image="docker.io/library/alpine:latest",
+                ),
+                state={state!r},
+                enabled={str(enabled).lower()},
+                systemd_unit_dir="/tmp/systemd/user",
+                systemctl_command=["systemctl", "--user"],
+                native_state=true,
+            )
+        end
+    """
+    project.compile(model, no_dedent=False)
+
+    units = [
+        r
+        for r in project.resources.values()
+        if r.is_type("podman::services::UnitState")
+    ]
+    assert sorted(r.name for r in units) == [
+        "container-app.service",
+        "container-db.service",
+    ]
+    for unit in units:
+        assert unit.systemctl_command == ["systemctl", "--user"]
+        assert unit.active is active_value
+        assert unit.enabled is enabled_value
+        assert unit.image == "docker.io/library/alpine:latest"
+        assert unit.restart_unit == unit.name
+        assert (unit.config_hash is not None) is (active_value is True)
+
+    # The state is not guarded anymore by is-active and is-enabled commands
+    assert not [
+        r
+        for r in project.resources.values()
+        if r.is_type("exec::Run")
+        and any(
+            "is-active" in (guard or "") or "is-enabled" in (guard or "")
+            for guard in [r.onlyif, r.unless]
+        )
+    ]
+
+
+def test_bundle(project: Project) -> None:
+    model = """
+        import podman
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        for name in ["db", "app"]:
+            podman::services::SystemdContainer(
+                container=podman::Container(
+                    host=host,
+                    name=name,
+                    image="docker.io/library/alpine:latest",
+                ),
+                state=name == "db" ? "running" : "removed",
+                on_calendar=name == "db" ? "daily" : null,
+                systemd_unit_dir="/tmp/systemd/user",
+                systemctl_command=["systemctl", "--user"],
+                bundled=true,
+            )
+        end
+    """
+    project.compile(model, no_dedent=False)
+
+    # All the services are managed by a single resource
+    assert sorted(
+        r.id.entity_type
+        for r in project.resources.values()
+        if not r.is_type("std::AgentConfig")
+    ) == ["podman::services::ServiceBundle"]
+
+    bundle = project.get_resource("podman::services::ServiceBundle")
+    assert bundle.name == "systemctl --user"
+    assert bundle.systemctl_command == ["systemctl", "--user"]
+    assert [d["path"] for d in bundle.directories] == ["/tmp/systemd/user"]
+    assert [(f["path"], f["purged"]) for f in bundle.files] == [
+        ("/tmp/systemd/user/container-app.service", True),
+        ("/tmp/systemd/user/container-db.service", False),
+        ("/tmp/systemd/user/container-db.timer", False),
+    ]
+    assert [
+        {k: v for k, v in u.items() if k != "config_hash"} for u in bundle.units
+    ] == [
+        {
+            "name": "container-app.service",
+            "active": False,
+            "enabled": False,
+            "restart": False,
+            "image": "docker.io/library/alpine:latest",
+            "restart_unit": "container-app.service",
+        },
+        {
+            "name": "container-db.timer",
+            "active": True,
+            "enabled": True,
+            "restart": False,
+            "image": "docker.io/library/alpine:latest",
+            "restart_unit": "container-db.service",
+        },
+    ]
+
+    # Only the config of the running unit is tracked
+    assert bundle.units[0]["config_hash"] is None
+    assert bundle.units[1]["config_hash"] is not None
+
+
+def test_replicas(project: Project) -> None:
+    model = """
+        import podman
+        import podman::services
+        import mitogen
+        import std
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::services::SystemdContainer(
+            container=podman::Container(
+                host=host,
+                name="worker-%i",
+                image="docker.io/library/alpine:latest",
+                env={"WORKER_ID": "%i"},
+            ),
+            state="running",
+            replicas=3,
+            systemd_unit_dir="/tmp/systemd/user",
+            systemctl_command=["systemctl", "--user"],
+            native_state=true,
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    # A single template unit is deployed for all the replicas
+    unit_file = project.get_resource(
+        "files::SystemdUnitFile", path="/tmp/systemd/user/container-worker@.service"
+    )
+    assert unit_file is not None
+    assert "--name=worker-%i" in unit_file.content
+
+    # A single resource manages the state of all the instances
+    unit = project.get_resource("podman::services::UnitState")
+    assert unit.name == "container-worker@.service"
+    assert unit.instances == ["1", "2", "3"]
+    assert unit.active is True
+    assert unit.enabled is True
@@ -0,0 +1,61 @@
+"""
+Copyright 2025 Guillaume Everarts de Velp
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Contact: edvgui@gmail.com
+"""
+
+from pytest_inmanta.plugin import Project
+
+from inmanta_plugins.podman.resources.volume import build_create_command
+
+
+def test_model(project: Project) -> None:
+    model = """
+        import podman
+        import std
+        import mitogen
+
+        host = std::Host(
+            name="localhost",
+            remote_agent=true,
+            ip="127.0.0.1",
+            os=std::linux,
+            via=mitogen::Local(),
+        )
+
+        podman::NamedVolume(
+            host=host,
+            name="test-volume",
+            labels={"test": "a"},
+            options={"o": "uid=1000"},
+        )
+    """
+    project.compile(model, no_dedent=False)
+
+    volume = project.get_resource("podman::NamedVolume")
+    assert volume.config == {
+        "Driver": "local",
+        "Labels": {"test": "a"},
+        "Options": {"o": "uid=1000"},
+    }
+    assert build_create_command(volume.name, volume.config) == [
+        "podman",
+        "volume",
+        "create",
+        "--driver=local",
+        "--opt=o=uid=1000",
+        "--label=test=a",
+        "test-volume",
+    ]